@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Aggregation (bucketing) of Sankey rows for large PDFs - see -a/--aggregate.
+#
+# Rows are added one at a time and only the N largest objects are kept as their own Sankey
+# nodes (a bounded min-heap). Every other object is folded into an "Other <type> (<size range>)"
+# bucket per category, so memory is proportional to N + the number of buckets, not the number
+# of objects. All object streams become a single "Object streams" node that the compressed
+# objects flow out of, and overhead ("xref", "trailer", ...) is summed per category.
+#
+# Bucket rows look like object rows ('type', 'size' and for streams 'compressed'/'uncompressed')
+# so the normal clustering by object type in pdflayout.py works unchanged.
+#
+
+import heapq
+
+DEFAULT_TOP_N = 20              # Default number of largest objects kept as their own nodes. See -a/--aggregate
+
+# Size histogram bucket boundaries (bytes) and labels
+SIZE_BUCKETS = [256, 4096, 65536, 1048576]
+SIZE_LABELS = ['<256 B', '256 B-4 KB', '4-64 KB', '64 KB-1 MB', '>=1 MB']
+
+OBJECT_STREAMS = 'Object streams'   # Node for all object streams and category of all compressed objects
+OVERHEAD = ['xref', 'trailer', 'startxref', '%%EOF']
+
+
+def size_label(size):
+    for i, limit in enumerate(SIZE_BUCKETS):
+        if (size < limit):
+            return SIZE_LABELS[i]
+    return SIZE_LABELS[-1]
+
+
+class Aggregator:
+
+    def __init__(self, top_n=DEFAULT_TOP_N):
+        self.top_n = top_n
+        self.heap = []          # (size, seq, row) of the largest objects so far
+        self.seq = 0            # Insertion order: heap tie-break and output order
+        self.buckets = {}       # (category, name) -> bucket row
+        self.count = 0          # Rows added
+
+    def add(self, d):
+        # Add one Sankey row (a dict as produced by the layout analysis). Rows without a size are ignored.
+        if ('size' not in d):
+            return
+        self.count = self.count + 1
+        if (d['name'] in OVERHEAD) or ('%PDF-' in d['name']):
+            self.fold(d, d['name'])
+        elif (d.get('type') == 'Object stream'):
+            self.fold(d, OBJECT_STREAMS)
+        elif (d['name'] == 'Linearized'):
+            # The node that the Linearized category flows out of - never folded
+            heapq.heappush(self.heap, (float('inf'), self.seq, d))
+            self.seq = self.seq + 1
+        else:
+            heapq.heappush(self.heap, (d['size'], self.seq, d))
+            self.seq = self.seq + 1
+            if (len(self.heap) > self.top_n):
+                _, _, smallest = heapq.heappop(self.heap)
+                self.fold_other(smallest)
+
+    def add_compressed(self, d):
+        # A compressed object from an object stream (flows out of the single "Object streams" node)
+        d['category'] = OBJECT_STREAMS
+        self.add(d)
+
+    def fold_other(self, d):
+        if ('Cavity' in d['name']):
+            kind = 'Cavity'
+        else:
+            kind = d.get('type', 'object')
+        self.fold(d, 'Other %s (%s)' % (kind, size_label(d['size'])))
+
+    def fold(self, d, name):
+        key = (d['category'], name)
+        b = self.buckets.get(key)
+        if (b is None):
+            b = { 'category': d['category'], 'name': name, 'size': 0, 'count': 0, 'seq': self.seq }
+            self.seq = self.seq + 1
+            for k in ['type', 'color']:
+                if (k in d):
+                    b[k] = d[k]
+            self.buckets[key] = b
+        b['size'] = b['size'] + d['size']
+        b['count'] = b['count'] + 1
+        if ('uncompressed' in d) and (('uncompressed_low' in d) or ('uncompressed_low' in b)):
+            # Confidence interval (--estimate): exact sizes count as both ends
+            for k in ['uncompressed_low', 'uncompressed_high']:
+                b[k] = b.get(k, b.get('uncompressed', 0)) + d.get(k, d['uncompressed'])
+        for k in ['compressed', 'uncompressed']:
+            if (k in d):
+                b[k] = b.get(k, 0) + d[k]
+        if ('estimated' in d):
+            b['estimated'] = d['estimated']
+
+    def rows(self):
+        # The kept objects and the buckets in the order they were first seen, with compressed objects
+        # last (as object stream contents are appended after the "PDF file" categories)
+        kept = [(seq, d) for _, seq, d in self.heap]
+        kept.extend((b.pop('seq'), b) for b in self.buckets.values())
+        kept.sort(key=lambda k: (k[1]['category'] == OBJECT_STREAMS, k[0]))
+        return [d for _, d in kept]
@@ -0,0 +1,283 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Benchmark harness for the sankey-pdf.py pipeline (layout analysis + Sankey CSV).
+#
+# Runs over the PDFs in this repository (Dialects/, CompactedSyntax/, Miscellaneous Targeted Test
+# PDFs/, Unicode passwords/, Inline Image Abbreviations/) or the given PDFs/directories, and with
+# --synthetic over PDFs made by pdfsynth.py at each of a list of sizes (plain, object streams,
+# linearized, incremental updates, cavities and all of them) to get scaling curves.
+#
+# Every PDF is analyzed in a fresh Python process so that peak memory is per PDF. Each result
+# record has the per-phase wall time and counters of a pdfprofile.Profile, the number of QPDF
+# subprocesses, bytes read (read() system calls, /proc/self/io "rchar": all of the file I/O with
+# --chunk-size, whereas mmap'ed pages are not counted) and the peak RSS of the process. With
+# --repeat the fastest run is kept. Results are written as one JSON document so runs of different
+# versions can be compared.
+#
+# With --burst N the PDFs are instead sent to a pdfserver.py service on a temporary Unix socket in
+# bursts of N concurrent requests (--repeat bursts), reporting the latency percentiles and HTTP
+# status counts - requests over the server's worker and queue limits get 503 rather than waiting.
+#
+# Usage: pdfbench.py [PDF or DIR ...] [--synthetic [SIZES]] [-o results.json] [-e scan] [-f] [-a [N]] [--chunk-size KB] [-t THREADS]
+#        pdfbench.py [PDF or DIR ...] --burst N [-j JOBS] [--queue N] [-n BURSTS] [-o results.json]
+#
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from pdflayout import analyze, csv_lines, ANALYZER_VERSION
+from pdfprofile import Profile
+from pdfsynth import synthetic_pdf
+from pdfaggregate import DEFAULT_TOP_N
+from pdfscan import DEFAULT_CHUNK_SIZE
+from pdfserver import request
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS_DIRS = ['Dialects', 'CompactedSyntax', 'Miscellaneous Targeted Test PDFs', 'Unicode passwords', 'Inline Image Abbreviations']
+DEFAULT_SIZES = '100,1000,10000'    # Default number of objects of the synthetic PDFs. See --synthetic
+
+
+def corpus_pdfs(paths):
+    # PDF filenames of the given files and directory trees, sorted per directory
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for f in sorted(files):
+                    if f.lower().endswith('.pdf'):
+                        yield os.path.join(root, f)
+        else:
+            yield path
+
+
+def synthetic_variants(n):
+    # (variant name, pdfsynth.synthetic_pdf() arguments) for synthetic PDFs with n objects
+    streams = max(1, n // 10)
+    return [
+        ('plain',      { 'objects': n, 'streams': streams }),
+        ('objstm',     { 'objects': n, 'streams': streams, 'object_streams': max(1, n // 100) }),
+        ('linearized', { 'objects': n, 'streams': streams, 'linearized': True }),
+        ('updates',    { 'objects': n, 'streams': streams, 'updates': max(1, n // 100) }),
+        ('cavities',   { 'objects': n, 'streams': streams, 'cavities': max(1, n // 20) }),
+        ('all',        { 'objects': n, 'streams': streams, 'object_streams': max(1, n // 100), 'linearized': True,
+                         'updates': max(1, n // 100), 'cavities': max(1, n // 20) }),
+    ]
+
+
+def read_bytes():
+    # Bytes read by read() system calls of this process so far
+    try:
+        with open('/proc/self/io', "rt") as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def worker(job):
+    # Analyze one PDF (in the benchmark's child process) and return the result record
+    record = { 'pdf': job['pdf'], 'file_size': os.path.getsize(job['pdf']), 'status': 'ok' }
+    profile = Profile()
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    io_start = read_bytes()
+    start = time.perf_counter()
+    try:
+        data = analyze(job['pdf'], force=job['force'], warn=lambda s: None, engine=job['engine'],
+                       aggregate=job['aggregate'], chunk_size=job['chunk_size'], profile=profile, threads=job['threads'])
+        profile.phase('csv')
+        record['rows'] = len(data)
+        csv = ''.join(csv_lines(data))
+        record['csv_bytes'] = len(csv)
+        if job.get('csv'):
+            # The Sankey CSV itself (see pdfgolden.py)
+            record['csv'] = csv
+        profile.stop()
+    except Exception as e:
+        profile.stop()
+        record['status'] = 'error'
+        record['error'] = '%s: %s' % (type(e).__name__, str(e).strip().splitlines()[0] if str(e).strip() else '')
+    record.update(profile.as_dict())
+    record['seconds'] = round(time.perf_counter() - start, 6)
+    record['subprocesses'] = profile.counts.get('subprocesses', 0)
+    io_end = read_bytes()
+    record['bytes_read'] = (io_end - io_start) if (io_start is not None) else None
+    record['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    record['baseline_rss'] = baseline_rss
+    return record
+
+
+def run_pdf(pdf, options, repeat):
+    # Run the worker in a fresh process repeat times, keep the fastest run
+    job = dict(options, pdf=pdf)
+    best = None
+    runs = []
+    for _ in range(repeat):
+        p = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', json.dumps(job)], capture_output=True, text=True)
+        try:
+            record = json.loads(p.stdout.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            record = { 'pdf': pdf, 'status': 'error', 'error': 'benchmark worker failed: %s' % p.stderr.strip()[-200:] }
+        runs.append(record.get('seconds'))
+        if (best is None) or ((record.get('seconds') is not None) and (record['seconds'] < best.get('seconds', float('inf')))):
+            best = record
+    if (repeat > 1):
+        best['runs'] = runs
+    return best
+
+
+def percentile(values, p):
+    # Nearest-rank percentile p (0-100) of a non-empty list
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100.0 * len(values)) - 1)]
+
+
+def latency_summary(latencies):
+    if (len(latencies) == 0):
+        return None
+    return { 'count': len(latencies), 'p50': round(percentile(latencies, 50), 6), 'p90': round(percentile(latencies, 90), 6),
+             'p99': round(percentile(latencies, 99), 6), 'max': round(max(latencies), 6) }
+
+
+async def timed_request(address, target, body):
+    start = time.perf_counter()
+    try:
+        status, _, _ = await request(address, 'POST', target, body)
+    except OSError:
+        status = 0          # connection refused or reset
+    return (status, time.perf_counter() - start)
+
+
+async def bursts(address, target, bodies, n, repeat):
+    # repeat bursts of n concurrent requests (cycling through the PDF bodies). Returns a record per burst.
+    records = []
+    for r in range(repeat):
+        start = time.perf_counter()
+        results = await asyncio.gather(*[timed_request(address, target, bodies[i % len(bodies)]) for i in range(n)])
+        statuses = {}
+        for status, _ in results:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        records.append({ 'burst': r + 1, 'requests': n, 'seconds': round(time.perf_counter() - start, 6), 'status': statuses,
+                         'latency': latency_summary([t for _, t in results]),
+                         'latency_ok': latency_summary([t for status, t in results if (status == 200)]) })
+    return records
+
+
+def run_burst(pdfs, n, repeat, jobs, queue, options):
+    # Start pdfserver.py on a temporary Unix socket and send it bursts of the PDFs
+    tmpdir = tempfile.mkdtemp(prefix='pdfbench-')
+    sock = os.path.join(tmpdir, 'server.sock')
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pdfserver.py'), '--unix', sock, '-j', str(jobs)]
+    if (queue is not None):
+        cmd = cmd + ['--queue', str(queue)]
+    server = subprocess.Popen(cmd, stderr=subprocess.PIPE, text=True)
+    try:
+        ready = server.stderr.readline()
+        if not ready.startswith('Listening'):
+            raise RuntimeError('pdfserver.py did not start: ' + ready + server.stderr.read())
+        bodies = []
+        for pdf in pdfs:
+            with open(pdf, "rb") as f:
+                bodies.append(f.read())
+        target = '/analyze?engine=%s&force=%d' % (options['engine'], options['force'])
+        if (options['aggregate'] is not None):
+            target = target + '&aggregate=%d' % options['aggregate']
+        return { 'pdfs': len(pdfs), 'jobs': jobs, 'queue': queue, 'bursts': asyncio.run(bursts('unix:' + sock, target, bodies, n, repeat)) }
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the sankey-pdf.py pipeline. Writes per-PDF timings, counters and peak memory as JSON.')
+    parser.add_argument('paths', help='PDFs or directory trees of PDFs (default: the PDFs in this repository unless --synthetic)', nargs='*')
+    parser.add_argument('-o', '--output', help='JSON output filename (default: stdout)', default='-')
+    parser.add_argument('-s', '--synthetic', help='Also benchmark synthetic PDFs with each number of objects in the comma separated SIZES (default: %s)' % DEFAULT_SIZES, nargs='?', const=DEFAULT_SIZES, metavar='SIZES')
+    parser.add_argument('--keep-synthetic', help='Write the synthetic PDFs into this directory (default: a temporary directory that is removed)', dest='keep_synthetic')
+    parser.add_argument('-n', '--repeat', help='Runs per PDF, the fastest is kept (default: 1)', type=int, default=1)
+    parser.add_argument('-e', '--engine', help="As sankey-pdf.py -e/--engine", choices=['xref', 'scan'], default='xref')
+    parser.add_argument('-f', '--force', help='As sankey-pdf.py -f/--force (needed for most synthetic PDFs unless -a/--aggregate)', action='store_true', default=False)
+    parser.add_argument('-a', '--aggregate', help='As sankey-pdf.py -a/--aggregate', nargs='?', type=int, const=DEFAULT_TOP_N, metavar='N')
+    parser.add_argument('--chunk-size', help='As sankey-pdf.py --chunk-size', nargs='?', type=int, const=DEFAULT_CHUNK_SIZE // 1024, metavar='KB', dest='chunk_size')
+    parser.add_argument('--burst', help='Send the PDFs to a local pdfserver.py in bursts of N concurrent requests (--repeat bursts) and report latency percentiles', type=int, metavar='N')
+    parser.add_argument('-j', '--jobs', help='--burst: server worker processes (default: number of CPUs)', type=int, default=os.cpu_count())
+    parser.add_argument('--queue', help='--burst: server queue limit (default: as pdfserver.py)', type=int)
+    parser.add_argument('-t', '--threads', help='As sankey-pdf.py -t/--threads (default: 1)', type=int, default=1)
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if (args.worker is not None):
+        print(json.dumps(worker(json.loads(args.worker))))
+        return
+
+    options = { 'engine': args.engine, 'force': args.force, 'aggregate': args.aggregate, 'threads': args.threads,
+                'chunk_size': (args.chunk_size * 1024) if (args.chunk_size is not None) else None }
+    paths = args.paths
+    if (len(paths) == 0) and (args.synthetic is None):
+        paths = [os.path.join(REPO_DIR, d) for d in CORPUS_DIRS]
+    if (args.burst is not None):
+        report = { 'analyzer_version': ANALYZER_VERSION, 'python': platform.python_version(), 'platform': platform.platform(),
+                   'options': options, 'server': run_burst(list(corpus_pdfs(paths)), args.burst, args.repeat, args.jobs, args.queue, options) }
+        write_report(report, args.output)
+        return
+    results = []
+    for pdf in corpus_pdfs(paths):
+        results.append(run_pdf(pdf, options, args.repeat))
+        print('%s: %s' % (pdf, results[-1]['status']), file=sys.stderr)
+
+    if (args.synthetic is not None):
+        tmpdir = args.keep_synthetic or tempfile.mkdtemp(prefix='pdfbench-')
+        os.makedirs(tmpdir, exist_ok=True)
+        try:
+            for n in [int(s) for s in args.synthetic.split(',')]:
+                for variant, kwargs in synthetic_variants(n):
+                    pdf = os.path.join(tmpdir, 'synthetic-%s-%d.pdf' % (variant, n))
+                    with open(pdf, "wb") as f:
+                        f.write(synthetic_pdf(**kwargs))
+                    record = run_pdf(pdf, options, args.repeat)
+                    record['synthetic'] = dict(kwargs, variant=variant)
+                    results.append(record)
+                    print('%s: %s' % (pdf, record['status']), file=sys.stderr)
+        finally:
+            if (args.keep_synthetic is None):
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+    report = { 'analyzer_version': ANALYZER_VERSION, 'python': platform.python_version(), 'platform': platform.platform(),
+               'options': options, 'results': results }
+    write_report(report, args.output)
+
+
+def write_report(report, output):
+    out = sys.stdout if (output == '-') else open(output, "wt")
+    json.dump(report, out, indent=1)
+    out.write('\n')
+    if (out is not sys.stdout):
+        out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Per-file resource budgets of a layout analysis, so that a hostile PDF (decompression bombs,
+# millions of markers, QPDF hanging on a broken stream) cannot exhaust memory or time.
+#
+# - time: wall time of the analysis (--timeout). Streams not decoded by then are estimated.
+# - stream bytes: decoded bytes of any one stream (--max-stream-mb). Decoding stops there.
+# - decoded bytes: decoded bytes of all streams together (--max-decoded-mb).
+# - markers: markers kept (--max-markers). The rest of the file is not analyzed.
+#
+# Hitting a budget never aborts the analysis: the object is marked as estimated (with the name of
+# the budget) in the Sankey data and the analysis goes on. Decoded sizes of estimated streams are
+# lower bounds (the bytes decoded until the budget ran out, at least the compressed size).
+# Streams are decoded bounded and incrementally (in-process decoders and QPDF output alike, and the
+# XRef streams of the cross-reference walk, see pdfxref.py), so memory stays bounded by the budgets
+# rather than by what a stream claims to decode to.
+#
+
+import threading
+import time
+
+DEFAULT_STREAM_BYTES = 256 * 1024 * 1024        # Default stream bytes budget (bytes). See --max-stream-mb
+DEFAULT_TOTAL_BYTES = 4 * 1024 * 1024 * 1024    # Default decoded bytes budget (bytes). See --max-decoded-mb
+DEFAULT_MARKERS = 5000000                       # Default markers budget. See --max-markers
+
+# Budget names (as in the 'estimated' entry of Sankey data dicts)
+TIME = 'time'
+STREAM_BYTES = 'stream bytes'
+TOTAL_BYTES = 'decoded bytes'
+MARKERS = 'markers'
+
+
+class Budget:
+    # None for any budget means unlimited. Shared by the stream decoding threads.
+
+    def __init__(self, seconds=None, total_bytes=DEFAULT_TOTAL_BYTES, stream_bytes=DEFAULT_STREAM_BYTES, markers=DEFAULT_MARKERS):
+        self.seconds = seconds
+        self.total_bytes = total_bytes
+        self.stream_bytes = stream_bytes
+        self.markers = markers
+        self.deadline = None        # time.monotonic() when the time budget runs out
+        self.decoded = 0            # decoded bytes so far
+        self.hits = {}              # budget name -> number of objects estimated because of it
+        self.lock = threading.Lock()
+
+    def start(self):
+        # Start the clock (only the first call counts)
+        if (self.seconds is not None) and (self.deadline is None):
+            self.deadline = time.monotonic() + self.seconds
+
+    def expired(self):
+        return (self.deadline is not None) and (time.monotonic() >= self.deadline)
+
+    def time_left(self):
+        # Seconds left or None if there is no time budget
+        if (self.deadline is None):
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def stream_limit(self):
+        # (decoded bytes the next stream may have or None, name of the budget that sets the limit)
+        with self.lock:
+            left = None if (self.total_bytes is None) else max(0, self.total_bytes - self.decoded)
+        if (left is not None) and ((self.stream_bytes is None) or (left < self.stream_bytes)):
+            return (left, TOTAL_BYTES)
+        return (self.stream_bytes, STREAM_BYTES)
+
+    def spend(self, n):
+        with self.lock:
+            self.decoded = self.decoded + n
+
+    def hit(self, name):
+        with self.lock:
+            self.hits[name] = self.hits.get(name, 0) + 1
+
+    def summary(self):
+        # e.g. "time (3), stream bytes (1)" or '' if no budget was hit
+        return ', '.join('%s (%d)' % (name, n) for name, n in self.hits.items())
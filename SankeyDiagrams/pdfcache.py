@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Content-addressed on-disk cache of sankey-pdf.py results so re-analyzing the same PDF bytes
+# (dedup pipelines, re-ingests) skips all scanning and decompression.
+#
+# Cache keys are a SHA-256 of the PDF file contents + ANALYZER_VERSION + the options that change
+# the result (see LayoutOptions.cache_options(): -f/--force, -k/--keep, --engine, -a/--aggregate,
+# the --max-stream-mb/--max-decoded-mb/--max-markers budgets, --estimate and a salted hash of
+# --password, never the password itself). Each entry is one JSON file holding the final `data`
+# list and the generated Sankey CSV. Entries are written atomically (temp file + rename) so the
+# cache can be shared by concurrent --batch workers. An entry's mtime is its last use: once the
+# total size goes over the cap, the least recently used entries are evicted under an exclusive lock.
+#
+# The same cache also holds the revision entries of incremental re-analysis (see pdfrevision.py),
+# stored with get_json()/put_json() and evicted like any other entry.
+#
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+
+HASH_BLOCK_SIZE = 1024 * 1024       # File contents are hashed in blocks of this many bytes
+DEFAULT_CACHE_SIZE = 1024           # Default cache size cap (MB). See --cache-size
+EVICT_TO = 0.9                      # Evict down to this fraction of the cap so eviction does not run on every put
+
+
+def file_hash(pdf):
+    h = hashlib.sha256()
+    with open(pdf, "rb") as f:
+        while True:
+            b = f.read(HASH_BLOCK_SIZE)
+            if (len(b) == 0):
+                break
+            h.update(b)
+    return h.hexdigest()
+
+
+class ResultCache:
+
+    def __init__(self, cachedir, max_bytes=DEFAULT_CACHE_SIZE * 1024 * 1024):
+        self.cachedir = cachedir
+        self.max_bytes = max_bytes
+        os.makedirs(cachedir, exist_ok=True)
+
+    def key(self, content_hash, version, options):
+        # options is a dict of the analysis options that change the result
+        s = '%s:%s:' % (content_hash, version) + ':'.join('%s=%s' % (k, options[k]) for k in sorted(options))
+        return hashlib.sha256(s.encode('ascii')).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cachedir, key[:2], key + '.json')
+
+    def get_json(self, key):
+        # The JSON object of an entry or None. A missing, half-evicted or corrupt entry is just a miss.
+        path = self.entry_path(key)
+        try:
+            with open(path, "rt") as f:
+                entry = json.load(f)
+            os.utime(path)          # mark as most recently used
+        except (OSError, ValueError):
+            return None
+        return entry if isinstance(entry, dict) else None
+
+    def get(self, key):
+        # Returns (data, csv text) or None
+        entry = self.get_json(key)
+        if (entry is None) or ('data' not in entry) or ('csv' not in entry):
+            return None
+        return (entry['data'], entry['csv'])
+
+    def put(self, key, data, csv):
+        self.put_json(key, { 'data': data, 'csv': csv })
+
+    def put_json(self, key, entry):
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, "wt") as f:
+                json.dump(entry, f)
+            size = os.path.getsize(tmp)
+            with self.locked():
+                # The size of an entry that is overwritten is read under the same lock as the
+                # total, so concurrent writers of the same key do not both subtract it
+                try:
+                    old_size = os.path.getsize(path)
+                except OSError:
+                    old_size = 0
+                os.replace(tmp, path)
+                self.account(size - old_size)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    @contextlib.contextmanager
+    def locked(self):
+        # Exclusive lock of the cache (between processes)
+        with open(os.path.join(self.cachedir, '.lock'), "a+") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def account(self, added):
+        # Keep a running total of the cache size in a small file (called under locked()) and only
+        # scan and evict once the total goes over the cap
+        usage_file = os.path.join(self.cachedir, '.usage')
+        try:
+            with open(usage_file, "rt") as f:
+                usage = int(f.read().strip() or 0) + added
+        except (OSError, ValueError):
+            usage = self.scan_usage()
+        if (usage > self.max_bytes):
+            usage = self.evict()
+        with open(usage_file, "wt") as f:
+            f.write(str(usage))
+
+    def entries(self):
+        # (mtime, size, path) of every cache entry
+        result = []
+        for sub in os.scandir(self.cachedir):
+            if not sub.is_dir():
+                continue
+            for e in os.scandir(sub.path):
+                if e.name.endswith('.json'):
+                    try:
+                        st = e.stat()
+                    except OSError:
+                        continue
+                    result.append((st.st_mtime, st.st_size, e.path))
+        return result
+
+    def scan_usage(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        # Delete least recently used entries until under EVICT_TO x the cap. Returns the new total.
+        entries = sorted(self.entries())
+        usage = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if (usage <= self.max_bytes * EVICT_TO):
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            usage = usage - size
+        return usage
@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Cavity and overlap detection over the byte ranges that the layout analysis accounts for.
+#
+# An IntervalIndex collects byte ranges [start, end), each claimed by an owner (an int such as a
+# marker index or an object number), in three typed arrays. sweep() sorts the ranges by start once
+# (O(n log n)) and walks them with a heap of the ends of the ranges still open, so it finds in the
+# same pass:
+#
+# - gaps: bytes that no range claims (cavities), with the owner of the range that follows the gap
+# - overlaps: bytes that more than one range claims, with the owners claiming them
+# - multiply-claimed bytes: the bytes claimed once too often (a byte claimed 3 times counts twice)
+#
+# pdflayout.py builds one index at the file level (objects, keywords, cross-reference tables, ...)
+# and one per decoded object stream (its offset table and members). Gaps become the red
+# "Cavity N" Sankey nodes, overlaps are reported as warnings.
+#
+
+import heapq
+from array import array
+
+
+class Coverage:
+
+    def __init__(self):
+        self.gaps = []              # (start, end, owner of the next range or None)
+        self.overlaps = []          # (start, end, owners)
+        self.gap_bytes = 0
+        self.overlap_bytes = 0      # bytes claimed more than once
+        self.extra_bytes = 0        # sum of (claims - 1) over the bytes claimed more than once
+
+    def add_overlap(self, start, end, owners):
+        # Adjacent segments claimed by the same owners are one overlap
+        if (len(self.overlaps) > 0) and (self.overlaps[-1][1] == start) and (self.overlaps[-1][2] == owners):
+            self.overlaps[-1] = (self.overlaps[-1][0], end, owners)
+        else:
+            self.overlaps.append((start, end, owners))
+        self.overlap_bytes = self.overlap_bytes + (end - start)
+        self.extra_bytes = self.extra_bytes + (end - start) * (len(owners) - 1)
+
+
+class IntervalIndex:
+
+    def __init__(self):
+        self.start = array('q')
+        self.end = array('q')
+        self.owner = array('q')
+
+    def __len__(self):
+        return len(self.start)
+
+    def add(self, start, end, owner):
+        # Empty ranges claim nothing
+        if (end > start):
+            self.start.append(start)
+            self.end.append(end)
+            self.owner.append(owner)
+
+    def sweep(self, lo=None, hi=None):
+        # Coverage of [lo, hi) - by default from the first start to the last end, i.e. only gaps
+        # between ranges. Ranges that touch (one ends where the next starts) do not overlap.
+        coverage = Coverage()
+        if (len(self) == 0):
+            if (lo is not None) and (hi is not None) and (hi > lo):
+                coverage.gaps.append((lo, hi, None))
+                coverage.gap_bytes = hi - lo
+            return coverage
+        start = self.start
+        end = self.end
+        owner = self.owner
+        order = sorted(range(len(self)), key=start.__getitem__)
+        covered = start[order[0]] if (lo is None) else min(lo, start[order[0]])   # end of the claimed bytes so far
+        last = order[0]     # the open range while ranges do not overlap
+        active = []         # heap of (end, owner) of the open ranges while they overlap
+        pos = covered       # where the set of open ranges last changed (while they overlap)
+        for j in order:
+            s = start[j]
+            if (s >= covered):
+                # Every open range has ended (the common case)
+                if (len(active) > 0):
+                    self.close(coverage, active, pos, covered)
+                    active = []
+                if (s > covered):
+                    coverage.gaps.append((covered, s, owner[j]))
+                    coverage.gap_bytes = coverage.gap_bytes + (s - covered)
+                last = j
+                covered = end[j]
+            else:
+                if (len(active) == 0):
+                    active = [(end[last], owner[last])]
+                    pos = start[last]
+                pos = max(self.close(coverage, active, pos, s), s)
+                heapq.heappush(active, (end[j], owner[j]))
+                if (end[j] > covered):
+                    covered = end[j]
+        if (len(active) > 0):
+            self.close(coverage, active, pos, covered)
+        if (hi is not None) and (hi > covered):
+            coverage.gaps.append((covered, hi, None))
+            coverage.gap_bytes = coverage.gap_bytes + (hi - covered)
+        return coverage
+
+    def close(self, coverage, active, pos, to):
+        # Close the open ranges that end at or before to, recording the bytes from pos on that
+        # more than one range claimed. Returns the new pos.
+        while (len(active) > 0) and (active[0][0] <= to):
+            e = active[0][0]
+            if (len(active) > 1) and (e > pos):
+                coverage.add_overlap(pos, e, tuple(sorted(o for _, o in active)))
+            pos = max(pos, e)
+            heapq.heappop(active)
+        if (len(active) > 1) and (to > pos):
+            coverage.add_overlap(pos, to, tuple(sorted(o for _, o in active)))
+            pos = to
+        return pos
+
+
+def packed_ends(starts, stop):
+    # End of each of the ranges starting at starts when every range runs up to the next larger
+    # start (or stop) - e.g. the members of an object stream, sized from its offset table. Ranges
+    # with the same start get the same end (and so overlap).
+    ends = [stop] * len(starts)
+    order = sorted(range(len(starts)), key=starts.__getitem__)
+    nxt = stop
+    previous = None
+    for j in reversed(order):
+        if (previous is not None) and (starts[j] < previous):
+            nxt = min(previous, stop)
+        ends[j] = max(starts[j], nxt)
+        previous = starts[j]
+    return ends
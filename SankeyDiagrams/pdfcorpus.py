@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Corpus-level Sankey diagram: what fraction of all the bytes of a corpus of PDFs are dictionaries,
+# stream data, cavities, cross-reference overhead, incremental updates, ...
+#
+# Map: the Sankey data of each PDF (see pdflayout.analyze()) is summarized into a CorpusTotals of
+# the bytes (and rows) per section of the file (original revision, linearization, incremental
+# updates) and kind of node (the per-PDF sums of dictionaries, stream dicts, compressed and
+# uncompressed stream data, cavities and overhead that the layout analysis clusters at its end).
+# Reduce: CorpusTotals are added up. Addition is associative and commutative, so totals can be
+# merged in any order - per batch worker process, per run (sankey-pdf.py -b DIR --corpus FILE adds
+# to an existing partial-aggregate file) and across machines (this script merges partial-aggregate
+# files). Memory is proportional to the number of node types, not the number of PDFs.
+#
+# Partial-aggregate files do not know which PDFs they hold: adding the same PDF twice counts it
+# twice. The manifest of sankey-pdf.py --rescan (see pdfmanifest.py) keeps the totals of each PDF,
+# so it can take a changed PDF out of its corpus totals before adding it again.
+#
+# Usage: pdfcorpus.py PARTIAL.json [PARTIAL.json ...] [-o merged.json] [-c corpus.csv]
+#
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from pdflayout import csv_lines
+
+CORPUS_FORMAT = 1           # Version of the partial-aggregate file format
+
+# Sections of a PDF file
+ORIGINAL = 'Original revisions'
+LINEARIZATION = 'Linearization'
+UPDATES = 'Incremental updates'
+SECTION_COLORS = { ORIGINAL: 'lightblue', LINEARIZATION: 'MediumPurple', UPDATES: 'PaleGreen' }
+
+# Kinds of nodes (and their colors in the per-PDF Sankey diagrams)
+KIND_COLORS = { 'Header': 'lightblue', 'Dictionaries': 'wheat', 'Arrays': 'lightcyan', 'Numbers': None, 'Strings': None,
+                'Names': None, 'Other objects': None, 'Stream dicts': 'wheat', 'Stream data': 'MistyRose',
+                'Cross-reference': 'lightblue', 'Cavities': 'red' }
+OVERHEAD = ['xref', 'trailer', 'startxref', '%%EOF']
+
+
+def row_section(d):
+    # Section of a Sankey data dict that is a top level node of its PDF, or None
+    category = d['category']
+    if (category == 'PDF file'):
+        return ORIGINAL if (d['name'] != 'Linearized') else None     # The Linearized node is the sum of its section
+    if (category == 'Linearized'):
+        return LINEARIZATION
+    if category.startswith('Incremental Update '):
+        return UPDATES
+    return None
+
+
+def object_kind(t):
+    if ('dict' in t):
+        return 'Dictionaries'
+    if ('array' in t):
+        return 'Arrays'
+    if ('number' in t):
+        return 'Numbers'
+    if ('string' in t):
+        return 'Strings'
+    if (t == 'name'):
+        return 'Names'
+    return 'Other objects'
+
+
+class CorpusTotals:
+
+    def __init__(self):
+        self.files = 0              # PDFs analyzed
+        self.errors = 0             # PDFs that could not be analyzed (not in the sizes)
+        self.file_bytes = 0         # Bytes of the PDFs analyzed
+        self.sizes = {}             # section -> kind -> bytes
+        self.counts = {}            # section -> kind -> Sankey rows (objects, cavities, ...)
+        self.uncompressed = 0       # Decoded bytes of the stream data (not of cross-reference streams)
+        self.estimated = 0          # Streams with an estimated decoded size
+        self.updates = 0            # Incremental updates
+        self.linearized = 0         # Linearized PDFs
+
+    def add(self, section, kind, size, count=1):
+        sizes = self.sizes.setdefault(section, {})
+        sizes[kind] = sizes.get(kind, 0) + size
+        counts = self.counts.setdefault(section, {})
+        counts[kind] = counts.get(kind, 0) + count
+
+    def add_layout(self, data, file_size):
+        # Map: add the Sankey data of one PDF of file_size bytes
+        self.files = self.files + 1
+        self.file_bytes = self.file_bytes + file_size
+        updates = 0
+        linearized = 0
+        for d in data:
+            if ('size' not in d):
+                continue
+            section = row_section(d)
+            if (section is None):
+                continue
+            if (section == UPDATES):
+                updates = max(updates, int(d['category'][len('Incremental Update '):]))
+            elif (section == LINEARIZATION):
+                linearized = 1
+            name = d['name']
+            count = d.get('count', 1)       # -a/--aggregate buckets hold several rows
+            t = d.get('type')
+            if ('%PDF-' in name):
+                self.add(section, 'Header', d['size'], count)
+            elif (name in OVERHEAD) or (t == 'XRef stream'):
+                self.add(section, 'Cross-reference', d['size'], count)
+            elif ('Cavity' in name):
+                self.add(section, 'Cavities', d['size'], count)
+            elif (t is not None) and ('stream' in t) and ('compressed' in d) and ('uncompressed' in d):
+                self.add(section, 'Stream dicts', max(0, d['size'] - d['compressed']), count)
+                self.add(section, 'Stream data', d['compressed'], count)
+                self.uncompressed = self.uncompressed + d['uncompressed']
+                if ('estimated' in d):
+                    self.estimated = self.estimated + count
+            else:
+                self.add(section, object_kind(t or ''), d['size'], count)
+        self.updates = self.updates + updates
+        self.linearized = self.linearized + linearized
+
+    def add_error(self):
+        self.errors = self.errors + 1
+
+    def merge(self, other, sign=1):
+        # Reduce: add another CorpusTotals to this one (sign -1: take it out again, see pdfmanifest.py)
+        for k in ['files', 'errors', 'file_bytes', 'uncompressed', 'estimated', 'updates', 'linearized']:
+            setattr(self, k, getattr(self, k) + sign * getattr(other, k))
+        for section, sizes in other.sizes.items():
+            for kind, size in sizes.items():
+                self.add(section, kind, sign * size, sign * other.counts[section][kind])
+                if (self.counts[section][kind] == 0):
+                    del self.sizes[section][kind]
+                    del self.counts[section][kind]
+            if (len(self.counts.get(section, {})) == 0):
+                self.sizes.pop(section, None)
+                self.counts.pop(section, None)
+        return self
+
+    def kind_total(self, kind, counts=False):
+        # Bytes (or rows) of a kind of node in all sections
+        return sum(v.get(kind, 0) for v in (self.counts if counts else self.sizes).values())
+
+    def accounted(self):
+        return sum(sum(sizes.values()) for sizes in self.sizes.values())
+
+    def rows(self):
+        # Sankey data dicts of the corpus: Corpus -> section -> kind, and the stream data decoded
+        data = []
+        for section in [ORIGINAL, LINEARIZATION, UPDATES]:
+            if (section in self.sizes):
+                data.append({ 'category': 'Corpus', 'name': section, 'size': sum(self.sizes[section].values()), 'color': SECTION_COLORS[section] })
+        unaccounted = self.file_bytes - self.accounted()
+        if (unaccounted > 0):
+            data.append({ 'category': 'Corpus', 'name': 'Unaccounted', 'size': unaccounted, 'color': 'red' })
+        for section in [ORIGINAL, LINEARIZATION, UPDATES]:
+            for kind, color in KIND_COLORS.items():
+                size = self.sizes.get(section, {}).get(kind, 0)
+                if (size > 0):
+                    data.append({ 'category': section, 'name': kind, 'size': size })
+                    if (color is not None):
+                        data[-1]['color'] = color
+        if (self.uncompressed > 0):
+            name = 'Uncompressed stream data (estimated)' if (self.estimated > 0) else 'Uncompressed stream data'
+            data.append({ 'category': 'Stream data', 'name': name, 'size': self.uncompressed, 'color': 'MistyRose' })
+        return data
+
+    def as_dict(self):
+        return { 'corpus': CORPUS_FORMAT, 'files': self.files, 'errors': self.errors, 'file_bytes': self.file_bytes,
+                 'sizes': self.sizes, 'counts': self.counts, 'uncompressed': self.uncompressed, 'estimated': self.estimated,
+                 'updates': self.updates, 'linearized': self.linearized }
+
+    @classmethod
+    def from_dict(cls, v):
+        if (v.get('corpus') != CORPUS_FORMAT):
+            raise ValueError('not a partial-aggregate (format %d) of corpus totals' % CORPUS_FORMAT)
+        totals = cls()
+        for k in ['files', 'errors', 'file_bytes', 'sizes', 'counts', 'uncompressed', 'estimated']:
+            setattr(totals, k, v[k])
+        totals.updates = v.get('updates', 0)
+        totals.linearized = v.get('linearized', 0)
+        return totals
+
+
+def load_totals(path):
+    # The CorpusTotals of a partial-aggregate file (empty if the file does not exist yet)
+    if not os.path.exists(path):
+        return CorpusTotals()
+    with open(path, "rt") as f:
+        return CorpusTotals.from_dict(json.load(f))
+
+
+def save_totals(totals, path):
+    # Written atomically (temp file + rename) so an interrupted run leaves the previous totals
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, "wt") as f:
+            json.dump(totals.as_dict(), f, indent=1)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge partial-aggregate files of corpus totals (see sankey-pdf.py --corpus) and write the corpus Sankey CSV.')
+    parser.add_argument('partials', help='Partial-aggregate JSON files', nargs='+')
+    parser.add_argument('-o', '--output', help='Write the merged partial-aggregate file')
+    parser.add_argument('-c', '--csv', help='Corpus Sankey CSV filename (default: stdout unless -o)', dest='csvfile')
+    args = parser.parse_args()
+
+    totals = CorpusTotals()
+    for path in args.partials:
+        with open(path, "rt") as f:
+            totals.merge(CorpusTotals.from_dict(json.load(f)))
+    if (args.output is not None):
+        save_totals(totals, args.output)
+    if (args.csvfile is not None) or (args.output is None):
+        out = sys.stdout if (args.csvfile in [None, '-']) else open(args.csvfile, "wt")
+        out.writelines(csv_lines(totals.rows()))
+        if (out is not sys.stdout):
+            out.close()
+    print('%d PDFs (%d bytes), %d errors' % (totals.files, totals.file_bytes, totals.errors), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
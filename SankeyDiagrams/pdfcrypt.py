@@ -0,0 +1,569 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# In-process decryption of PDFs encrypted with the standard security handler, so that the streams
+# (and object streams) of encrypted PDFs are decoded by pdfdecode.py like any other stream instead
+# of by a QPDF subprocess per stream.
+#
+# Supported: /V 1, 2 and 4 (RC4 40-128 bit and AES-128, revisions 2-4) and /V 5 (AES-256,
+# revision 5 and revision 6 of PDF 2.0). Revision 6 passwords are Unicode: they are prepared with
+# the SASLprep profile of stringprep (RFC 4013) using Unicode 3.2 normalization, then UTF-8 encoded.
+# A PDF is opened with the user or the owner password (the empty user password by default, see
+# --password). The /Encrypt dictionary and /ID are found via the trailers or XRef stream
+# dictionaries of the markers (see find_encrypt()).
+#
+# The file key is computed once per PDF and the key of each object once (then cached), only the
+# /Encrypt dictionary is parsed. Stream data is decrypted on the fly as a generator of chunks in
+# front of the filters (see pdfdecode.decode_chunks()): nothing decrypted is ever written out.
+# AES is implemented here (table driven) as the Python standard library has no AES: decrypting is
+# slower than inflating, but still much faster than a subprocess per stream.
+#
+# NO_CRYPT (unencrypted PDFs) decrypts nothing, like NO_PROFILE it is a no-op stand-in.
+#
+
+import hashlib
+import stringprep
+import struct
+import threading
+import unicodedata
+from bisect import bisect_left, bisect_right
+
+from pdfdecode import Lexer, Name, Ref, parse_object, parse_object_dict, PDFSyntaxError, UnsupportedFilter
+
+# Padding string of revision 2-4 passwords (Algorithm 2)
+PASSWORD_PADDING = bytes.fromhex('28BF4E5E4E758A4164004E56FFFA01082E2E00B6D0683E802F0CA9FE6453697A')
+MAX_PASSWORD_BYTES = 127    # Revision 5 and 6 passwords are truncated to this many UTF-8 bytes
+AES_BLOCK = 16
+PASSWORD_KEY_SALT = b'sankey-pdf password'  # Salt of password_key()
+PASSWORD_KEY_ROUNDS = 10000                 # PBKDF2 iterations of password_key()
+
+# Crypt filter method (/CFM) -> cipher (None: not encrypted)
+CRYPT_METHODS = { 'None': None, 'V2': 'RC4', 'AESV2': 'AESV2', 'AESV3': 'AESV3' }
+
+
+class PasswordError(Exception):
+    # The password is neither the user nor the owner password of the PDF
+    pass
+
+
+class UnsupportedEncryption(Exception):
+    # Not the standard security handler, or a version or revision that is not supported
+    pass
+
+
+# --- RC4 ---
+
+class RC4:
+    # RC4 stream cipher: crypt() continues the key stream, so a stream can be decrypted chunk by chunk
+
+    def __init__(self, key):
+        s = list(range(256))
+        j = 0
+        for i in range(256):
+            j = (j + s[i] + key[i % len(key)]) & 0xFF
+            s[i], s[j] = s[j], s[i]
+        self.s = s
+        self.i = 0
+        self.j = 0
+
+    def crypt(self, data):
+        s = self.s
+        i = self.i
+        j = self.j
+        out = bytearray(len(data))
+        for k, c in enumerate(data):
+            i = (i + 1) & 0xFF
+            si = s[i]
+            j = (j + si) & 0xFF
+            sj = s[j]
+            s[i] = sj
+            s[j] = si
+            out[k] = c ^ s[(si + sj) & 0xFF]
+        self.i = i
+        self.j = j
+        return bytes(out)
+
+
+def rc4(key, data):
+    return RC4(key).crypt(data)
+
+
+# --- AES (FIPS-197) ---
+
+def xtime(a):
+    a = a << 1
+    return (a ^ 0x11B) if (a & 0x100) else a
+
+
+def aes_tables():
+    # S-box, inverse S-box and the round tables (Te: SubBytes + MixColumns, Td: InvSubBytes + InvMixColumns)
+    exp = [0] * 255
+    log = [0] * 256
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x = x ^ xtime(x)            # times 3, a generator of GF(2^8)
+
+    def mul(a, b):
+        return 0 if (a == 0) or (b == 0) else exp[(log[a] + log[b]) % 255]
+
+    sbox = [0] * 256
+    inv_sbox = [0] * 256
+    for i in range(256):
+        s = r = 0 if (i == 0) else exp[(255 - log[i]) % 255]
+        for _ in range(4):
+            r = ((r << 1) | (r >> 7)) & 0xFF
+            s = s ^ r
+        s = s ^ 0x63
+        sbox[i] = s
+        inv_sbox[s] = i
+    te = [[], [], [], []]
+    td = [[], [], [], []]
+    for i in range(256):
+        s = sbox[i]
+        w = (mul(s, 2) << 24) | (s << 16) | (s << 8) | mul(s, 3)
+        s = inv_sbox[i]
+        v = (mul(s, 14) << 24) | (mul(s, 9) << 16) | (mul(s, 13) << 8) | mul(s, 11)
+        for k in range(4):
+            te[k].append(w)
+            td[k].append(v)
+            w = ((w >> 8) | (w << 24)) & 0xFFFFFFFF
+            v = ((v >> 8) | (v << 24)) & 0xFFFFFFFF
+    return (sbox, inv_sbox, te, td)
+
+
+SBOX, INV_SBOX, TE, TD = aes_tables()
+
+
+class AES:
+    # AES-128/192/256 block cipher with the CBC mode used by PDF encryption (no padding here)
+
+    def __init__(self, key):
+        if (len(key) not in [16, 24, 32]):
+            raise ValueError('AES key of %d bytes' % len(key))
+        nk = len(key) // 4
+        self.rounds = nk + 6
+        w = list(struct.unpack('>%dI' % nk, key))
+        rcon = 1
+        for i in range(nk, 4 * (self.rounds + 1)):
+            t = w[i - 1]
+            if (i % nk == 0):
+                t = ((t << 8) & 0xFFFFFFFF) | (t >> 24)
+                t = self.sub_word(t) ^ (rcon << 24)
+                rcon = xtime(rcon)
+            elif (nk > 6) and (i % nk == 4):
+                t = self.sub_word(t)
+            w.append(w[i - nk] ^ t)
+        self.enc_keys = w
+        # Equivalent inverse cipher: round keys in reverse order, InvMixColumns on the inner ones
+        d = []
+        for r in range(self.rounds, -1, -1):
+            rk = w[4 * r:4 * r + 4]
+            if (0 < r < self.rounds):
+                rk = [TD[0][SBOX[k >> 24]] ^ TD[1][SBOX[(k >> 16) & 0xFF]] ^ TD[2][SBOX[(k >> 8) & 0xFF]] ^ TD[3][SBOX[k & 0xFF]] for k in rk]
+            d.extend(rk)
+        self.dec_keys = d
+
+    @staticmethod
+    def sub_word(t):
+        return (SBOX[t >> 24] << 24) | (SBOX[(t >> 16) & 0xFF] << 16) | (SBOX[(t >> 8) & 0xFF] << 8) | SBOX[t & 0xFF]
+
+    def cbc_encrypt(self, data, iv):
+        # data is a multiple of AES_BLOCK bytes
+        te0, te1, te2, te3 = TE
+        sbox = SBOX
+        rk = self.enc_keys
+        last = 4 * self.rounds
+        p0, p1, p2, p3 = struct.unpack('>4I', iv)
+        out = []
+        for b0, b1, b2, b3 in struct.iter_unpack('>4I', data):
+            s0 = b0 ^ p0 ^ rk[0]
+            s1 = b1 ^ p1 ^ rk[1]
+            s2 = b2 ^ p2 ^ rk[2]
+            s3 = b3 ^ p3 ^ rk[3]
+            for k in range(4, last, 4):
+                t0 = te0[s0 >> 24] ^ te1[(s1 >> 16) & 0xFF] ^ te2[(s2 >> 8) & 0xFF] ^ te3[s3 & 0xFF] ^ rk[k]
+                t1 = te0[s1 >> 24] ^ te1[(s2 >> 16) & 0xFF] ^ te2[(s3 >> 8) & 0xFF] ^ te3[s0 & 0xFF] ^ rk[k + 1]
+                t2 = te0[s2 >> 24] ^ te1[(s3 >> 16) & 0xFF] ^ te2[(s0 >> 8) & 0xFF] ^ te3[s1 & 0xFF] ^ rk[k + 2]
+                t3 = te0[s3 >> 24] ^ te1[(s0 >> 16) & 0xFF] ^ te2[(s1 >> 8) & 0xFF] ^ te3[s2 & 0xFF] ^ rk[k + 3]
+                s0, s1, s2, s3 = t0, t1, t2, t3
+            p0 = ((sbox[s0 >> 24] << 24) | (sbox[(s1 >> 16) & 0xFF] << 16) | (sbox[(s2 >> 8) & 0xFF] << 8) | sbox[s3 & 0xFF]) ^ rk[last]
+            p1 = ((sbox[s1 >> 24] << 24) | (sbox[(s2 >> 16) & 0xFF] << 16) | (sbox[(s3 >> 8) & 0xFF] << 8) | sbox[s0 & 0xFF]) ^ rk[last + 1]
+            p2 = ((sbox[s2 >> 24] << 24) | (sbox[(s3 >> 16) & 0xFF] << 16) | (sbox[(s0 >> 8) & 0xFF] << 8) | sbox[s1 & 0xFF]) ^ rk[last + 2]
+            p3 = ((sbox[s3 >> 24] << 24) | (sbox[(s0 >> 16) & 0xFF] << 16) | (sbox[(s1 >> 8) & 0xFF] << 8) | sbox[s2 & 0xFF]) ^ rk[last + 3]
+            out.append(struct.pack('>4I', p0, p1, p2, p3))
+        return b''.join(out)
+
+    def cbc_decrypt(self, data, iv):
+        # data is a multiple of AES_BLOCK bytes
+        td0, td1, td2, td3 = TD
+        inv_sbox = INV_SBOX
+        rk = self.dec_keys
+        last = 4 * self.rounds
+        p0, p1, p2, p3 = struct.unpack('>4I', iv)
+        out = []
+        for b0, b1, b2, b3 in struct.iter_unpack('>4I', data):
+            s0 = b0 ^ rk[0]
+            s1 = b1 ^ rk[1]
+            s2 = b2 ^ rk[2]
+            s3 = b3 ^ rk[3]
+            for k in range(4, last, 4):
+                t0 = td0[s0 >> 24] ^ td1[(s3 >> 16) & 0xFF] ^ td2[(s2 >> 8) & 0xFF] ^ td3[s1 & 0xFF] ^ rk[k]
+                t1 = td0[s1 >> 24] ^ td1[(s0 >> 16) & 0xFF] ^ td2[(s3 >> 8) & 0xFF] ^ td3[s2 & 0xFF] ^ rk[k + 1]
+                t2 = td0[s2 >> 24] ^ td1[(s1 >> 16) & 0xFF] ^ td2[(s0 >> 8) & 0xFF] ^ td3[s3 & 0xFF] ^ rk[k + 2]
+                t3 = td0[s3 >> 24] ^ td1[(s2 >> 16) & 0xFF] ^ td2[(s1 >> 8) & 0xFF] ^ td3[s0 & 0xFF] ^ rk[k + 3]
+                s0, s1, s2, s3 = t0, t1, t2, t3
+            out.append(struct.pack('>4I',
+                ((inv_sbox[s0 >> 24] << 24) | (inv_sbox[(s3 >> 16) & 0xFF] << 16) | (inv_sbox[(s2 >> 8) & 0xFF] << 8) | inv_sbox[s1 & 0xFF]) ^ rk[last] ^ p0,
+                ((inv_sbox[s1 >> 24] << 24) | (inv_sbox[(s0 >> 16) & 0xFF] << 16) | (inv_sbox[(s3 >> 8) & 0xFF] << 8) | inv_sbox[s2 & 0xFF]) ^ rk[last + 1] ^ p1,
+                ((inv_sbox[s2 >> 24] << 24) | (inv_sbox[(s1 >> 16) & 0xFF] << 16) | (inv_sbox[(s0 >> 8) & 0xFF] << 8) | inv_sbox[s3 & 0xFF]) ^ rk[last + 2] ^ p2,
+                ((inv_sbox[s3 >> 24] << 24) | (inv_sbox[(s2 >> 16) & 0xFF] << 16) | (inv_sbox[(s1 >> 8) & 0xFF] << 8) | inv_sbox[s0 & 0xFF]) ^ rk[last + 3] ^ p3))
+            p0, p1, p2, p3 = b0, b1, b2, b3
+        return b''.join(out)
+
+
+ZERO_IV = bytes(AES_BLOCK)
+
+
+# --- Streaming decryption of stream data (see pdfdecode.decode_chunks()) ---
+
+def identity_chunks(chunks):
+    # Streams of an encrypted PDF that are not encrypted (XRef streams, Identity crypt filter, ...)
+    return chunks
+
+
+def rc4_chunks(key, chunks):
+    cipher = RC4(key)
+    for chunk in chunks:
+        yield cipher.crypt(chunk)
+
+
+def aes_chunks(cipher, chunks):
+    # AES-CBC stream data: the first block is the IV and the last block is padded (PKCS#5). The
+    # last whole block is held back until the end so that the padding can be removed.
+    iv = None
+    pending = b''
+    for chunk in chunks:
+        pending = pending + chunk
+        if (iv is None):
+            if (len(pending) < AES_BLOCK):
+                continue
+            iv = pending[:AES_BLOCK]
+            pending = pending[AES_BLOCK:]
+        n = len(pending) - ((len(pending) % AES_BLOCK) or AES_BLOCK)
+        if (n > 0):
+            yield cipher.cbc_decrypt(pending[:n], iv)
+            iv = pending[n - AES_BLOCK:n]
+            pending = pending[n:]
+    # A partial block at the end (a broken stream) is dropped
+    n = len(pending) - (len(pending) % AES_BLOCK)
+    if (iv is not None) and (n > 0):
+        out = cipher.cbc_decrypt(pending[:n], iv)
+        pad = out[-1]
+        if (1 <= pad <= AES_BLOCK) and (out[-pad:] == bytes([pad]) * pad):
+            out = out[:-pad]
+        if (len(out) > 0):
+            yield out
+
+
+# --- Passwords ---
+
+def saslprep(s):
+    # SASLprep (RFC 4013) of a revision 6 password: map, normalize (NFKC of Unicode 3.2), then
+    # check prohibited characters and bidirectional strings. Unassigned code points are allowed
+    # (a "query" in RFC 3454 terms). Raises PasswordError for a prohibited password.
+    chars = []
+    for c in s:
+        if stringprep.in_table_b1(c):
+            continue                # commonly mapped to nothing
+        chars.append(' ' if stringprep.in_table_c12(c) else c)
+    s = unicodedata.ucd_3_2_0.normalize('NFKC', ''.join(chars))
+    for c in s:
+        if (stringprep.in_table_c12(c) or stringprep.in_table_c21_c22(c) or stringprep.in_table_c3(c) or
+                stringprep.in_table_c4(c) or stringprep.in_table_c5(c) or stringprep.in_table_c6(c) or
+                stringprep.in_table_c7(c) or stringprep.in_table_c8(c) or stringprep.in_table_c9(c)):
+            raise PasswordError('prohibited character U+%04X in the password (SASLprep)' % ord(c))
+    if any(stringprep.in_table_d1(c) for c in s):
+        if any(stringprep.in_table_d2(c) for c in s) or not (stringprep.in_table_d1(s[0]) and stringprep.in_table_d1(s[-1])):
+            raise PasswordError('mixed right-to-left and left-to-right characters in the password (SASLprep)')
+    return s
+
+
+def password_bytes(password, revision):
+    # The bytes of a password: SASLprep'd UTF-8 for revisions 5 and 6, otherwise PDFDocEncoding
+    # (Latin-1 covers the printable characters that passwords are typed with)
+    if isinstance(password, bytes):
+        return password
+    if (revision >= 5):
+        return saslprep(password).encode('utf-8')[:MAX_PASSWORD_BYTES]
+    try:
+        return password.encode('latin-1')
+    except UnicodeEncodeError:
+        return password.encode('utf-8')
+
+
+def password_key(password):
+    # A salted hash of a password that results can be cached under (see --cache): results found
+    # with one password are never served for another one, and the password itself is not stored
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), PASSWORD_KEY_SALT, PASSWORD_KEY_ROUNDS).hex()
+
+
+def hash_r6(password, salt, user_key, revision):
+    # Algorithm 2.B (revision 6; revision 5 is a single SHA-256) of password, 8 bytes of salt and
+    # (for the owner password) the 48 bytes of /U
+    k = hashlib.sha256(password + salt + user_key).digest()
+    if (revision == 5):
+        return k
+    i = 0
+    while True:
+        e = AES(k[:16]).cbc_encrypt((password + k + user_key) * 64, k[16:32])
+        k = [hashlib.sha256, hashlib.sha384, hashlib.sha512][sum(e[:16]) % 3](e).digest()
+        i = i + 1
+        if (i >= 64) and (e[-1] <= i - 32):
+            return k[:32]
+
+
+# --- The standard security handler ---
+
+def pdf_string(d, key, length=None):
+    v = d.get(key)
+    if not isinstance(v, bytes) or ((length is not None) and (len(v) < length)):
+        raise UnsupportedEncryption('missing or bad /%s in the /Encrypt dictionary' % key)
+    return v
+
+
+class NoCrypt:
+    # An unencrypted PDF
+
+    encrypted = False
+
+    def stream_decrypt(self, num, gen, stream_dict):
+        # Function of the raw stream data chunks that returns the decrypted chunks (None: not encrypted)
+        return None
+
+
+NO_CRYPT = NoCrypt()
+
+
+class SecurityHandler(NoCrypt):
+    # The standard security handler of the /Encrypt dictionary encrypt of a PDF with file
+    # identifier file_id (first /ID string), opened with password (user or owner).
+    # Raises PasswordError or UnsupportedEncryption.
+
+    encrypted = True
+
+    def __init__(self, encrypt, file_id=b'', password=''):
+        if (encrypt.get('Filter') != 'Standard'):
+            raise UnsupportedEncryption('security handler /%s' % encrypt.get('Filter'))
+        self.version = encrypt.get('V', 0)
+        self.revision = encrypt.get('R')
+        if (self.version not in [1, 2, 4, 5]) or (self.revision not in [2, 3, 4, 5, 6]):
+            raise UnsupportedEncryption('/V %s /R %s' % (self.version, self.revision))
+        self.encrypt_metadata = (encrypt.get('EncryptMetadata', True) is not False)
+        self.file_id = file_id
+        # Crypt filters: name -> cipher. /V 1 and 2 encrypt everything with RC4.
+        self.filters = { 'Identity': None }
+        self.stream_filter_name = 'Identity'
+        if (self.version < 4):
+            self.filters['Standard'] = 'RC4'
+            self.stream_filter_name = 'Standard'
+        else:
+            cf = encrypt.get('CF')
+            for name, f in (cf.items() if isinstance(cf, dict) else []):
+                method = f.get('CFM', 'None') if isinstance(f, dict) else 'None'
+                self.filters[name] = CRYPT_METHODS.get(method, 'unsupported /CFM /%s' % method)
+            self.stream_filter_name = encrypt.get('StmF', 'Identity')
+        if (self.version == 1):
+            self.length = 5
+        elif (self.version == 4):
+            self.length = 16
+        elif (self.version == 5):
+            self.length = 32
+        else:
+            length = encrypt.get('Length', 40)
+            self.length = (length // 8) if isinstance(length, int) and (40 <= length <= 128) and (length % 8 == 0) else 5
+        self.keys = {}                  # (object number, generation, cipher) -> key (or AES) of the object
+        self.lock = threading.Lock()    # streams are decrypted from the decoding threads
+        self.key = self.authenticate(encrypt, password)
+
+    def authenticate(self, encrypt, password):
+        # The file key from the user or the owner password
+        pw = password_bytes(password, self.revision)
+        if (self.revision >= 5):
+            key = self.authenticate_r6(encrypt, pw)
+        else:
+            key = self.authenticate_r4(encrypt, pw)
+        if (key is None):
+            raise PasswordError('wrong password' if (len(pw) > 0) else 'the PDF has a user password')
+        return key
+
+    def authenticate_r6(self, encrypt, pw):
+        # Algorithm 2.A
+        o = pdf_string(encrypt, 'O', 48)
+        u = pdf_string(encrypt, 'U', 48)
+        if (hash_r6(pw, u[32:40], b'', self.revision) == u[:32]):
+            return AES(hash_r6(pw, u[40:48], b'', self.revision)).cbc_decrypt(pdf_string(encrypt, 'UE', 32)[:32], ZERO_IV)
+        if (hash_r6(pw, o[32:40], u[:48], self.revision) == o[:32]):
+            return AES(hash_r6(pw, o[40:48], u[:48], self.revision)).cbc_decrypt(pdf_string(encrypt, 'OE', 32)[:32], ZERO_IV)
+        return None
+
+    def authenticate_r4(self, encrypt, pw):
+        o = pdf_string(encrypt, 'O', 32)[:32]
+        u = pdf_string(encrypt, 'U', 16)
+        p = encrypt.get('P', 0)
+        if not isinstance(p, int):
+            raise UnsupportedEncryption('bad /P in the /Encrypt dictionary')
+        key = self.file_key(pw, o, p)
+        if self.is_user_key(key, u):
+            return key
+        # Algorithm 7: the owner password decrypts /O to the user password
+        h = hashlib.md5((pw + PASSWORD_PADDING)[:32]).digest()
+        if (self.revision >= 3):
+            for _ in range(50):
+                h = hashlib.md5(h).digest()
+        h = h[:self.length]
+        if (self.revision == 2):
+            user = rc4(h, o)
+        else:
+            user = o
+            for i in range(19, -1, -1):
+                user = rc4(bytes(b ^ i for b in h), user)
+        key = self.file_key(user, o, p)
+        return key if self.is_user_key(key, u) else None
+
+    def file_key(self, pw, o, p):
+        # Algorithm 2
+        h = hashlib.md5((pw + PASSWORD_PADDING)[:32] + o + struct.pack('<i', p if (p < 0x80000000) else p - 0x100000000) + self.file_id)
+        if (self.revision >= 4) and not self.encrypt_metadata:
+            h.update(b'\xff\xff\xff\xff')
+        key = h.digest()
+        if (self.revision >= 3):
+            for _ in range(50):
+                key = hashlib.md5(key[:self.length]).digest()
+        return key[:self.length]
+
+    def is_user_key(self, key, u):
+        # Algorithms 4 and 5
+        if (self.revision == 2):
+            return rc4(key, PASSWORD_PADDING) == u[:32]
+        x = rc4(key, hashlib.md5(PASSWORD_PADDING + self.file_id).digest())
+        for i in range(1, 20):
+            x = rc4(bytes(b ^ i for b in key), x)
+        return x == u[:16]
+
+    def stream_cipher(self, stream_dict):
+        # Cipher of a stream (None: not encrypted): XRef streams never are, a /Crypt filter names
+        # its crypt filter, otherwise /StmF (metadata maybe not)
+        if (stream_dict.get('Type') == 'XRef'):
+            return None
+        filters = stream_dict.get('Filter')
+        parms = stream_dict.get('DecodeParms')
+        if isinstance(filters, Name):
+            filters = [filters]
+            parms = [parms]
+        if isinstance(filters, list) and ('Crypt' in filters):
+            i = filters.index('Crypt')
+            p = parms[i] if isinstance(parms, list) and (i < len(parms)) else None
+            name = p.get('Name', 'Identity') if isinstance(p, dict) else 'Identity'
+        elif (stream_dict.get('Type') == 'Metadata') and not self.encrypt_metadata:
+            return None
+        else:
+            name = self.stream_filter_name
+        if (name not in self.filters):
+            raise UnsupportedFilter('crypt filter /%s' % name)
+        cipher = self.filters[name]
+        if (cipher is not None) and cipher.startswith('unsupported'):
+            raise UnsupportedFilter(cipher)
+        return cipher
+
+    def object_key(self, num, gen, cipher):
+        # Algorithm 1: the key of object num gen (the file key for /V 5), derived once. For AES the
+        # expanded key (an AES) is cached. /V 5 has one key for all objects (0 0).
+        k = (num, gen, cipher)
+        with self.lock:
+            key = self.keys.get(k)
+            if (key is None):
+                if (self.version == 5):
+                    key = self.key
+                else:
+                    key = hashlib.md5(self.key + struct.pack('<I', num)[:3] + struct.pack('<I', gen)[:2] +
+                                      (b'sAlT' if (cipher == 'AESV2') else b'')).digest()[:min(self.length + 5, 16)]
+                if (cipher != 'RC4'):
+                    key = AES(key)
+                self.keys[k] = key
+            return key
+
+    def stream_decrypt(self, num, gen, stream_dict):
+        cipher = self.stream_cipher(stream_dict)
+        if (cipher is None):
+            return identity_chunks
+        if (self.version == 5):
+            num = gen = 0           # one key for all objects
+        key = self.object_key(int(num), int(gen), cipher)
+        if (cipher == 'RC4'):
+            return lambda chunks: rc4_chunks(key, chunks)
+        return lambda chunks: aes_chunks(key, chunks)
+
+
+def parse_trailer(buf, markers, kind, offset, end):
+    # The trailer dictionary after "trailer" (end is the end of the keyword) or the dictionary of
+    # the XRef stream whose /Type /XRef is at offset
+    if (kind == 'trailer'):
+        d = parse_object(Lexer(buf, end))
+        return d if isinstance(d, dict) else {}
+    objs = [m[0] for m in markers['obj']]
+    i = bisect_right(objs, offset) - 1
+    streams = [m[0] for m in markers['stream']]
+    j = bisect_left(streams, offset)
+    if (i < 0):
+        return {}
+    return parse_object_dict(buf, objs[i], streams[j] if (j < len(streams)) else None)
+
+
+def find_encrypt(buf, markers):
+    # (/Encrypt dictionary, first /ID string) of a PDF from the markers (see pdfscan.scan_markers()):
+    # the last trailer or XRef stream dictionary with an /Encrypt entry. None if not encrypted.
+    candidates = sorted([(m[0], 'trailer', m[2]) for m in markers['trailer']] + [(m[0], 'XRef', m[2]) for m in markers['XRef']], reverse=True)
+    for offset, kind, end in candidates:
+        try:
+            trailer = parse_trailer(buf, markers, kind, offset, end)
+        except PDFSyntaxError:
+            continue
+        encrypt = trailer.get('Encrypt')
+        if (encrypt is None):
+            continue
+        if isinstance(encrypt, Ref):
+            name = '%d %d obj' % encrypt
+            found = [m[0] for m in markers['obj'] if (m[1] == name)]
+            if (len(found) == 0):
+                raise UnsupportedEncryption('/Encrypt %d %d R not found' % encrypt)
+            endobjs = [m[0] for m in markers['endobj']]
+            j = bisect_left(endobjs, found[-1])
+            encrypt = parse_object_dict(buf, found[-1], endobjs[j] if (j < len(endobjs)) else None)
+        if not isinstance(encrypt, dict):
+            raise UnsupportedEncryption('/Encrypt is not a dictionary')
+        file_id = trailer.get('ID')
+        file_id = file_id[0] if isinstance(file_id, list) and (len(file_id) > 0) and isinstance(file_id[0], bytes) else b''
+        return (encrypt, file_id)
+    return None
+
+
+def security_handler(buf, markers, password=''):
+    # The SecurityHandler of an encrypted PDF (NO_CRYPT if it is not encrypted)
+    found = find_encrypt(buf, markers)
+    if (found is None):
+        return NO_CRYPT
+    encrypt, file_id = found
+    return SecurityHandler(encrypt, file_id, password)
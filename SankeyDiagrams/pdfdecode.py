@@ -0,0 +1,619 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# In-process stream decoding for sankey-pdf.py so that working out the decompressed length
+# of a stream does not need a `qpdf --filtered-stream-data` subprocess per stream.
+#
+# Only the stream extent dictionary is tokenized (just enough to get /Filter, /DecodeParms,
+# /Length, /N and /First). Stream data is taken from the byte range between the "stream" and
+# "endstream" markers and decoded as a chain of chunk generators so decoded bytes can be
+# counted without ever building the whole output.
+#
+# Supported filters: FlateDecode & LZWDecode (incl. PNG and TIFF predictors), ASCIIHexDecode,
+# ASCII85Decode and RunLengthDecode. Like QPDF's default decode level, the specialized image
+# filters (DCTDecode, JPXDecode, JBIG2Decode, CCITTFaxDecode) are not decoded. Anything else
+# (e.g. indirect /Filter) raises UnsupportedFilter so the caller can fall back to QPDF.
+#
+# Streams of encrypted PDFs are decrypted on the fly in front of the filters by a decrypt function
+# of the raw chunks (see pdfcrypt.py), which also takes the place of a /Crypt filter.
+#
+
+import re
+import time
+import zlib
+from collections import namedtuple
+
+from pdfscan import regex_match
+
+CHUNK_SIZE = 65536          # Raw stream data is fed to the decoders in chunks of this many bytes
+
+PDF_WHITESPACE = b'\x00\x09\x0a\x0c\x0d\x20'
+PDF_DELIMITERS = b'()<>[]{}/%'
+
+# Specialized image filters that are never decoded (same as QPDF's default "generalized" decode level)
+IMAGE_FILTERS = ['DCTDecode', 'JPXDecode', 'JBIG2Decode', 'CCITTFaxDecode']
+
+
+class PDFSyntaxError(Exception):
+    pass
+
+
+class UnsupportedFilter(Exception):
+    pass
+
+
+class DecodeError(Exception):
+    pass
+
+
+class BudgetExceeded(Exception):
+    # Decoding stopped at a limit (see pdfbudget.py) after decoded bytes. data is what was decoded
+    # (decoded_data() only) and timeout is True if it was the time budget.
+    def __init__(self, decoded, data=None, timeout=False):
+        super().__init__('decoding budget exceeded after %d bytes' % decoded)
+        self.decoded = decoded
+        self.data = data
+        self.timeout = timeout
+
+
+# Indirect reference "X Y R"
+Ref = namedtuple('Ref', ['num', 'gen'])
+
+
+class Name(str):
+    # PDF name object (without the leading "/") - keeps names distinct from keywords
+    pass
+
+
+OBJ_HEADER_REGEX = re.compile(rb'[\x00\x09\x0a\x0c\x0d\x20]*([0-9]+)[\x00\x09\x0a\x0c\x0d\x20]+([0-9]+)[\x00\x09\x0a\x0c\x0d\x20]+obj')
+NUMBER_REGEX = re.compile(rb'[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)$')
+REGULAR_REGEX = re.compile(rb'[^\x00\x09\x0a\x0c\x0d\x20()<>\[\]{}/%]*')
+NAME_ESCAPE_REGEX = re.compile(rb'#([0-9A-Fa-f]{2})')
+STRING_ESCAPES = {ord('n'): b'\n', ord('r'): b'\r', ord('t'): b'\t', ord('b'): b'\b', ord('f'): b'\f',
+                  ord('('): b'(', ord(')'): b')', ord('\\'): b'\\'}
+
+
+class Lexer:
+    # Minimal PDF tokenizer over buf[pos:end]. Only intended for the small dictionaries
+    # of stream extents, object streams, xref streams and trailers.
+
+    def __init__(self, buf, pos, end=None):
+        self.buf = buf
+        self.pos = pos
+        self.end = len(buf) if (end is None) else min(end, len(buf))
+
+    def skip_whitespace(self):
+        buf = self.buf
+        while (self.pos < self.end):
+            c = buf[self.pos]
+            if (c in PDF_WHITESPACE):
+                self.pos = self.pos + 1
+            elif (c == 0x25): # % comment up to EOL
+                while ((self.pos < self.end) and (buf[self.pos] not in b'\r\n')):
+                    self.pos = self.pos + 1
+            else:
+                break
+
+    def next_token(self):
+        # Returns a (kind, value) tuple. kind is one of: 'delim', 'name', 'string', 'number', 'keyword', 'eof'.
+        # Lookahead is done by saving and restoring pos, so pos is always just after the last parsed object.
+        self.skip_whitespace()
+        if (self.pos >= self.end):
+            return ('eof', None)
+        buf = self.buf
+        c = buf[self.pos]
+        if (c == 0x3C): # <
+            if ((self.pos + 1 < self.end) and (buf[self.pos + 1] == 0x3C)):
+                self.pos = self.pos + 2
+                return ('delim', '<<')
+            return ('string', self.read_hex_string())
+        if (c == 0x3E): # >
+            if ((self.pos + 1 < self.end) and (buf[self.pos + 1] == 0x3E)):
+                self.pos = self.pos + 2
+                return ('delim', '>>')
+            raise PDFSyntaxError('unexpected ">" at offset %d' % self.pos)
+        if (c in b'[]{}'):
+            self.pos = self.pos + 1
+            return ('delim', chr(c))
+        if (c == 0x28): # (
+            return ('string', self.read_literal_string())
+        if (c == 0x2F): # /
+            m = regex_match(REGULAR_REGEX, buf, self.pos + 1, self.end)
+            self.pos = m.end()
+            name = NAME_ESCAPE_REGEX.sub(lambda e: bytes([int(e.group(1), 16)]), bytes(m.group(0)))
+            return ('name', Name(name.decode('latin-1')))
+        if (c == 0x29): # )
+            raise PDFSyntaxError('unexpected ")" at offset %d' % self.pos)
+        m = regex_match(REGULAR_REGEX, buf, self.pos, self.end)
+        self.pos = m.end()
+        token = bytes(m.group(0))
+        if (NUMBER_REGEX.match(token)):
+            if (b'.' in token):
+                return ('number', float(token))
+            return ('number', int(token))
+        return ('keyword', token.decode('latin-1'))
+
+    def read_hex_string(self):
+        close = self.buf.find(b'>', self.pos + 1, self.end)
+        if (close < 0):
+            raise PDFSyntaxError('unterminated hex string at offset %d' % self.pos)
+        digits = bytes(b for b in bytes(self.buf[self.pos + 1:close]) if b not in PDF_WHITESPACE)
+        self.pos = close + 1
+        if (len(digits) % 2 == 1):
+            digits = digits + b'0'
+        try:
+            return bytes.fromhex(digits.decode('latin-1'))
+        except ValueError:
+            raise PDFSyntaxError('bad hex string at offset %d' % self.pos)
+
+    def read_literal_string(self):
+        buf = self.buf
+        i = self.pos + 1
+        depth = 1
+        out = bytearray()
+        while (i < self.end):
+            c = buf[i]
+            if (c == 0x5C): # backslash escape
+                i = i + 1
+                if (i >= self.end):
+                    break
+                c = buf[i]
+                if (c in STRING_ESCAPES):
+                    out += STRING_ESCAPES[c]
+                elif (0x30 <= c <= 0x37): # up to 3 octal digits
+                    j = i
+                    while ((j < self.end) and (j < i + 3) and (0x30 <= buf[j] <= 0x37)):
+                        j = j + 1
+                    out.append(int(bytes(buf[i:j]), 8) & 0xFF)
+                    i = j - 1
+                elif (c == 0x0D): # line continuation
+                    if ((i + 1 < self.end) and (buf[i + 1] == 0x0A)):
+                        i = i + 1
+                elif (c != 0x0A):
+                    out.append(c)
+            elif (c == 0x28):
+                depth = depth + 1
+                out.append(c)
+            elif (c == 0x29):
+                depth = depth - 1
+                if (depth == 0):
+                    self.pos = i + 1
+                    return bytes(out)
+                out.append(c)
+            else:
+                out.append(c)
+            i = i + 1
+        raise PDFSyntaxError('unterminated literal string at offset %d' % self.pos)
+
+
+def parse_object(lexer):
+    # Parse a single direct object. Names are Name, strings are bytes, indirect references are Ref
+    kind, value = lexer.next_token()
+    if (kind == 'delim'):
+        if (value == '<<'):
+            d = {}
+            while True:
+                kind, key = lexer.next_token()
+                if (kind == 'delim') and (key == '>>'):
+                    return d
+                if (kind != 'name'):
+                    raise PDFSyntaxError('dictionary key is not a name at offset %d' % lexer.pos)
+                d[str(key)] = parse_object(lexer)
+        if (value == '['):
+            a = []
+            while True:
+                pos = lexer.pos
+                kind, v = lexer.next_token()
+                if (kind == 'delim') and (v == ']'):
+                    return a
+                lexer.pos = pos
+                a.append(parse_object(lexer))
+        raise PDFSyntaxError('unexpected "%s" at offset %d' % (value, lexer.pos))
+    if (kind == 'number'):
+        # Might be the start of an indirect reference "X Y R"
+        if isinstance(value, int) and (value >= 0):
+            pos = lexer.pos
+            t2 = lexer.next_token()
+            if (t2[0] == 'number') and isinstance(t2[1], int) and (t2[1] >= 0):
+                t3 = lexer.next_token()
+                if (t3 == ('keyword', 'R')):
+                    return Ref(value, t2[1])
+            lexer.pos = pos
+        return value
+    if (kind == 'keyword'):
+        if (value == 'true'):
+            return True
+        if (value == 'false'):
+            return False
+        if (value == 'null'):
+            return None
+        raise PDFSyntaxError('unexpected keyword "%s" at offset %d' % (value, lexer.pos))
+    if (kind == 'eof'):
+        raise PDFSyntaxError('unexpected end of data at offset %d' % lexer.pos)
+    return value
+
+
+def parse_object_dict(buf, obj_offset, end):
+    # Parse the dictionary of the indirect object "X Y obj << ... >>" that starts at obj_offset.
+    # end limits how far the tokenizer may read (e.g. the offset of the "stream" keyword).
+    m = regex_match(OBJ_HEADER_REGEX, buf, obj_offset, end)
+    if (m is None):
+        raise PDFSyntaxError('no "X Y obj" at offset %d' % obj_offset)
+    d = parse_object(Lexer(buf, m.end(), end))
+    if not isinstance(d, dict):
+        raise PDFSyntaxError('object at offset %d is not a dictionary' % obj_offset)
+    return d
+
+
+def stream_data_extent(buf, stream_dict, stream_offset, endstream_offset):
+    # Work out the byte range of the raw stream data between the "stream" and "endstream" keywords.
+    # A direct /Length is used if it agrees with the "endstream" marker, otherwise the markers are trusted.
+    start = stream_offset + len('stream')
+    if (buf[start:start + 2] == b'\r\n'):
+        start = start + 2
+    elif (buf[start:start + 1] in [b'\n', b'\r']):
+        start = start + 1
+    length = stream_dict.get('Length')
+    if isinstance(length, int) and (length >= 0) and (start + length <= endstream_offset):
+        if (len(bytes(buf[start + length:endstream_offset]).strip(PDF_WHITESPACE)) == 0):
+            return (start, start + length)
+    end = endstream_offset
+    if (buf[end - 2:end] == b'\r\n'):
+        end = end - 2
+    elif (buf[end - 1:end] in [b'\n', b'\r']):
+        end = end - 1
+    return (start, max(start, end))
+
+
+def filter_chain(stream_dict):
+    # Return a list of (filter name, decode parms dict) from /Filter and /DecodeParms
+    filters = stream_dict.get('Filter')
+    parms = stream_dict.get('DecodeParms')
+    if (filters is None):
+        return []
+    if isinstance(filters, Ref) or isinstance(parms, Ref):
+        raise UnsupportedFilter('indirect /Filter or /DecodeParms')
+    if not isinstance(filters, list):
+        filters = [filters]
+    if not isinstance(parms, list):
+        parms = [parms] * len(filters)
+    chain = []
+    for i, f in enumerate(filters):
+        if not isinstance(f, Name):
+            raise UnsupportedFilter('unexpected /Filter entry: %s' % repr(f))
+        p = parms[i] if (i < len(parms)) else None
+        if isinstance(p, Ref):
+            raise UnsupportedFilter('indirect /DecodeParms')
+        chain.append((str(f), p if isinstance(p, dict) else {}))
+    return chain
+
+
+def raw_chunks(buf, start, end):
+    for i in range(start, end, CHUNK_SIZE):
+        yield bytes(buf[i:min(i + CHUNK_SIZE, end)])
+
+
+def flate_decode(chunks):
+    d = zlib.decompressobj()
+    for chunk in chunks:
+        # Limit each step so a tiny input chunk cannot explode into one huge output chunk
+        while (len(chunk) > 0):
+            try:
+                out = d.decompress(chunk, CHUNK_SIZE)
+            except zlib.error as e:
+                raise DecodeError('FlateDecode: %s' % e)
+            if (len(out) > 0):
+                yield out
+            if d.eof:
+                return
+            chunk = d.unconsumed_tail
+    try:
+        out = d.flush()
+    except zlib.error as e:
+        raise DecodeError('FlateDecode: %s' % e)
+    if (len(out) > 0):
+        yield out
+
+
+def lzw_decode(chunks, early_change=1):
+    # Output is yielded every CHUNK_SIZE bytes (or so) so a tiny input chunk cannot explode into one
+    # huge output chunk, as in flate_decode()
+    table = [bytes([i]) for i in range(256)] + [b'', b'']
+    code_len = 9
+    prev = None
+    acc = 0
+    nbits = 0
+    out = bytearray()
+    for chunk in chunks:
+        for byte in chunk:
+            acc = (acc << 8) | byte
+            nbits = nbits + 8
+            while (nbits >= code_len):
+                nbits = nbits - code_len
+                code = (acc >> nbits) & ((1 << code_len) - 1)
+                acc = acc & ((1 << nbits) - 1)
+                if (code == 256): # clear table
+                    table = table[:258]
+                    code_len = 9
+                    prev = None
+                    continue
+                if (code == 257): # EOD
+                    if (len(out) > 0):
+                        yield bytes(out)
+                    return
+                if (code < len(table)):
+                    entry = table[code]
+                elif (code == len(table)) and (prev is not None):
+                    entry = prev + prev[:1]
+                else:
+                    raise DecodeError('LZWDecode: bad code %d' % code)
+                out += entry
+                if (len(out) >= CHUNK_SIZE):
+                    yield bytes(out)
+                    out = bytearray()
+                if (prev is not None) and (len(table) < 4096):
+                    table.append(prev + entry[:1])
+                prev = entry
+                if ((len(table) + early_change) >= (1 << code_len)) and (code_len < 12):
+                    code_len = code_len + 1
+        if (len(out) > 0):
+            yield bytes(out)
+            out = bytearray()
+
+
+def ascii_hex_decode(chunks):
+    pending = b''
+    for chunk in chunks:
+        eod = chunk.find(b'>')
+        if (eod >= 0):
+            chunk = chunk[:eod]
+        digits = pending + bytes(b for b in chunk if b not in PDF_WHITESPACE)
+        n = len(digits) - (len(digits) % 2)
+        pending = digits[n:]
+        try:
+            out = bytes.fromhex(digits[:n].decode('latin-1'))
+        except ValueError:
+            raise DecodeError('ASCIIHexDecode: bad hex digit')
+        if (len(out) > 0):
+            yield out
+        if (eod >= 0):
+            break
+    if (len(pending) > 0):
+        yield bytes.fromhex((pending + b'0').decode('latin-1'))
+
+
+def ascii85_decode(chunks):
+    group = []
+    for chunk in chunks:
+        out = bytearray()
+        eod = chunk.find(b'~')
+        if (eod >= 0):
+            chunk = chunk[:eod]
+        for c in chunk:
+            if (c in PDF_WHITESPACE):
+                continue
+            if (c == 0x7A) and (len(group) == 0): # 'z'
+                out += b'\x00\x00\x00\x00'
+                continue
+            if not (0x21 <= c <= 0x75):
+                raise DecodeError('ASCII85Decode: bad character 0x%02X' % c)
+            group.append(c - 33)
+            if (len(group) == 5):
+                v = 0
+                for g in group:
+                    v = v * 85 + g
+                out += (v & 0xFFFFFFFF).to_bytes(4, 'big')
+                group = []
+        if (len(out) > 0):
+            yield bytes(out)
+        if (eod >= 0):
+            break
+    if (len(group) > 1):
+        n = len(group) - 1
+        v = 0
+        for g in group + [84] * (5 - len(group)):
+            v = v * 85 + g
+        yield (v & 0xFFFFFFFF).to_bytes(4, 'big')[:n]
+
+
+def run_length_decode(chunks):
+    pending = b''
+    for chunk in chunks:
+        data = pending + chunk
+        out = bytearray()
+        i = 0
+        while (i < len(data)):
+            n = data[i]
+            if (n == 128): # EOD
+                if (len(out) > 0):
+                    yield bytes(out)
+                return
+            if (n < 128):
+                if (i + 1 + n + 1 > len(data)):
+                    break
+                out += data[i + 1:i + 2 + n]
+                i = i + 2 + n
+            else:
+                if (i + 2 > len(data)):
+                    break
+                out += data[i + 1:i + 2] * (257 - n)
+                i = i + 2
+        pending = data[i:]
+        if (len(out) > 0):
+            yield bytes(out)
+
+
+def predictor_params(parms):
+    predictor = parms.get('Predictor', 1)
+    colors = parms.get('Colors', 1)
+    bpc = parms.get('BitsPerComponent', 8)
+    columns = parms.get('Columns', 1)
+    if not all(isinstance(v, int) for v in [predictor, colors, bpc, columns]):
+        raise UnsupportedFilter('bad predictor parameters')
+    bpp = max(1, (colors * bpc) // 8)
+    row_len = (colors * bpc * columns + 7) // 8
+    return (predictor, bpp, bpc, row_len)
+
+
+def png_unpredict(chunks, bpp, row_len):
+    prev = bytearray(row_len)
+    pending = bytearray()
+    for chunk in chunks:
+        pending += chunk
+        out = bytearray()
+        while (len(pending) >= row_len + 1):
+            ft = pending[0]
+            row = pending[1:row_len + 1]
+            del pending[:row_len + 1]
+            if (ft == 1): # Sub
+                for i in range(bpp, row_len):
+                    row[i] = (row[i] + row[i - bpp]) & 0xFF
+            elif (ft == 2): # Up
+                for i in range(row_len):
+                    row[i] = (row[i] + prev[i]) & 0xFF
+            elif (ft == 3): # Average
+                for i in range(row_len):
+                    left = row[i - bpp] if (i >= bpp) else 0
+                    row[i] = (row[i] + ((left + prev[i]) >> 1)) & 0xFF
+            elif (ft == 4): # Paeth
+                for i in range(row_len):
+                    a = row[i - bpp] if (i >= bpp) else 0
+                    b = prev[i]
+                    c = prev[i - bpp] if (i >= bpp) else 0
+                    p = a + b - c
+                    pa = abs(p - a)
+                    pb = abs(p - b)
+                    pc = abs(p - c)
+                    if (pa <= pb) and (pa <= pc):
+                        row[i] = (row[i] + a) & 0xFF
+                    elif (pb <= pc):
+                        row[i] = (row[i] + b) & 0xFF
+                    else:
+                        row[i] = (row[i] + c) & 0xFF
+            elif (ft != 0):
+                raise DecodeError('PNG predictor: bad row filter type %d' % ft)
+            out += row
+            prev = row
+        if (len(out) > 0):
+            yield bytes(out)
+
+
+def tiff_unpredict(chunks, bpp, row_len):
+    pending = bytearray()
+    for chunk in chunks:
+        pending += chunk
+        out = bytearray()
+        while (len(pending) >= row_len):
+            row = pending[:row_len]
+            del pending[:row_len]
+            for i in range(bpp, row_len):
+                row[i] = (row[i] + row[i - bpp]) & 0xFF
+            out += row
+        if (len(out) > 0):
+            yield bytes(out)
+
+
+def predicted_length(n, predictor, row_len):
+    # Length after undoing a predictor on n bytes of input, without actually undoing it
+    if (predictor >= 10):
+        return (n // (row_len + 1)) * row_len
+    return n
+
+
+def apply_filter(chunks, name, parms, unpredict=True):
+    if (name in ['FlateDecode', 'Fl']):
+        chunks = flate_decode(chunks)
+    elif (name in ['LZWDecode', 'LZW']):
+        early_change = parms.get('EarlyChange', 1)
+        chunks = lzw_decode(chunks, early_change if isinstance(early_change, int) else 1)
+    elif (name in ['ASCIIHexDecode', 'AHx']):
+        return ascii_hex_decode(chunks)
+    elif (name in ['ASCII85Decode', 'A85']):
+        return ascii85_decode(chunks)
+    elif (name in ['RunLengthDecode', 'RL']):
+        return run_length_decode(chunks)
+    else:
+        raise UnsupportedFilter(name)
+    # Flate and LZW may have a predictor
+    predictor, bpp, bpc, row_len = predictor_params(parms)
+    if (predictor <= 1) or not unpredict:
+        return chunks
+    if (predictor >= 10):
+        return png_unpredict(chunks, bpp, row_len)
+    if (predictor == 2) and (bpc == 8):
+        return tiff_unpredict(chunks, bpp, row_len)
+    raise UnsupportedFilter('predictor %d with %d bits per component' % (predictor, bpc))
+
+
+def decode_chunks(buf, stream_dict, stream_offset, endstream_offset, last_predictor=True, decrypt=None):
+    # Generator of decoded stream data chunks. Set last_predictor False to skip undoing
+    # the predictor of the last filter (its effect on the length can then be computed).
+    # decrypt is a function of the raw chunks that returns them decrypted (see pdfcrypt.py) or None.
+    chain = filter_chain(stream_dict)
+    start, end = stream_data_extent(buf, stream_dict, stream_offset, endstream_offset)
+    chunks = raw_chunks(buf, start, end)
+    if (decrypt is not None):
+        chunks = decrypt(chunks)
+        chain = [(f, parms) for f, parms in chain if (f != 'Crypt')]
+    if any(f in IMAGE_FILTERS for f, _ in chain):
+        return chunks
+    for i, (f, parms) in enumerate(chain):
+        chunks = apply_filter(chunks, f, parms, last_predictor or (i < len(chain) - 1))
+    return chunks
+
+
+def check_budget(n, limit, deadline, parts=None):
+    if (limit is not None) and (n > limit):
+        raise BudgetExceeded(n, b''.join(parts) if (parts is not None) else None)
+    if (deadline is not None) and (time.monotonic() > deadline):
+        raise BudgetExceeded(n, b''.join(parts) if (parts is not None) else None, timeout=True)
+
+
+def decoded_length(buf, stream_dict, stream_offset, endstream_offset, limit=None, deadline=None, decrypt=None):
+    # Count the decoded bytes of a stream incrementally (never holding more than a chunk or so).
+    # Raises BudgetExceeded after more than limit bytes or once time.monotonic() passes deadline.
+    chain = filter_chain(stream_dict)
+    chunks = decode_chunks(buf, stream_dict, stream_offset, endstream_offset, last_predictor=False, decrypt=decrypt)
+    n = 0
+    for chunk in chunks:
+        n = n + len(chunk)
+        check_budget(n, limit, deadline)
+    if (len(chain) > 0) and not any(f in IMAGE_FILTERS for f, _ in chain):
+        f, parms = chain[-1]
+        if (f in ['FlateDecode', 'Fl', 'LZWDecode', 'LZW']):
+            predictor, _, _, row_len = predictor_params(parms)
+            n = predicted_length(n, predictor, row_len)
+    return n
+
+
+def decode_into(sink, buf, stream_dict, stream_offset, endstream_offset, limit=None, deadline=None, decrypt=None):
+    # Feed the decoded stream data to sink(chunk) incrementally (e.g. an object stream parser, see
+    # pdfobjstm.py) and return its length. Budgets as decoded_length().
+    n = 0
+    for chunk in decode_chunks(buf, stream_dict, stream_offset, endstream_offset, decrypt=decrypt):
+        sink(chunk)
+        n = n + len(chunk)
+        check_budget(n, limit, deadline)
+    return n
+
+
+def decoded_data(buf, stream_dict, stream_offset, endstream_offset, limit=None, deadline=None, decrypt=None):
+    # The complete decoded stream data (e.g. object streams). Budgets as decoded_length().
+    parts = []
+    n = 0
+    for chunk in decode_chunks(buf, stream_dict, stream_offset, endstream_offset, decrypt=decrypt):
+        parts.append(chunk)
+        n = n + len(chunk)
+        check_budget(n, limit, deadline, parts)
+    return b''.join(parts)
@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Cross-corpus stream deduplication (see --dedup FILE).
+#
+# PDFs made from the same templates embed the same fonts, ICC profiles and images. Before a stream
+# is decoded in-process, the raw bytes of its data (between "stream" and "endstream", see
+# pdfdecode.stream_data_extent()) are hashed together with its filter chain. The decoded length
+# depends only on these, so a persistent index in a SQLite file maps the hash to the decoded length,
+# the filters and raw length, the PDF the stream was first seen in and how often it was seen. A
+# stream that is in the index (or was seen earlier in the same PDF) is not decoded again. Only exact
+# results of the in-process decoder are indexed: streams that fall back to QPDF, encrypted streams
+# (see pdfcrypt.py) and streams cut short by a budget are always decoded, and an indexed length
+# larger than the stream budget is decoded again so that the budget hit is the same. The Sankey
+# data is the same with or without the index.
+#
+# The raw bytes of streams that were seen before in another PDF or earlier in the same PDF are
+# duplicates: each Layout reports them (duplicate_bytes). Streams reused from a previous revision
+# (see pdfrevision.py) are not hashed.
+#
+# Batch workers share the index: new entries are written at the end of each PDF in one
+# transaction (the database is in WAL mode so readers do not wait).
+#
+# NO_DEDUP (the default) decodes everything, like NO_PROFILE it is a no-op stand-in.
+#
+# Usage: pdfdedup.py INDEX [--top N]
+#
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+
+from pdfdecode import filter_chain, stream_data_extent, CHUNK_SIZE
+
+BUSY_TIMEOUT_SECS = 60      # How long a batch worker waits for another one's transaction
+DEFAULT_TOP = 20            # Streams listed by pdfdedup.py
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS streams (
+        hash TEXT PRIMARY KEY,          -- SHA-256 of the filter chain and the raw stream data
+        raw_length INTEGER NOT NULL,
+        decoded_length INTEGER NOT NULL,
+        filters TEXT NOT NULL,          -- e.g. 'FlateDecode', '' for none
+        origin TEXT,                    -- PDF the stream was first seen in (None: not a file or URL)
+        seen INTEGER NOT NULL           -- occurrences in all PDFs analyzed with the index
+    )''',
+]
+
+INDEXES = {}                # Open StreamIndex per path (per process)
+
+
+def stream_key(buf, stream_dict, stream_offset, endstream_offset):
+    # (hash, raw length, filters) of a stream: the SHA-256 of its filter chain and raw data
+    chain = filter_chain(stream_dict)
+    start, end = stream_data_extent(buf, stream_dict, stream_offset, endstream_offset)
+    h = hashlib.sha256(repr([(f, sorted(parms.items(), key=lambda kv: kv[0])) for f, parms in chain]).encode())
+    h.update(b'\0')
+    for i in range(start, end, CHUNK_SIZE):
+        h.update(buf[i:min(i + CHUNK_SIZE, end)])
+    return (h.hexdigest(), end - start, ' '.join(f for f, _ in chain))
+
+
+class StreamIndex:
+    # The persistent index of a --dedup FILE
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECS, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.execute('PRAGMA journal_mode=WAL')
+        with self.db:
+            for statement in SCHEMA:
+                self.db.execute(statement)
+
+    def get(self, key):
+        # (decoded length, origin) of an indexed stream or None
+        with self.lock:
+            return self.db.execute('SELECT decoded_length, origin FROM streams WHERE hash = ?', (key,)).fetchone()
+
+    def update(self, new, seen):
+        # Add new entries (hash -> (raw length, decoded length, filters, origin, occurrences)) and
+        # count the occurrences of indexed streams (hash -> occurrences) in one transaction
+        with self.lock, self.db:
+            self.db.executemany('INSERT OR IGNORE INTO streams VALUES (?, ?, ?, ?, ?, ?)', [(k,) + v for k, v in new.items()])
+            self.db.executemany('UPDATE streams SET seen = seen + ? WHERE hash = ?', [(n, k) for k, n in seen.items()])
+
+    def close(self):
+        self.db.close()
+
+
+def open_index(path):
+    # The StreamIndex of path, opened once per process (batch workers analyze many PDFs)
+    path = os.path.abspath(path)
+    if (path not in INDEXES):
+        INDEXES[path] = StreamIndex(path)
+    return INDEXES[path]
+
+
+class NoDedup:
+    # Stream deduplication off
+
+    duplicate_bytes = None
+
+    def lookup(self, buf, stream_dict, stream_offset, endstream_offset):
+        # (key, decoded length or None): None when the stream has to be decoded
+        return (None, None)
+
+    def record(self, key, decoded_length):
+        pass
+
+    def done(self):
+        pass
+
+
+NO_DEDUP = NoDedup()
+
+
+class StreamDedup(NoDedup):
+    # Stream deduplication of one PDF with a StreamIndex. origin identifies the PDF (its absolute
+    # path or URL, None for bytes) so that streams it shares with itself on a second analysis are
+    # not duplicates. Called from the decoding threads (see pdflayout.StreamJobs).
+
+    def __init__(self, index, origin=None):
+        self.index = index
+        self.origin = origin
+        self.duplicate_bytes = 0
+        self.duplicate_streams = 0
+        self.known = {}             # hash -> decoded length of the streams of this PDF (None: not decoded in-process)
+        self.counts = {}            # hash -> occurrences in this PDF
+        self.indexed = set()        # hashes that were in the index
+        self.new = {}               # hash -> (raw length, decoded length, filters, origin) to add to the index
+        self.lock = threading.Lock()
+
+    def lookup(self, buf, stream_dict, stream_offset, endstream_offset):
+        key, raw_length, filters = stream_key(buf, stream_dict, stream_offset, endstream_offset)
+        with self.lock:
+            repeat = key in self.counts
+            self.counts[key] = self.counts.get(key, 0) + 1
+            if repeat:
+                self.duplicate(raw_length)
+                return ((key, raw_length, filters), self.known.get(key))
+        entry = self.index.get(key)
+        with self.lock:
+            if (entry is None):
+                return ((key, raw_length, filters), None)
+            if (entry[1] is None) or (entry[1] != self.origin):
+                self.duplicate(raw_length)
+            self.indexed.add(key)
+            self.known[key] = entry[0]
+            return ((key, raw_length, filters), entry[0])
+
+    def duplicate(self, raw_length):
+        self.duplicate_bytes = self.duplicate_bytes + raw_length
+        self.duplicate_streams = self.duplicate_streams + 1
+
+    def record(self, key, decoded_length):
+        # The exact decoded length of a stream that was decoded in-process
+        key, raw_length, filters = key
+        with self.lock:
+            self.known[key] = decoded_length
+            if (key not in self.indexed):
+                self.new[key] = (raw_length, decoded_length, filters, self.origin)
+
+    def done(self):
+        # Add the new streams to the index and count the occurrences of the indexed ones
+        with self.lock:
+            new = { k: v + (self.counts[k],) for k, v in self.new.items() }
+            seen = { k: self.counts[k] for k in self.indexed }
+            if (len(new) > 0) or (len(seen) > 0):
+                self.index.update(new, seen)
+            self.new = {}
+            self.indexed = set()
+            self.counts = {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize a stream deduplication index (see sankey-pdf.py --dedup).')
+    parser.add_argument('index', help='Stream index database')
+    parser.add_argument('--top', help='List the N streams seen most often (default: %(default)d)', type=int, default=DEFAULT_TOP, metavar='N')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.index):
+        print('ERROR: no stream index %s' % args.index, file=sys.stderr)
+        return 1
+    index = StreamIndex(args.index)
+    streams, raw, decoded, seen, duplicate = index.db.execute(
+        'SELECT COUNT(*), TOTAL(raw_length), TOTAL(decoded_length), TOTAL(seen), TOTAL((seen - 1) * raw_length) FROM streams').fetchone()
+    print('%d distinct streams (%d raw bytes, %d decoded bytes), seen %d times: %d raw bytes of repeats not decoded again' % (streams, raw, decoded, seen, duplicate))
+    for row in index.db.execute('SELECT seen, raw_length, decoded_length, filters, origin FROM streams WHERE seen > 1 ORDER BY (seen - 1) * raw_length DESC LIMIT ?', (args.top,)):
+        print('%6d x %10d bytes (%d decoded) %-20s first in %s' % row)
+    index.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Sampling estimation of uncompressed stream sizes - see --estimate.
+#
+# Streams are stratified by filter chain, stream dictionary /Type and /Subtype and compressed size
+# class (powers of 4). Per stratum only a few streams spread evenly over the file are decoded (the
+# sample), every other stream gets the stratum's compression ratio (ratio estimator: sum of the
+# uncompressed sizes / sum of the compressed sizes of the sample) times its compressed size.
+#
+# Confidence intervals are 95% intervals of the ratio from the residuals of the sample (Student's t,
+# finite population correction). A stratum with a single sample has no spread of its own and borrows
+# the relative spread of all samples in the file. The interval of the total adds up the variances
+# of the strata. Decoded (sampled) streams are exact.
+#
+# The estimator only sees (key, id, compressed size) and (id, uncompressed size) - pdflayout.py
+# decides which objects are streams and does the decoding.
+#
+
+import math
+
+DEFAULT_SAMPLES = 5             # Streams decoded per stratum. See --estimate
+SIZE_CLASS_BITS = 2             # Compressed size classes are powers of 2**SIZE_CLASS_BITS
+
+# Two-sided 95% Student's t quantiles by degrees of freedom (normal beyond)
+T_95 = [None, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+Z_95 = 1.960
+
+
+def t_95(df):
+    return T_95[df] if (df < len(T_95)) else Z_95
+
+
+def stratum_key(stream_dict, compressed):
+    # (filters, /Type, /Subtype, size class) of a stream. stream_dict is None if it could not be parsed.
+    if (stream_dict is None):
+        return ('?', '', '', compressed.bit_length() // SIZE_CLASS_BITS)
+    filters = stream_dict.get('Filter')
+    if (filters is None):
+        filters = []
+    elif not isinstance(filters, list):
+        filters = [filters]
+    return (' '.join(str(f) for f in filters), str(stream_dict.get('Type', '')), str(stream_dict.get('Subtype', '')),
+            compressed.bit_length() // SIZE_CLASS_BITS)
+
+
+def ratio_spread(samples, population):
+    # (ratio, standard error of the ratio or None) of (compressed, uncompressed) samples out of population streams
+    n = len(samples)
+    c = sum(s[0] for s in samples)
+    ratio = sum(s[1] for s in samples) / c
+    if (n < 2):
+        return (ratio, None)
+    residuals = sum((u - ratio * k) ** 2 for k, u in samples) / (n - 1)
+    fpc = max(0.0, 1.0 - n / population)
+    return (ratio, math.sqrt(fpc * residuals / n) / (c / n))
+
+
+class Stratum:
+
+    def __init__(self):
+        self.members = []       # (id, compressed) in the order added
+        self.chosen = set()     # ids to decode
+        self.samples = []       # (compressed, uncompressed) of decoded streams
+
+
+class StreamEstimator:
+
+    def __init__(self, samples=DEFAULT_SAMPLES):
+        self.samples = samples
+        self.strata = {}        # key -> Stratum
+        self.stratum_of = {}    # id -> Stratum
+        self.exact = 0          # uncompressed bytes of the decoded streams
+
+    def add(self, key, id, compressed):
+        s = self.strata.get(key)
+        if (s is None):
+            s = self.strata[key] = Stratum()
+        s.members.append((id, compressed))
+        self.stratum_of[id] = s
+
+    def choose(self):
+        # Pick the sample of every stratum: streams spread evenly over the members (in the order added)
+        for s in self.strata.values():
+            n = min(self.samples, len(s.members))
+            s.chosen = { s.members[(2 * j + 1) * len(s.members) // (2 * n)][0] for j in range(n) }
+
+    def decode(self, id):
+        # True if the stream id is in the sample (or unknown)
+        s = self.stratum_of.get(id)
+        return (s is None) or (id in s.chosen)
+
+    def skipped(self):
+        return set(id for s in self.strata.values() for id, _ in s.members if (id not in s.chosen))
+
+    def observe(self, id, compressed, uncompressed, exact=True):
+        # Decoded size of a sampled stream. Inexact sizes (e.g. a budget ran out) are not used as samples.
+        self.exact = self.exact + uncompressed
+        s = self.stratum_of.get(id)
+        if (s is not None) and exact and (compressed > 0):
+            s.samples.append((compressed, uncompressed))
+
+    def estimates(self):
+        # Yields (id, compressed, estimate, low, high) for every stream that was not decoded and
+        # sets self.total, self.low and self.high (all stream data, decoded streams included)
+        everything = [x for s in self.strata.values() for x in s.samples]
+        if (len(everything) > 1):
+            pooled, pooled_se = ratio_spread(everything, len(self.stratum_of))
+            pooled_rel, pooled_t = (pooled_se / pooled, t_95(len(everything) - 1))
+        else:
+            # No spread known at all: +-100%
+            pooled = ratio_spread(everything, 1)[0] if (len(everything) > 0) else 1.0
+            pooled_rel, pooled_t = (1.0 / Z_95, Z_95)
+        self.total = self.exact
+        variance = 0.0
+        for s in self.strata.values():
+            rest = [(id, c) for id, c in s.members if (id not in s.chosen)]
+            if (len(rest) == 0):
+                continue
+            if (len(s.samples) == 0):
+                ratio, se, t = (pooled, pooled * pooled_rel, pooled_t)
+            else:
+                ratio, se = ratio_spread(s.samples, len(s.members))
+                t = t_95(len(s.samples) - 1)
+                if (se is None):
+                    se, t = (ratio * pooled_rel, pooled_t)
+            half = t * se
+            sum_c = 0
+            for id, c in rest:
+                estimate = max(c, round(ratio * c))
+                self.total = self.total + estimate
+                sum_c = sum_c + c
+                yield (id, c, estimate, max(c, round((ratio - half) * c)), max(c, round((ratio + half) * c)))
+            variance = variance + (se * sum_c) ** 2
+        half_total = Z_95 * math.sqrt(variance)
+        self.low = max(self.exact, round(self.total - half_total))
+        self.high = round(self.total + half_total)
+
+    def summary(self):
+        # After estimates()
+        decoded = sum(len(s.chosen) for s in self.strata.values())
+        return ('%d of %d streams estimated from %d decoded in %d strata: uncompressed stream data %d bytes (95%% CI %d-%d)' %
+                (len(self.stratum_of) - decoded, len(self.stratum_of), decoded, len(self.strata), self.total, self.low, self.high))
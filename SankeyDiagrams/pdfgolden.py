@@ -0,0 +1,374 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Golden-output equivalence harness: the Sankey CSV of the current pipeline (pdflayout.py) must
+# match that of the original grep + QPDF implementation of sankey-pdf.py (the "legacy" pipeline)
+# on valid PDFs, and must not get slower or use more memory than a reference run.
+#
+# For each PDF (the PDFs in this repository, the given PDFs/directories and with --synthetic the
+# PDFs made by pdfsynth.py, as pdfbench.py) the Sankey CSV rows are compared with:
+#
+# - the legacy pipeline: the first version of sankey-pdf.py taken from git (or --legacy SCRIPT or
+#   REV), run in a fresh process. It needs Linux, grep and qpdf, otherwise it is skipped.
+# - a golden CSV: GOLDENS/<name of the PDF without .pdf>.csv if there is one. The Sankey CSVs in
+#   this directory are the seed goldens (their PDFs are not in this repository, give them on the
+#   command line). --update-goldens writes the legacy CSVs as goldens.
+#
+# Rows are compared as (category, name, size, color), in any order. The 'Cavity N' numbering is
+# ignored (cavities are matched per category in file order). Tolerance for EOL differences:
+#
+# - the sizes of matching rows may differ by up to EOL_TOLERANCE bytes (a CR LF pair): the old
+#   grep regexes and the in-process scanner disagree on which object a trailing EOL belongs to
+# - cavities of up to CAVITY_TOLERANCE bytes may be only on one side: an EOL more or less
+#   accounted for an object can take a gap over or under the cavity threshold
+#
+# Anything else (a missing or extra row, another color, a larger size difference, a PDF that one
+# side can analyze but the other cannot) is a difference. Gates on the performance, against the
+# legacy runs and against a previous report of this harness or pdfbench.py (--baseline):
+#
+# - throughput: the bytes per second over all PDFs that both ran must be at least the reference's
+#   divided by --max-slowdown
+# - peak memory: the peak RSS of each PDF must be at most the reference's times --max-memory plus
+#   MEMORY_SLACK (the interpreter and module imports)
+#
+# Exits with 1 if any PDF differs or a gate fails. The JSON report has the pdfbench.py record of
+# each PDF (so it can be the --baseline of a later run) with the legacy record and the comparisons.
+#
+# Usage: pdfgolden.py [PDF or DIR ...] [--synthetic [SIZES]] [--legacy SCRIPT|REV] [--goldens DIR] [--baseline REPORT] [-o report.json]
+#
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from pdflayout import ANALYZER_VERSION
+from pdfbench import REPO_DIR, CORPUS_DIRS, DEFAULT_SIZES, corpus_pdfs, synthetic_variants, run_pdf, write_report
+from pdfsynth import synthetic_pdf
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+EOL_TOLERANCE = 2                   # Bytes a row size may differ by (see the module comment)
+CAVITY_TOLERANCE = 4                # Largest cavity that may be only on one side (bytes)
+MEMORY_SLACK = 16 * 1024 * 1024     # Peak RSS allowance on top of --max-memory (bytes)
+DEFAULT_MAX_SLOWDOWN = 1.2
+DEFAULT_MAX_MEMORY = 1.2
+LEGACY_TIMEOUT_SECS = 600           # Legacy pipeline run timeout per PDF (seconds)
+MAX_REPORTED = 20                   # Differing rows listed per comparison
+
+
+def parse_rows(csv):
+    # (category, name, size, color) of the rows of a Sankey CSV (the --estimate interval is dropped)
+    rows = []
+    for line in csv.splitlines():
+        if (line.strip() == ''):
+            continue
+        fields = line.split(',')
+        if (len(fields) < 3) or not fields[2].strip().isdigit():
+            raise ValueError('not a Sankey CSV row: %r' % line)
+        color = fields[3].strip() if (len(fields) > 3) else ''
+        rows.append((fields[0], fields[1], int(fields[2]), color))
+    return rows
+
+
+def is_cavity(row):
+    return row[1].startswith('Cavity ') and row[1][len('Cavity '):].isdigit()
+
+
+def row_groups(rows):
+    # Rows grouped by (category, name) in order, cavities by (category, 'Cavity'). Also returns
+    # the number of cavities of up to CAVITY_TOLERANCE bytes, which are left out.
+    groups = {}
+    small = 0
+    for row in rows:
+        if is_cavity(row):
+            if (row[2] <= CAVITY_TOLERANCE):
+                small = small + 1
+                continue
+            key = (row[0], 'Cavity')
+        else:
+            key = (row[0], row[1])
+        groups.setdefault(key, []).append(row)
+    return groups, small
+
+
+def compare_rows(expected, actual):
+    # Compare the rows of a Sankey CSV (actual) with the reference rows (expected). Returns a dict
+    # with 'status' 'equal', 'eol' (equal within the EOL tolerance) or 'different'.
+    result = { 'rows': len(expected), 'eol_rows': 0, 'small_cavities': [0, 0], 'different': [], 'missing': [], 'extra': [] }
+    exp_groups, result['small_cavities'][0] = row_groups(expected)
+    act_groups, result['small_cavities'][1] = row_groups(actual)
+    for key in exp_groups.keys() | act_groups.keys():
+        exp = exp_groups.get(key, [])
+        act = act_groups.get(key, [])
+        for e, a in zip(exp, act):
+            if (e[3] != a[3]) or (abs(e[2] - a[2]) > EOL_TOLERANCE):
+                result['different'].append([list(e), list(a)])
+            elif (e[2] != a[2]):
+                result['eol_rows'] = result['eol_rows'] + 1
+        result['missing'].extend(list(e) for e in exp[len(act):])
+        result['extra'].extend(list(a) for a in act[len(exp):])
+    if (len(result['different']) + len(result['missing']) + len(result['extra']) > 0):
+        result['status'] = 'different'
+    elif (result['eol_rows'] > 0) or (result['small_cavities'][0] != result['small_cavities'][1]):
+        result['status'] = 'eol'
+    else:
+        result['status'] = 'equal'
+    for k in ['different', 'missing', 'extra']:
+        result[k] = sorted(result[k])[:MAX_REPORTED]
+    return result
+
+
+def compare(reference, record):
+    # Compare the CSV of a pipeline run (record) with that of a reference run or golden CSV
+    if (reference.get('status') != 'ok'):
+        return None     # the reference cannot analyze this PDF: nothing to be equivalent to
+    if (record.get('status') != 'ok'):
+        return { 'status': 'different', 'error': record.get('error') }
+    try:
+        return compare_rows(parse_rows(reference['csv']), parse_rows(record['csv']))
+    except ValueError as e:
+        return { 'status': 'different', 'error': str(e) }
+
+
+def legacy_unavailable():
+    # Why the legacy pipeline cannot run here, or None
+    if ('linux' not in sys.platform):
+        return 'needs Linux'
+    for tool in ['grep', 'qpdf']:
+        if (shutil.which(tool) is None):
+            return 'needs ' + tool
+    return None
+
+
+def legacy_script(spec, tmpdir):
+    # Filename of the legacy sankey-pdf.py: spec is a script, a git revision or None for the
+    # commit that added sankey-pdf.py. Raises RuntimeError if git cannot provide it.
+    if (spec is not None) and os.path.isfile(spec):
+        return spec
+    git = ['git', '-C', SCRIPT_DIR]
+    try:
+        rev = spec
+        if (rev is None):
+            p = subprocess.run(git + ['log', '--diff-filter=A', '--format=%H', '--', 'sankey-pdf.py'], capture_output=True, text=True, check=True)
+            rev = p.stdout.split()[-1]
+        p = subprocess.run(git + ['show', rev + ':./sankey-pdf.py'], capture_output=True, check=True)
+    except (OSError, IndexError, subprocess.CalledProcessError) as e:
+        raise RuntimeError('cannot get the legacy sankey-pdf.py from git: %s' % (getattr(e, 'stderr', None) or e))
+    script = os.path.join(tmpdir, 'sankey-pdf-legacy.py')
+    with open(script, "wb") as f:
+        f.write(p.stdout)
+    return script
+
+
+def legacy_worker(job):
+    # Run the legacy pipeline on one PDF (in the harness's child process, so that the peak RSS of
+    # its children is that of this PDF's legacy process, grep and QPDF) and return the result record
+    record = { 'pdf': job['pdf'], 'file_size': os.path.getsize(job['pdf']), 'status': 'ok' }
+    fd, csvfile = tempfile.mkstemp(prefix='pdfgolden-', suffix='.csv')
+    os.close(fd)
+    os.remove(csvfile)
+    cmd = [sys.executable, job['script'], '-p', job['pdf'], '-c', csvfile]
+    if job['force']:
+        cmd.append('-f')
+    start = time.perf_counter()
+    try:
+        p = subprocess.run(cmd, capture_output=True, text=True, errors='replace', timeout=LEGACY_TIMEOUT_SECS)
+        if (p.returncode != 0) or not os.path.exists(csvfile):
+            lines = (p.stdout + p.stderr).strip().splitlines()
+            record['status'] = 'error'
+            record['error'] = 'exit code %d: %s' % (p.returncode, lines[-1] if (len(lines) > 0) else '')
+        else:
+            with open(csvfile, "rt") as f:
+                record['csv'] = f.read()
+    except subprocess.TimeoutExpired:
+        record['status'] = 'error'
+        record['error'] = 'timed out after %d seconds' % LEGACY_TIMEOUT_SECS
+    finally:
+        if os.path.exists(csvfile):
+            os.remove(csvfile)
+    record['seconds'] = round(time.perf_counter() - start, 6)
+    record['peak_rss'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    return record
+
+
+def run_legacy(pdf, script, force, repeat):
+    # Run the legacy worker in a fresh process repeat times, keep the fastest run
+    job = { 'pdf': pdf, 'script': script, 'force': force }
+    best = None
+    for _ in range(repeat):
+        p = subprocess.run([sys.executable, os.path.abspath(__file__), '--legacy-worker', json.dumps(job)], capture_output=True, text=True)
+        try:
+            record = json.loads(p.stdout.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            record = { 'pdf': pdf, 'status': 'error', 'error': 'legacy worker failed: %s' % p.stderr.strip()[-200:] }
+        if (best is None) or (record.get('seconds', float('inf')) < best.get('seconds', float('inf'))):
+            best = record
+    return best
+
+
+def golden_record(goldens, pdf):
+    # The golden CSV of a PDF as a result record, or None
+    golden = os.path.join(goldens, os.path.splitext(os.path.basename(pdf))[0] + '.csv')
+    if not os.path.isfile(golden):
+        return None
+    with open(golden, "rt") as f:
+        return { 'golden': golden, 'status': 'ok', 'csv': f.read() }
+
+
+def throughput(records):
+    # Bytes per second over the records
+    seconds = sum(r['seconds'] for r in records)
+    return (sum(r['file_size'] for r in records) / seconds) if (seconds > 0) else None
+
+
+def gates(results, reference, name, max_slowdown, max_memory):
+    # Throughput and peak memory gates of the results against the reference records (by PDF
+    # filename without directory, so synthetic PDFs in other temporary directories match).
+    # Returns a list of failure messages.
+    failures = []
+    by_name = { os.path.basename(r['pdf']): r for r in reference if (r.get('status') == 'ok') }
+    pairs = [(r, by_name[os.path.basename(r['pdf'])]) for r in results
+             if (r.get('status') == 'ok') and (os.path.basename(r['pdf']) in by_name)]
+    if (len(pairs) == 0):
+        return failures
+    new = throughput([r for r, _ in pairs])
+    ref = throughput([b for _, b in pairs])
+    if (new is not None) and (ref is not None) and (new < ref / max_slowdown):
+        failures.append('throughput %.0f bytes/s < %s %.0f bytes/s / %g' % (new, name, ref, max_slowdown))
+    for r, b in pairs:
+        if (r.get('peak_rss') is not None) and (b.get('peak_rss') is not None) and (r['peak_rss'] > b['peak_rss'] * max_memory + MEMORY_SLACK):
+            failures.append('%s: peak RSS %d > %s %d * %g + %d' % (r['pdf'], r['peak_rss'], name, b['peak_rss'], max_memory, MEMORY_SLACK))
+    return failures
+
+
+def check_pdf(pdf, options, args, script, goldens):
+    # Run both pipelines on a PDF and compare. Returns the pdfbench.py record with 'legacy',
+    # 'vs_legacy', 'golden' and 'vs_golden' entries.
+    record = run_pdf(pdf, options, args.repeat)
+    legacy = None
+    if (script is not None):
+        legacy = run_legacy(pdf, script, args.force, args.repeat)
+        record['vs_legacy'] = compare(legacy, record)
+        if args.update_goldens and (legacy['status'] == 'ok'):
+            golden = os.path.join(goldens, os.path.splitext(os.path.basename(pdf))[0] + '.csv')
+            with open(golden, "wt") as f:
+                f.write(legacy['csv'])
+    golden = golden_record(goldens, pdf)
+    if (golden is not None):
+        record['golden'] = golden['golden']
+        record['vs_golden'] = compare(golden, record)
+    record.pop('csv', None)
+    if (legacy is not None):
+        legacy.pop('csv', None)
+        record['legacy'] = legacy
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that the sankey-pdf.py pipeline gives the same Sankey CSV rows as the legacy grep + QPDF pipeline and golden CSVs, within throughput and peak memory gates.')
+    parser.add_argument('paths', help='PDFs or directory trees of PDFs (default: the PDFs in this repository unless --synthetic)', nargs='*')
+    parser.add_argument('-o', '--output', help='JSON report filename (default: stdout)', default='-')
+    parser.add_argument('-s', '--synthetic', help='Also check synthetic PDFs with each number of objects in the comma separated SIZES (default: %s)' % DEFAULT_SIZES, nargs='?', const=DEFAULT_SIZES, metavar='SIZES')
+    parser.add_argument('-n', '--repeat', help='Runs per PDF and pipeline, the fastest is kept (default: 1)', type=int, default=1)
+    parser.add_argument('-e', '--engine', help="As sankey-pdf.py -e/--engine", choices=['xref', 'scan'], default='xref')
+    parser.add_argument('-f', '--force', help='As sankey-pdf.py -f/--force, for both pipelines (needed for most synthetic PDFs)', action='store_true', default=False)
+    parser.add_argument('--legacy', help='Legacy sankey-pdf.py script or git revision of it (default: the commit that added sankey-pdf.py)', metavar='SCRIPT|REV')
+    parser.add_argument('--no-legacy', help='Only compare with the golden CSVs and --baseline', action='store_true', default=False, dest='no_legacy')
+    parser.add_argument('--goldens', help='Directory of golden Sankey CSVs named after the PDFs (default: %(default)s)', default=SCRIPT_DIR)
+    parser.add_argument('--update-goldens', help='Write the legacy CSV of each PDF into the --goldens directory', action='store_true', default=False, dest='update_goldens')
+    parser.add_argument('--baseline', help='Previous JSON report of pdfgolden.py or pdfbench.py to gate throughput and peak memory against')
+    parser.add_argument('--max-slowdown', help='Throughput gate: at least the reference throughput divided by this (default: %g)' % DEFAULT_MAX_SLOWDOWN, type=float, default=DEFAULT_MAX_SLOWDOWN, dest='max_slowdown')
+    parser.add_argument('--max-memory', help='Peak memory gate: at most the reference peak RSS of each PDF times this plus %d MB (default: %g)' % (MEMORY_SLACK // (1024 * 1024), DEFAULT_MAX_MEMORY), type=float, default=DEFAULT_MAX_MEMORY, dest='max_memory')
+    parser.add_argument('--legacy-worker', help=argparse.SUPPRESS, dest='legacy_worker')
+    args = parser.parse_args()
+
+    if (args.legacy_worker is not None):
+        print(json.dumps(legacy_worker(json.loads(args.legacy_worker))))
+        return 0
+
+    options = { 'engine': args.engine, 'force': args.force, 'aggregate': None, 'threads': 1, 'chunk_size': None, 'csv': True }
+    paths = args.paths
+    if (len(paths) == 0) and (args.synthetic is None):
+        paths = [os.path.join(REPO_DIR, d) for d in CORPUS_DIRS]
+    tmpdir = tempfile.mkdtemp(prefix='pdfgolden-')
+    report = { 'analyzer_version': ANALYZER_VERSION, 'python': platform.python_version(), 'platform': platform.platform(),
+               'options': dict(options, eol_tolerance=EOL_TOLERANCE, cavity_tolerance=CAVITY_TOLERANCE,
+                               max_slowdown=args.max_slowdown, max_memory=args.max_memory) }
+    try:
+        script = None
+        if args.no_legacy:
+            report['legacy'] = 'off'
+        elif (legacy_unavailable() is not None):
+            report['legacy'] = 'unavailable: ' + legacy_unavailable()
+        else:
+            try:
+                script = legacy_script(args.legacy, tmpdir)
+                report['legacy'] = args.legacy or 'first version'
+            except RuntimeError as e:
+                report['legacy'] = 'unavailable: ' + str(e)
+        if (script is None):
+            print('Legacy pipeline %s' % report['legacy'], file=sys.stderr)
+
+        pdfs = list(corpus_pdfs(paths))
+        synthetic = {}
+        if (args.synthetic is not None):
+            for n in [int(s) for s in args.synthetic.split(',')]:
+                for variant, kwargs in synthetic_variants(n):
+                    pdf = os.path.join(tmpdir, 'synthetic-%s-%d.pdf' % (variant, n))
+                    with open(pdf, "wb") as f:
+                        f.write(synthetic_pdf(**kwargs))
+                    synthetic[pdf] = dict(kwargs, variant=variant)
+                    pdfs.append(pdf)
+
+        results = []
+        for pdf in pdfs:
+            record = check_pdf(pdf, options, args, script, args.goldens)
+            if (pdf in synthetic):
+                record['synthetic'] = synthetic[pdf]
+            results.append(record)
+            statuses = ['%s: %s' % (k, record[k]['status']) for k in ['vs_legacy', 'vs_golden'] if (record.get(k) is not None)]
+            print('%s: %s' % (pdf, ', '.join([record['status']] + statuses)), file=sys.stderr)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    # Goldens without a PDF to check are reported (e.g. the seed goldens' PDFs are not in this repository)
+    checked = set(os.path.splitext(os.path.basename(pdf))[0] for pdf in pdfs)
+    report['goldens_unchecked'] = sorted(f for f in os.listdir(args.goldens) if f.endswith('.csv') and (f[:-len('.csv')] not in checked))
+
+    failures = []
+    for r in results:
+        for k in ['vs_legacy', 'vs_golden']:
+            if (r.get(k) is not None) and (r[k]['status'] == 'different'):
+                failures.append('%s: differs from the %s output' % (r['pdf'], k[len('vs_'):]))
+    if (script is not None):
+        failures.extend(gates(results, [r['legacy'] for r in results], 'legacy', args.max_slowdown, args.max_memory))
+    if (args.baseline is not None):
+        with open(args.baseline, "rt") as f:
+            failures.extend(gates(results, json.load(f).get('results', []), 'baseline', args.max_slowdown, args.max_memory))
+    report['results'] = results
+    report['failures'] = failures
+    write_report(report, args.output)
+    for failure in failures:
+        print('FAIL: ' + failure, file=sys.stderr)
+    return 1 if (len(failures) > 0) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1156 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# The PDF layout analysis behind sankey-pdf.py as importable functions, so that many PDFs
+# can be analyzed in one Python process (see --batch). Errors that used to exit() the script
+# raise LayoutError (or one of its subclasses) instead.
+#
+# Library entry point: analyze_layout(source, options) where source is a PDF filename, bytes or
+# a memoryview and options a LayoutOptions. It returns a Layout (Sankey data, CSV, warnings), does
+# not print anything (unless options.debug) and keeps no state between calls.
+#
+# Hostile PDFs cannot exhaust memory or time: the analysis runs within per-file budgets (see
+# pdfbudget.py). Objects whose sizes are estimates because a budget ran out are marked with an
+# 'estimated' entry and the analysis goes on. With --estimate only a stratified sample of the
+# streams is decoded and the other uncompressed sizes are extrapolated (see pdfestimate.py).
+# With a stream deduplication index (LayoutOptions.dedup) streams seen before in the corpus are
+# not decoded again (see pdfdedup.py).
+# Encrypted PDFs (standard security handler) are decrypted in-process with LayoutOptions.password
+# or the empty user password (see pdfcrypt.py).
+#
+# There is NO PDF PARSER USED HERE!!
+#
+
+import subprocess
+import os
+import pprint
+import re
+import mmap
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pdfscan import open_pdf_buffer, open_source_buffer, scan_markers, work_out_object_type, is_chunked
+from pdfsource import HTTPSource, is_url
+from pdfxref import xref_markers, XRefError
+from pdfmarkers import MarkerTable, NONE, HEADER, OBJ, TYPE, OBJSTM, XREFSTM, LINEARIZED, STREAM, ENDSTREAM, ENDOBJ, XREF, TRAILER, STARTXREF, EOF, CAVITY, TRUNCATED
+from pdfmarkers import TYPE_CODES, T_DICT, T_STREAM, T_XREF_STREAM, T_OBJECT_STREAM, LIGHTBLUE, RED, PURPLE, PALE_GREEN, PDF_FILE, MARKER, LINEARIZED_CATEGORY
+from pdfmarkers import ESTIMATED_CODES
+from pdfaggregate import Aggregator, DEFAULT_TOP_N
+from pdfprofile import NO_PROFILE
+from pdfdecode import parse_object_dict, decoded_length, decode_into, PDFSyntaxError, UnsupportedFilter, DecodeError, BudgetExceeded, CHUNK_SIZE
+from pdfbudget import Budget, TIME, MARKERS, DEFAULT_STREAM_BYTES, DEFAULT_TOTAL_BYTES, DEFAULT_MARKERS
+from pdfestimate import StreamEstimator, stratum_key
+from pdfrevision import NO_REVISIONS
+from pdfcavity import IntervalIndex
+from pdfobjstm import ObjectStream, ObjectStreamParser, ObjectIndex
+from pdfdedup import StreamDedup, NO_DEDUP, open_index
+from pdfcrypt import security_handler, password_key, NO_CRYPT, PasswordError, UnsupportedEncryption
+from pdfwriter import CSVWriter, open_output, debug_rows, is_sankey_row, sankey_row, csv_line
+
+pp = pprint.PrettyPrinter(indent=2, compact=False, width=180)
+
+# Constants
+ANALYZER_VERSION = '7'  # Bump whenever the analysis results change (part of the result cache key)
+MAX_MARKERS = 500       # Maximum number of markers before we assume things are too complex/big for D3 Sankey and aggregate.  See -f/--force and -a/--aggregate
+LINEARIZE_RANGE = 10    # How many markers after a Linearization marker should there be "startxref" / "%%EOF"
+STREAM_JOBS_AHEAD = 4   # Streams decoded ahead of the classification loop per decoding thread. See LayoutOptions.threads
+TIMEOUT_SECS = 10       # QPDF subprocess run timeout (seconds) when the analysis has no time budget (see LayoutOptions.timeout)
+
+
+class LayoutError(Exception):
+    # A PDF that cannot be analyzed. exit_code is what sankey-pdf.py used to exit() with.
+    def __init__(self, message, exit_code=-1):
+        super().__init__(message)
+        self.exit_code = exit_code
+
+
+class NotAPDFError(LayoutError):
+    # No "%PDF-x.y" header or too few objects
+    pass
+
+
+class StructureError(LayoutError):
+    # Markers that do not add up (mismatched keywords, unexpected marker sequences)
+    pass
+
+
+class QPDFError(LayoutError):
+    # The QPDF fallback is not installed or failed
+    pass
+
+
+class EncryptionError(LayoutError):
+    # An encrypted PDF that the password (or the empty user password) does not open
+    pass
+
+
+class LayoutOptions:
+    # Options of analyze_layout() - the sankey-pdf.py command line options of the same names
+    def __init__(self, force=False, keep=False, engine='xref', aggregate=None, chunk_size=None, debug=False, timeout=None, threads=1,
+                 max_stream_bytes=DEFAULT_STREAM_BYTES, max_decoded_bytes=DEFAULT_TOTAL_BYTES, max_markers=DEFAULT_MARKERS, estimate=None, dedup=None, password=''):
+        if (engine not in ['xref', 'scan']):
+            raise ValueError("engine must be 'xref' or 'scan', not %s" % repr(engine))
+        if (estimate is not None) and (estimate < 1):
+            raise ValueError('estimate must be at least 1 stream per stratum, not %d' % estimate)
+        self.force = force              # -f/--force
+        self.keep = keep                # -k/--keep
+        self.engine = engine            # -e/--engine
+        self.aggregate = aggregate      # -a/--aggregate (top N) or None
+        self.chunk_size = chunk_size    # --chunk-size in bytes (files only) or None to mmap
+        self.debug = debug              # -d/--debug: print internal data to stdout
+        self.threads = threads          # --threads: streams decoded concurrently (1: one at a time)
+        self.estimate = estimate        # --estimate: streams decoded per stratum or None to decode all
+        self.dedup = dedup              # --dedup: stream deduplication index filename or None
+        self.password = password        # --password: user or owner password of encrypted PDFs
+        # Budgets (see pdfbudget.py), None for unlimited
+        self.timeout = timeout                      # --timeout: seconds
+        self.max_stream_bytes = max_stream_bytes    # --max-stream-mb
+        self.max_decoded_bytes = max_decoded_bytes  # --max-decoded-mb
+        self.max_markers = max_markers              # --max-markers
+
+    def budget(self):
+        return Budget(self.timeout, self.max_decoded_bytes, self.max_stream_bytes, self.max_markers)
+
+    def cache_options(self):
+        # The options that change the result (part of a result cache key). Results that hit the
+        # time budget depend on the machine and are not cached (see sankey-pdf.py). A password is
+        # only in the key as a salted hash: a result is never served for another password.
+        options = { 'force': self.force, 'keep': self.keep, 'engine': self.engine, 'aggregate': self.aggregate,
+                    'max_stream_bytes': self.max_stream_bytes, 'max_decoded_bytes': self.max_decoded_bytes, 'max_markers': self.max_markers,
+                    'estimate': self.estimate }
+        if self.password:
+            options['password'] = password_key(self.password)
+        return options
+
+
+class Layout:
+    # Result of analyze_layout(): data is the list of Sankey data dicts, warnings the warning messages,
+    # budget_hits the number of objects estimated per budget that ran out and objects the
+    # pdfobjstm.ObjectIndex of the compressed objects (None for cached results) and duplicate_bytes
+    # the raw stream bytes seen before (see pdfdedup.py, None without an index or for cached results)
+    def __init__(self, data, warnings=(), budget_hits=None, objects=None, duplicate_bytes=None):
+        self.data = data
+        self.warnings = list(warnings)
+        self.budget_hits = dict(budget_hits or {})
+        self.objects = objects
+        self.duplicate_bytes = duplicate_bytes
+
+    def rows(self):
+        return list(sankey_rows(self.data))
+
+    def csv(self):
+        return ''.join(csv_lines(self.data))
+
+
+class QPDF:
+    # Runs QPDF on the PDF being analyzed - the fallback for streams the built-in decoder cannot
+    # handle. A PDF that is only in memory (pdf is None) is written to a temporary file on first use.
+    # Each call is killed when the time budget runs out (or after TIMEOUT_SECS if there is none),
+    # stream data is read incrementally and QPDF is killed once it is over the size budget.
+    def __init__(self, pdf, pdf_buf, profile=NO_PROFILE, budget=None, password=''):
+        self.pdf = pdf
+        self.pdf_buf = pdf_buf
+        self.password = password
+        self.profile = profile
+        self.budget = budget if (budget is not None) else Budget()
+        self.tmpfile = None
+        self.objects = set()            # object numbers QPDF was asked for (resolved in the latest revision)
+        self.lock = threading.Lock()    # QPDF is run from the stream decoding threads
+
+    def command(self, args):
+        self.profile.count('subprocesses')
+        with self.lock:
+            self.objects.update(a.split('=', 1)[1] for a in args if a.startswith('--show-object='))
+            if (self.pdf is None):
+                with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
+                    self.tmpfile = f.name
+                    for i in range(0, len(self.pdf_buf), CHUNK_SIZE):
+                        f.write(self.pdf_buf[i:i + CHUNK_SIZE])
+                self.pdf = self.tmpfile
+        if self.password:
+            args = ['--password=' + self.password] + args
+        return ['qpdf'] + args + [self.pdf]
+
+    def timeout(self):
+        left = self.budget.time_left()
+        return TIMEOUT_SECS if (left is None) else left
+
+    def run(self, args, text=False):
+        # QPDF with a small output (e.g. an object dictionary). Raises BudgetExceeded on timeout.
+        cmd = self.command(args)
+        try:
+            return subprocess.run(cmd, capture_output=True, timeout=self.timeout(), text=text)
+        except FileNotFoundError:
+            raise QPDFError('ERROR: QPDF is needed but not installed: ' + ' '.join(cmd))
+        except subprocess.TimeoutExpired:
+            raise BudgetExceeded(0, timeout=True)
+
+    def stream(self, obj_num, limit=None, sink=None):
+        # Decoded length of the stream of object obj_num, the data is fed to sink(chunk) if given.
+        # Raises BudgetExceeded after more than limit bytes or on timeout.
+        cmd = self.command(['--show-object='+str(obj_num), '--filtered-stream-data'])
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except FileNotFoundError:
+            raise QPDFError('ERROR: QPDF is needed but not installed: ' + ' '.join(cmd))
+        timed_out = []
+        timer = threading.Timer(self.timeout(), lambda: (timed_out.append(True), proc.kill()))
+        timer.start()
+        n = 0
+        try:
+            while True:
+                b = proc.stdout.read(CHUNK_SIZE)
+                if (len(b) == 0):
+                    break
+                n = n + len(b)
+                if (sink is not None):
+                    sink(b)
+                if (limit is not None) and (n > limit):
+                    raise BudgetExceeded(n)
+        finally:
+            timer.cancel()
+            if (proc.poll() is None):
+                proc.kill()
+            proc.wait()
+            proc.stdout.close()
+        if (len(timed_out) > 0):
+            raise BudgetExceeded(n, timeout=True)
+        return n
+
+    def close(self):
+        if (self.tmpfile is not None):
+            os.unlink(self.tmpfile)
+            self.tmpfile = None
+
+
+def uncompressed_stream_length(qpdf, pdf_buf, obj_num, obj_offset, stream_offset, endstream_offset, debugmode=False, profile=NO_PROFILE, budget=None, dedup=NO_DEDUP, crypt=NO_CRYPT, obj_gen=0):
+    # (decoded length, None) of the stream data between "stream" and "endstream", decoded in-process.
+    # Only falls back to a QPDF subprocess for filters that the built-in decoder cannot handle.
+    # If a budget runs out: (bytes decoded until then, name of the budget).
+    # Streams in the deduplication index are not decoded (unless over the stream budget). Encrypted
+    # streams are decrypted on the fly with the key of object obj_num obj_gen (see pdfcrypt.py) and
+    # are not deduplicated: the same raw bytes decrypt differently in another PDF.
+    if budget.expired():
+        return (0, TIME)
+    limit, limit_name = budget.stream_limit()
+    try:
+        try:
+            stm_dict = parse_object_dict(pdf_buf, obj_offset, stream_offset)
+            decrypt = crypt.stream_decrypt(obj_num, obj_gen, stm_dict)
+            key, n = dedup.lookup(pdf_buf, stm_dict, stream_offset, endstream_offset) if (decrypt is None) else (None, None)
+            if (n is not None) and ((limit is None) or (n <= limit)):
+                budget.spend(n)
+                profile.count('streams deduplicated')
+                return (n, None)
+            n = decoded_length(pdf_buf, stm_dict, stream_offset, endstream_offset, limit, budget.deadline, decrypt)
+            if (key is not None):
+                dedup.record(key, n)
+        except (PDFSyntaxError, UnsupportedFilter, DecodeError) as e:
+            if (debugmode):
+                print('Object %s: falling back to QPDF (%s)' % (obj_num, e))
+            n = qpdf.stream(obj_num, limit)
+    except BudgetExceeded as e:
+        n = e.decoded
+        estimated = TIME if e.timeout else limit_name
+    else:
+        estimated = None
+    budget.spend(n)
+    profile.count('streams decoded')
+    profile.count('bytes decoded', n)
+    return (n, estimated)
+
+
+def object_stream_data(qpdf, pdf_buf, obj_num, obj_offset, stream_offset, endstream_offset, debugmode=False, profile=NO_PROFILE, budget=None, dedup=NO_DEDUP, crypt=NO_CRYPT, obj_gen=0):
+    # (pdfobjstm.ObjectStream, None) of an object stream, parsed while it is decoded in-process.
+    # Object streams are always decoded (their offset tables are needed, not only their length).
+    # Encrypted object streams are decrypted on the fly (the objects in them are not encrypted again).
+    # If a budget runs out: (ObjectStream of the data decoded until then, name of the budget).
+    if budget.expired():
+        return (ObjectStream(), TIME)
+    limit, limit_name = budget.stream_limit()
+    parser = None
+    try:
+        try:
+            stm_dict = parse_object_dict(pdf_buf, obj_offset, stream_offset)
+            parser = ObjectStreamParser(stm_dict['N'], stm_dict['First'])
+            decode_into(parser.feed, pdf_buf, stm_dict, stream_offset, endstream_offset, limit, budget.deadline,
+                        crypt.stream_decrypt(obj_num, obj_gen, stm_dict))
+        except (PDFSyntaxError, UnsupportedFilter, DecodeError, KeyError) as e:
+            if (debugmode):
+                print('Object stream %s: falling back to QPDF (%s)' % (obj_num, e))
+            result = qpdf.run(['--show-object='+str(obj_num)], text=True)
+            if (result.returncode != 0):
+                raise QPDFError('ERROR: ' + pp.pformat(result))
+            result = result.stdout.splitlines()
+            m = re.search(r'(?<=/N)\s?\d+', result[1])
+            n = int(m.group(0))
+            m = re.search(r'(?<=/First)\s?\d+', result[1])
+            parser = ObjectStreamParser(n, int(m.group(0)))
+            qpdf.stream(obj_num, limit, parser.feed)
+    except BudgetExceeded as e:
+        estimated = TIME if e.timeout else limit_name
+    else:
+        estimated = None
+    if (parser is None):
+        objstm = ObjectStream()
+    else:
+        parser.close()
+        objstm = parser.objstm
+    budget.spend(objstm.length)
+    profile.count('streams decoded')
+    profile.count('bytes decoded', objstm.length)
+    return (objstm, estimated)
+
+
+def stream_job(t, i, obj_num, qpdf, pdf_buf, debugmode, profile, budget, dedup, crypt):
+    # (function, arguments) that decodes the stream of the XRef stream, object stream or stream
+    # object obj_num whose "X Y obj" (followed by a dictionary) is marker i, or None
+    kind = t.kind
+    offset = t.offset
+    if (kind[i] != OBJ) or (i + 4 >= len(t)):
+        return None
+    obj_gen = t.name(i).split(' ')[1] if crypt.encrypted else 0
+    if (kind[i + 2] == XREFSTM):
+        return (uncompressed_stream_length, (qpdf, pdf_buf, obj_num, offset[i], offset[i + 3], offset[i + 4], debugmode, profile, budget, dedup, crypt, obj_gen))
+    if (kind[i + 2] == OBJSTM):
+        return (object_stream_data, (qpdf, pdf_buf, obj_num, offset[i], offset[i + 3], offset[i + 4], debugmode, profile, budget, dedup, crypt, obj_gen))
+    if (kind[i + 2] == STREAM):
+        return (uncompressed_stream_length, (qpdf, pdf_buf, obj_num, offset[i], offset[i + 2], offset[i + 3], debugmode, profile, budget, dedup, crypt, obj_gen))
+    return None
+
+
+class StreamJobs:
+    # Stream decoding for the classification loop. With more than one thread, the streams are
+    # decoded on a thread pool (zlib releases the GIL while inflating and QPDF fallbacks are
+    # subprocesses) in marker order, at most STREAM_JOBS_AHEAD per thread ahead of the loop so
+    # that decoded object streams do not pile up. The loop takes the results in marker order, so
+    # the result (and which error is raised first) is the same as decoding one stream at a time.
+    # Streams of a previous revision of the PDF are not decoded again (see pdfrevision.py).
+    # crypt is the pdfcrypt.SecurityHandler of an encrypted PDF, set once the markers are found.
+    def __init__(self, qpdf, pdf_buf, debugmode=False, profile=NO_PROFILE, threads=1, revisions=NO_REVISIONS, dedup=NO_DEDUP):
+        self.qpdf = qpdf
+        self.args = (qpdf, pdf_buf, debugmode, profile, qpdf.budget, dedup)
+        self.crypt = NO_CRYPT
+        self.profile = profile
+        self.threads = threads
+        self.revisions = revisions
+        self.t = None
+        self.pool = None
+        self.futures = {}       # marker index -> Future, in marker order
+
+    def start(self, t, skip=()):
+        # t is the sorted marker table the classification loop is about to walk, skip the marker
+        # indices of streams it will not ask for (see --estimate)
+        self.t = t
+        if (self.threads > 1):
+            self.jobs = [(i, stream_job(t, i, t.name(i).split(' ', 1)[0], *self.args, self.crypt)) for i in range(len(t) - 1)
+                         if (t.kind[i] == OBJ) and (t.type[i + 1] == T_DICT) and (i not in skip)
+                         and (self.revisions.stream(t.offset[i]) is None)]
+            self.jobs = [(i, job) for i, job in self.jobs if (job is not None)]
+            self.next = 0
+            self.window = self.threads * STREAM_JOBS_AHEAD
+            if (len(self.jobs) > 1):
+                self.pool = ThreadPoolExecutor(self.threads, thread_name_prefix='pdflayout-stream')
+
+    def result(self, i, obj_num):
+        # Decoding result of the stream of object obj_num at marker i
+        result = self.revisions.stream(self.t.offset[i])
+        if (result is not None):
+            self.profile.count('streams reused')
+            return result
+        result = self.decode(i, obj_num)
+        # QPDF finds objects by number, so its results are only valid for this revision
+        if (obj_num not in self.qpdf.objects):
+            self.revisions.record(self.t.offset[i], result)
+        return result
+
+    def decode(self, i, obj_num):
+        if (self.pool is None):
+            fn, args = stream_job(self.t, i, obj_num, *self.args, self.crypt)
+            return fn(*args)
+        # Futures for markers the loop has gone past are never needed
+        for j in [j for j in self.futures if (j < i)]:
+            self.futures.pop(j).cancel()
+        while (self.next < len(self.jobs)) and (len(self.futures) < self.window):
+            j, (fn, args) = self.jobs[self.next]
+            self.futures[j] = self.pool.submit(fn, *args)
+            self.next = self.next + 1
+        future = self.futures.pop(i, None)
+        if (future is None):
+            fn, args = stream_job(self.t, i, obj_num, *self.args, self.crypt)
+            return fn(*args)
+        return future.result()
+
+    def close(self):
+        if (self.pool is not None):
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+
+
+def analyze(pdf, force=False, dont_delete=False, debugmode=False, warn=print, engine='xref', aggregate=None, chunk_size=None, profile=NO_PROFILE, budget=None, threads=1, estimate=None, revisions=NO_REVISIONS, objects=None, dedup=NO_DEDUP, password=''):
+    # Work out the layout of the PDF file or http(s) URL "pdf" (read with range requests, see
+    # pdfsource.py). Returns the data list for the Sankey D3 diagram
+    # (see write_csv()). force and dont_delete are the -f/--force and -k/--keep options.
+    # engine is how objects are located: 'xref' (cross-reference driven, falling back to 'scan'
+    # for broken files) or 'scan' (full-file keyword scan - also finds unreferenced objects).
+    # aggregate is the -a/--aggregate N option: keep the N largest objects as nodes and bucket the
+    # rest (see pdfaggregate.py). There is then no MAX_MARKERS limit and -k/--keep is ignored.
+    # Over MAX_MARKERS without force the PDF is aggregated with DEFAULT_TOP_N (and a warning).
+    # chunk_size (bytes) reads the file through a bounded chunk cache instead of mmap'ing it (see
+    # pdfscan.ChunkedBuffer) for PDFs larger than RAM. The result is the same.
+    # profile is a pdfprofile.Profile that records per-phase timings and counters.
+    # budget is the pdfbudget.Budget of the analysis (default: the default budgets).
+    # threads is the number of streams decoded concurrently (see StreamJobs).
+    # estimate is the number of streams per stratum decoded (see pdfestimate.py) or None for all.
+    # revisions is a pdfrevision.RevisionCache to reuse the analysis of a previous revision.
+    # objects is a pdfobjstm.ObjectIndex that the objects in object streams are added to.
+    # dedup is a pdfdedup.StreamDedup to skip decoding streams seen before.
+    # password opens an encrypted PDF (user or owner password, see pdfcrypt.py).
+    if (budget is None):
+        budget = Budget()
+    budget.start()
+    profile.phase('open')
+    if is_url(pdf):
+        in_pdf = None
+        pdf_buf = open_source_buffer(HTTPSource(pdf), chunk_size)
+        size = len(pdf_buf)
+    else:
+        size = os.path.getsize(pdf)     # phsyical file size (bytes)
+        in_pdf = open(pdf, "rb")
+        pdf_buf = open_pdf_buffer(in_pdf, chunk_size)
+    try:
+        # QPDF needs a local file: a temporary copy of a URL
+        return analyze_buffer(pdf if (in_pdf is not None) else None, pdf_buf, size, force, dont_delete, debugmode, warn, engine, aggregate, profile, budget, threads, estimate, revisions, objects, dedup, password)
+    finally:
+        profile.stop()
+        count_reads(profile, pdf_buf)
+        # Close the input PDF file
+        if isinstance(pdf_buf, mmap.mmap):
+            pdf_buf.close()
+        if (in_pdf is not None):
+            in_pdf.close()
+
+
+def count_reads(profile, pdf_buf):
+    # Bytes read (or transferred) and read requests of a ChunkedBuffer
+    if is_chunked(pdf_buf):
+        profile.count('bytes read', pdf_buf.bytes_read)
+        profile.count('read requests', pdf_buf.requests)
+
+
+def find_markers(pdf_buf, engine='xref', debugmode=False, profile=NO_PROFILE, budget=None):
+    # Locate all markers via the cross-reference information, or by a single-pass scan of the whole file.
+    # Returns (marker dict, 'xref' or 'scan' - how they were found). XRef streams are decoded within
+    # budget (see pdfxref.py).
+    if (engine == 'xref'):
+        try:
+            return (xref_markers(pdf_buf, budget=budget), 'xref')
+        except (XRefError, PDFSyntaxError) as e:
+            profile.count('xref fallbacks')
+            if (debugmode):
+                print('Cross-reference walk failed, falling back to full-file scan (%s)' % e)
+    return (scan_markers(pdf_buf), 'scan')
+
+
+def pdf_buffer(source):
+    # analyze_buffer() needs find()/rfind(): bytes and bytearray are used as they are, a memoryview
+    # of a whole bytes-like object is unwrapped and any other memoryview is copied
+    if isinstance(source, memoryview):
+        if isinstance(source.obj, (bytes, bytearray, mmap.mmap)) and source.c_contiguous and (source.nbytes == len(source.obj)):
+            return source.obj
+        return source.tobytes()
+    if isinstance(source, (bytes, bytearray, mmap.mmap)):
+        return source
+    raise TypeError('PDF source must be a filename, bytes, bytearray or memoryview, not %s' % type(source).__name__)
+
+
+def analyze_layout(source, options=None, profile=NO_PROFILE, revisions=NO_REVISIONS):
+    # Library entry point: work out the layout of a PDF given as a filename (str or path-like), an
+    # http(s) URL, a byte source (see pdfsource.py: an object with size, read(start, stop),
+    # bytes_read and requests) or its contents (bytes, bytearray or memoryview). options is a
+    # LayoutOptions (default: all off).
+    # revisions is a pdfrevision.RevisionCache for incremental re-analysis (see analyze()).
+    # Returns a Layout. Raises a LayoutError subclass for PDFs that cannot be analyzed.
+    if (options is None):
+        options = LayoutOptions()
+    warnings = []
+    budget = options.budget()
+    objects = ObjectIndex()
+    dedup = NO_DEDUP
+    if (options.dedup is not None):
+        origin = None
+        if isinstance(source, (str, os.PathLike)):
+            origin = os.fspath(source) if is_url(os.fspath(source)) else os.path.abspath(source)
+        dedup = StreamDedup(open_index(options.dedup), origin)
+    kwargs = { 'force': options.force, 'dont_delete': options.keep, 'debugmode': options.debug, 'warn': warnings.append,
+               'engine': options.engine, 'aggregate': options.aggregate, 'profile': profile, 'budget': budget,
+               'threads': options.threads, 'estimate': options.estimate, 'revisions': revisions,
+               'objects': objects, 'dedup': dedup, 'password': options.password }
+    try:
+        if isinstance(source, (str, os.PathLike)):
+            data = analyze(os.fspath(source), chunk_size=options.chunk_size, **kwargs)
+        elif hasattr(source, 'read') and hasattr(source, 'size'):
+            buf = open_source_buffer(source, options.chunk_size)
+            try:
+                data = analyze_buffer(None, buf, len(buf), **kwargs)
+            finally:
+                profile.stop()
+                count_reads(profile, buf)
+        else:
+            buf = pdf_buffer(source)
+            data = analyze_buffer(None, buf, len(buf), **kwargs)
+    except (AssertionError, IndexError) as e:
+        # The classification loop asserts the marker sequence of each object
+        raise StructureError('ERROR: unexpected marker sequence (%s)' % (str(e) or type(e).__name__), exit_code=-2) from e
+    finally:
+        # The streams decoded are indexed even if the analysis failed later on
+        dedup.done()
+    if (dedup.duplicate_bytes is not None):
+        profile.count('duplicate bytes', dedup.duplicate_bytes)
+    return Layout(data, warnings, budget.hits, objects, dedup.duplicate_bytes)
+
+
+def analyze_buffer(pdf, pdf_buf, size, force=False, dont_delete=False, debugmode=False, warn=print, engine='xref', aggregate=None, profile=NO_PROFILE, budget=None, threads=1, estimate=None, revisions=NO_REVISIONS, objects=None, dedup=NO_DEDUP, password=''):
+    # As analyze() but for an already opened buffer (bytes, mmap, ChunkedBuffer) of the PDF file "pdf" of size bytes.
+    # "pdf" is only needed for the QPDF fallback: if None the buffer is written to a temporary file for QPDF.
+    if (budget is None):
+        budget = Budget()
+    budget.start()
+    qpdf = QPDF(pdf, pdf_buf, profile, budget, password)
+    streams = StreamJobs(qpdf, pdf_buf, debugmode, profile, threads, revisions, dedup)
+    try:
+        return layout(qpdf, streams, pdf_buf, size, force, dont_delete, debugmode, warn, engine, aggregate, profile, budget, estimate, revisions, objects, password)
+    finally:
+        streams.close()
+        qpdf.close()
+
+
+def open_security_handler(pdf_buf, markers, password='', debugmode=False):
+    # The pdfcrypt.SecurityHandler of an encrypted PDF (NO_CRYPT if it is not). Encryption that
+    # pdfcrypt.py does not support is left to the QPDF fallback.
+    try:
+        return security_handler(pdf_buf, markers, password)
+    except PasswordError as e:
+        raise EncryptionError('ERROR: the PDF is encrypted and the password does not open it (%s). See --password' % e)
+    except (UnsupportedEncryption, PDFSyntaxError) as e:
+        if (debugmode):
+            print('Encryption: falling back to QPDF (%s)' % e)
+        return NO_CRYPT
+
+
+def truncate_markers(t, max_markers, size):
+    # Keep the first max_markers markers (sorted by offset) back to the start of the object that
+    # the cut is in, then one estimated TRUNCATED marker for the rest of the file
+    kind = t.kind
+    c = max(max_markers, kind.index(HEADER) + 1)
+    while (c > 0) and (kind[c] in [TYPE, OBJSTM, XREFSTM, LINEARIZED, STREAM, ENDSTREAM, ENDOBJ]):
+        c = c - 1
+    cut = t.offset[c]
+    t.take(list(range(c)))
+    t.append(TRUNCATED, cut, size=size - cut, estimated=ESTIMATED_CODES[MARKERS])
+
+
+def warn_overlaps(warn, coverage, describe, where='the PDF file'):
+    # One warning for the bytes of coverage (see pdfcavity.py) claimed more than once.
+    # describe(owner) names an owner.
+    start, end, owners = coverage.overlaps[0]
+    warn('WARNING: %d bytes of %s are claimed more than once (%d overlaps, %d extra claims), first %d-%d by %s' %
+         (coverage.overlap_bytes, where, len(coverage.overlaps), coverage.extra_bytes, start, end, ', '.join(describe(o) for o in owners)))
+
+
+def compressed_row(d):
+    # A row of an object stream as a compressed object (cavities have no type)
+    if ('type' in d):
+        d['type'] = 'Compressed ' + d['type']
+
+
+def plan_stream_sample(t, pdf_buf, samples):
+    # StreamEstimator (see pdfestimate.py) of the normal streams of the sorted marker table t,
+    # stratified by the stream dictionaries, with its sample chosen
+    estimator = StreamEstimator(samples)
+    kind = t.kind
+    offset = t.offset
+    for i in range(len(t) - 3):
+        if (kind[i] == OBJ) and (t.type[i + 1] == T_DICT) and (kind[i + 2] == STREAM):
+            compressed_data = offset[i + 3] - offset[i + 2] + len('endstream') + 1
+            try:
+                stm_dict = parse_object_dict(pdf_buf, offset[i], offset[i + 2])
+            except PDFSyntaxError:
+                stm_dict = None
+            estimator.add(stratum_key(stm_dict, compressed_data), i, compressed_data)
+    estimator.choose()
+    return estimator
+
+
+def layout(qpdf, streams, pdf_buf, size, force, dont_delete, debugmode, warn, engine, aggregate, profile, budget, estimate, revisions, objects, password=''):
+    # The layout analysis of analyze_buffer()
+    t = MarkerTable()               # Every marker, one typed array per column (see pdfmarkers.py)
+    cavity_count = 1                # Need to uniquely label each cavity for Sankey nodes 
+
+    # Find every marker (replaces a `grep -P` pass per marker)
+    profile.phase('markers')
+    revisions.start(pdf_buf, engine, profile, budget)
+    markers = revisions.markers(lambda: find_markers(pdf_buf, engine, debugmode, profile, budget))
+
+    # Find PDF header magic (might not be at physical file offset 0!)
+    result = markers['header']
+    if (len(result) == 0):
+        raise NotAPDFError('"%PDF-x.y" header could not be found! Not a PDF file...')
+    if (len(result) > 1):
+        warn('\n\nWARNING: More than one "%PDF-x.y" header was found! Huh???')
+    sof, hdr, _ = result[0]
+    if (sof > 0):
+        t.append(CAVITY, 0, num=cavity_count, size=sof, color=RED)
+        cavity_count = cavity_count + 1 
+    t.append(HEADER, sof, label=t.labels.code(hdr), size=len(hdr)+1, color=LIGHTBLUE)
+
+    # PDF conventional body indirect object marker "X Y obj"
+    result = markers['obj']
+    num_obj_keywords = len(result)
+    if (num_obj_keywords < 5):
+        raise NotAPDFError('ERROR: could not find sufficient "X Y obj" markers (%d found)!' % num_obj_keywords)
+    t.extend_objs(result)
+
+    # Primitive PDF object type classification markers.
+    # Want the first 2 non-whitespace bytes following "obj" to determine type of object.
+    # Re-use the byte-offsets from "X Y obj" above, skip over N x whitespace (EOLs, NUL, SPACE, etc) 
+    # to locate the first 2 non-whitespace bytes in a small buffer.
+    profile.phase('sniff')
+    sniffed = revisions.sniff(pdf_buf, result)      # start reading immediately after "X Y obj"
+    t.extend(TYPE, [m[0] for m in result], 
+             label=[t.labels.code(ty) for ty in sniffed], 
+             type=[TYPE_CODES[ty] for ty in sniffed], 
+             category=MARKER)
+    del sniffed
+    profile.phase('table')
+
+    # Object stream marker
+    t.extend(OBJSTM, [m[0] for m in markers['ObjStm']], type=T_OBJECT_STREAM, category=MARKER)
+
+    # Cross-reference stream marker
+    t.extend(XREFSTM, [m[0] for m in markers['XRef']], type=T_XREF_STREAM, category=MARKER)
+
+    # "stream" keyword - differentiated from "endstream" by the scanner
+    result = markers['stream']
+    num_stream = len(result)
+    t.extend(STREAM, [m[0] for m in result], type=T_STREAM, category=MARKER)
+
+    # "endstream" keyword
+    result = markers['endstream']
+    if (num_stream != len(result)):
+        raise StructureError('ERROR: "endstream" marker (%d) mismatch with "stream" (%d)!' % (len(result), num_stream))
+    if ((num_stream > num_obj_keywords) or (len(result) > num_obj_keywords)):
+        raise StructureError('ERROR: "endstream" (%d) / "stream" (%d) markers did not correlate with number of objects (%d)!' % (len(result), num_stream, num_obj_keywords))
+    t.extend(ENDSTREAM, [m[0] for m in result], type=T_STREAM, category=MARKER)
+
+    # "endobj" keyword
+    result = markers['endobj']
+    if (len(result) != num_obj_keywords):
+        raise StructureError('ERROR: "endobj" marker mismatch (%d found, %d expected)!' % (len(result), num_obj_keywords))
+    t.extend(ENDOBJ, [m[0] for m in result], category=MARKER)
+
+    # "xref" keyword - differentiated from "startxref" by the scanner
+    t.extend(XREF, [m[0] for m in markers['xref']], color=LIGHTBLUE)
+
+    # "trailer" keyword
+    t.extend(TRAILER, [m[0] for m in markers['trailer']], color=LIGHTBLUE)
+
+    # "startxref" keyword
+    result = markers['startxref']
+    num_startxrefs = len(result)
+    t.extend(STARTXREF, [m[0] for m in result], color=LIGHTBLUE)
+
+    # Linearization dictionary 
+    result = markers['Linearized']
+    if (len(result) > 1):
+        raise StructureError('ERROR: more than 1 /Linearized dictionary found! Huh???')
+    is_linearized = (len(result) > 0)
+    t.extend(LINEARIZED, [m[0] for m in result], category=MARKER, color=PURPLE)
+
+    # PDF "%%EOF" marker
+    result = markers['eof']
+    num_eofs = len(result)
+    t.extend(EOF, [m[0] for m in result], size=len('%%EOF')+1, color=LIGHTBLUE)
+
+    # Encrypted PDF: the file key is computed once, streams are then decrypted as they are decoded
+    profile.phase('encryption')
+    streams.crypt = open_security_handler(pdf_buf, markers, password, debugmode)
+    if streams.crypt.encrypted:
+        profile.count('encrypted')
+    profile.phase('table')
+
+    del markers
+    profile.count('objects', num_obj_keywords)
+    profile.count('markers', len(t))
+
+    # Sort everything by file byte offset. For each object, "X Y obj" will come first, then a type marker (dict, array, etc), 
+    # then either XRef or ObjStm (keys in the stream extent dict), then "stream" then "endstream" (if a stream) then "endobj"
+    profile.phase('sort')
+    t.sort()
+
+    # Over the markers budget the rest of the file becomes one estimated "Truncated" marker
+    if (budget.markers is not None) and (len(t) > budget.markers):
+        truncate_markers(t, budget.markers, size)
+        budget.hit(MARKERS)
+        num_eofs = t.kind.count(EOF)
+        num_startxrefs = t.kind.count(STARTXREF)
+    kind = t.kind
+    offset = t.offset
+
+    # Work out if the file ended correctly with a "%%EOF"
+    missing_last_eof = False
+    if (kind[-1] != EOF):
+        missing_last_eof = True
+
+    # Check physical file size in case of junk post-amble byte cavity
+    if (kind[-1] != TRUNCATED) and (size > (offset[-1] + len(t.name(-1)) + 2)):
+        t.append(CAVITY, offset[-1] + len('%%EOF') + 1, 
+                 num=cavity_count, 
+                 size=(size - offset[-1] - len('%%EOF') - 1), 
+                 color=RED)
+        cavity_count = cavity_count + 1
+
+    if (debugmode):
+        print("\n\nRaw sorted data (%d):" % len(t))
+        debug_rows(t.rows())
+
+    if (len(t) > MAX_MARKERS) and not force and (aggregate is None):
+        warn('WARNING: over %d markers were in the PDF file - too many for a Sankey diagram, aggregating (-a %d). Use -f/--force to keep them all.' % (MAX_MARKERS, DEFAULT_TOP_N))
+        aggregate = DEFAULT_TOP_N
+
+    if (num_startxrefs != num_eofs) and not force:
+        # @todo - work out how to determine end of Linearization section
+        raise StructureError('LOGIC ERROR: number of "%%%%EOF" (%d) did not match number of "startxref" keywords (%d) - possibly hybrid reference??' % (num_eofs, num_startxrefs), exit_code=-2)
+
+    profile.phase('classify')
+    first_obj_in_pdf = -1
+    object_streams = []
+    if (aggregate is not None):
+        agg = Aggregator(aggregate)     # Object stream contents go straight into the buckets
+    data_size = len(t)
+    types = t.type
+    if (estimate is not None):
+        profile.phase('sample')
+        estimator = plan_stream_sample(t, pdf_buf, estimate)
+        streams.start(t, estimator.skipped())
+        profile.phase('classify')
+    else:
+        estimator = None
+        streams.start(t)
+    claims = IntervalIndex()    # bytes each object or keyword accounts for (cavity and overlap detection)
+    i = 0
+    # Convert absolute file offsets to sizes, correct types for "X Y obj" and work out stream compressed/uncompressed lengths
+    while (i < data_size):
+        obj_num = -1            # for "X Y obj"
+        end_last_marker = -1    # the very end of the marker + 1
+        k = kind[i]
+        unit = i
+
+        if (debugmode):
+            print('%5d: %s' % (i, t.row(i)))
+
+        if (k in [HEADER, CAVITY, TRAILER, STARTXREF, XREF, EOF]):
+            # Work out size (if req'd) and where next object should start (cavity detection)
+            end_last_marker = offset[i] + len(t.name(i)) + 1
+            if (k == XREF) and ((i + 1) < data_size):
+                # Cross-reference table entries run up to the next marker (normally "trailer") - overhead, not a cavity
+                end_last_marker = offset[i + 1]
+            if (t.size[i] == NONE):
+                t.size[i] = end_last_marker - offset[i]
+            i = i + 1                             # Move to next item in data
+        elif (k == TRUNCATED):
+            # The rest of the file (over the markers budget)
+            end_last_marker = offset[i] + t.size[i]
+            i = i + 1
+        elif (k == OBJ):
+            # Start of an indirect object: "X Y obj"
+            if (first_obj_in_pdf < 0):
+                first_obj_in_pdf = i
+            obj_num = t.name(i).split(' ', 1)[0]
+            if (types[i + 1] == T_DICT) and (kind[i + 2] == XREFSTM):
+                assert (i + 6) < data_size
+                assert(kind[i + 3] == STREAM)
+                assert(kind[i + 4] == ENDSTREAM)
+                assert(kind[i + 5] == ENDOBJ)
+                t.set_name(i, 'XRef stream ' + obj_num)
+                # X Y obj, dict, XRef, stream, endstream, endobj
+                t.fill('type', i, i + 6, T_XREF_STREAM)
+                # Calculate compressed data length from "stream" and to after "endstream" keywords (i.e. keywords inclusive)
+                compressed_data = offset[i + 4] - offset[i + 3] + len('endstream') + 1
+                t.compressed[i] = compressed_data
+                # Calculate the decompressed length of the stream data, including "stream" and "endstream" keywords + EOLs
+                n, estimated = streams.result(i, obj_num)
+                if (estimated is not None):
+                    t.estimated[i] = ESTIMATED_CODES[estimated]
+                    budget.hit(estimated)
+                uncompressed_data = n + len('stream') + len('endstream') + 2
+                # EOLs can cause some mismatches for unfiltered streams
+                if (uncompressed_data < compressed_data):
+                    uncompressed_data = compressed_data
+                t.uncompressed[i] = uncompressed_data
+                # Work out size and where next object should start (cavity detection)
+                end_last_marker = offset[i + 5] + len('endobj') + 1
+                t.size[i] = end_last_marker - offset[i]
+                i = i + 6 # Skip over: dict, XRef, stream, endstream, endobj 
+            elif (types[i + 1] == T_DICT) and (kind[i + 2] == OBJSTM):
+                assert (i + 6) < data_size
+                assert(kind[i + 3] == STREAM)
+                assert(kind[i + 4] == ENDSTREAM)
+                assert(kind[i + 5] == ENDOBJ)
+                t.set_name(i, 'Object stream ' + obj_num)
+                # X Y obj, dict, ObjStm, stream, endstream, endobj
+                t.fill('type', i, i + 6, T_OBJECT_STREAM)
+                # Calculate compressed data length from "stream" and to after "endstream" keywords (i.e. keywords inclusive)
+                compressed_data = offset[i + 4] - offset[i + 3] + len('endstream') + 1
+                t.compressed[i] = compressed_data
+                # Work out size and where next object should start (cavity detection)
+                end_last_marker = offset[i + 5] + len('endobj') + 1
+                t.size[i] = end_last_marker - offset[i]
+                # Get the object stream offset table and the first bytes of its objects (see object_stream_data())
+                ostm, estimated = streams.result(i, obj_num)
+                # Calculate the decompressed length of the stream data, including "stream" and "endstream" keywords + EOLs
+                uncompressed_data = ostm.length + len('stream') + len('endstream') + 2
+                # EOLs can cause some mismatches for unfiltered streams
+                if (uncompressed_data < compressed_data):
+                    uncompressed_data = compressed_data
+                t.uncompressed[i] = uncompressed_data
+                # An estimated (partly decoded) object stream is not listed: its objects are unknown
+                if (estimated is not None):
+                    t.estimated[i] = ESTIMATED_CODES[estimated]
+                    budget.hit(estimated)
+                else:
+                    # Each object runs up to the next larger offset in the offset table (or the end of the data)
+                    objstm = []
+                    too_large = False
+                    members = IntervalIndex()       # Cavities and overlaps in the decoded data
+                    members.add(0, ostm.table_end, -1)
+                    for _, num, member_offset, member_size, head in ostm.members():
+                        # PDF string objects can have non-UTF-8 byte sequences so do as 2 chars rather than a string
+                        c1 = chr(head[0]) if (len(head) > 0) else ' '
+                        c2 = chr(head[1]) if (len(head) > 1) else ' '
+                        objstm.append({'category': 'Object stream ' + str(obj_num), 
+                                    'name': str(num) + ' 0 obj', 
+                                    'type': work_out_object_type(c1, c2),
+                                    'offset': member_offset, 
+                                    'size': member_size})
+                        members.add(member_offset, member_offset + member_size, num)
+                        if (num > MAX_MARKERS):
+                            too_large = True
+                    if (objects is not None):
+                        objects.add(int(obj_num), ostm)
+                    coverage = members.sweep(0, ostm.length)
+                    for start, end, _ in coverage.gaps:
+                        if ((end - start) > 3):
+                            objstm.append({'category': 'Object stream ' + str(obj_num), 
+                                           'name': 'Cavity ' + str(cavity_count), 
+                                           'offset': start, 
+                                           'size': end - start, 
+                                           'color': 'red'})
+                            cavity_count = cavity_count + 1
+                    if (len(coverage.overlaps) > 0):
+                        warn_overlaps(warn, coverage, lambda n: ('%d 0 obj' % n) if (n >= 0) else 'offset table', 'object stream ' + str(obj_num))
+                        profile.count('overlapping bytes', coverage.overlap_bytes)
+                    if (debugmode):
+                        print("\n\nObject stream %s (%d):" % (obj_num, len(objstm)))
+                        debug_rows(objstm)
+                    if too_large and not force and (aggregate is None):
+                        # Aggregate from now on, including the object streams so far
+                        warn('WARNING: objects over number %d were in a compressed object stream - too many for a Sankey diagram, aggregating (-a %d). Use -f/--force to keep them all.' % (MAX_MARKERS, DEFAULT_TOP_N))
+                        aggregate = DEFAULT_TOP_N
+                        agg = Aggregator(aggregate)
+                        for ostm in object_streams:
+                            for o in ostm:
+                                compressed_row(o)
+                                agg.add_compressed(o)
+                        object_streams = []
+                    if (aggregate is not None):
+                        for o in objstm:
+                            compressed_row(o)
+                            agg.add_compressed(o)
+                    else:
+                        object_streams.append(objstm)            
+                i = i + 6 # Skip over: dict, XRef, stream, endstream, endobj 
+            elif (types[i + 1] == T_DICT) and (kind[i + 2] == LINEARIZED):
+                # Linearized PDF - set category from 1st object in file to 1st '%%EOF'
+                # "X Y obj" / dict / Linearized / endobj
+                assert(kind[i + 3] == ENDOBJ)
+                assert(is_linearized)
+                assert(first_obj_in_pdf > 0)
+                # Recategorize from top of file to end of Linearization dictionary
+                t.fill('category', first_obj_in_pdf, i + 4, LINEARIZED_CATEGORY)
+                t.fill('color', first_obj_in_pdf, i + 4, PURPLE)
+                # Recategorize from next object to next '%%EOF' (inclusive)
+                if (num_eofs > 1) or (missing_last_eof and (num_eofs == 1)):
+                    j = kind.index(EOF, i + 4)
+                    t.fill('category', i + 4, j + 1, LINEARIZED_CATEGORY)
+                    t.fill('color', i + 4, j + 1, PURPLE)
+                # Work out size and where next object should start (cavity detection)
+                end_last_marker = offset[i + 3] + len('endobj') + 1
+                t.size[i] = end_last_marker - offset[i]
+                i = i + 4
+            elif (types[i + 1] == T_DICT) and (kind[i + 2] == STREAM):
+                # Normal stream
+                assert((i + 5) < data_size)
+                assert(kind[i + 3] == ENDSTREAM)
+                assert(kind[i + 4] == ENDOBJ)
+                # X Y obj, dict, stream, endstream, endobj
+                t.fill('type', i, i + 5, T_STREAM)
+                # Calculate compressed data length from "stream" and to after "endstream" keywords (i.e. keywords inclusive)
+                compressed_data = offset[i + 3] - offset[i + 2] + len('endstream') + 1
+                t.compressed[i] = compressed_data
+                # Calculate the decompressed length of the stream data, including "stream" and "endstream" keywords + EOLs
+                # (streams not in the --estimate sample are extrapolated after the loop)
+                if (estimator is None) or estimator.decode(i):
+                    n, estimated = streams.result(i, obj_num)
+                    if (estimated is not None):
+                        t.estimated[i] = ESTIMATED_CODES[estimated]
+                        budget.hit(estimated)
+                    uncompressed_data = n + len('stream') + len('endstream') + 2
+                    # EOLs can cause some mismatches for unfiltered streams
+                    if (uncompressed_data < compressed_data):
+                        uncompressed_data = compressed_data
+                    t.uncompressed[i] = uncompressed_data
+                    if (estimator is not None):
+                        estimator.observe(i, compressed_data, uncompressed_data, estimated is None)
+                # Work out size and where next object should start (cavity detection)
+                end_last_marker = offset[i + 4] + len('endobj') + 1
+                t.size[i] = end_last_marker - offset[i]
+                i = i + 5 # Skip over: dict, stream, endstream, endobj 
+            else:
+                # just a basic object: number, string, array, etc. Followed by "endobj" marker
+                assert(kind[i + 2] == ENDOBJ)
+                types[i] = types[i + 1]
+                # Work out size and where next object should start (cavity detection)
+                end_last_marker = offset[i + 2] + len('endobj') + 1
+                t.size[i] = end_last_marker - offset[i]
+                i = i + 3 # Skip over: type, endobj
+
+            # 'i' has now been updated index to the next core marker (keyword, "X Y obj", etc.)
+        else:
+            raise StructureError('LOGIC ERROR: unexpected marker at data[%d]!\n' % i + pp.pformat(t.row(i)), exit_code=-2)
+
+        # The marker just checked accounts for its size (incl. an EOL) from its offset on
+        claims.add(offset[unit], offset[unit] + t.size[unit], unit)
+
+    # Cavities: more than an EOL or two between the bytes accounted for and the next marker
+    coverage = claims.sweep()
+    for start, end, j in coverage.gaps:
+        if ((end - start) > 3):
+            t.append(CAVITY, start + 1, 
+                     category=t.category[j], 
+                     num=cavity_count, 
+                     size=(end - start - 1), 
+                     color=RED)
+            cavity_count = cavity_count + 1
+    if (len(coverage.overlaps) > 0):
+        warn_overlaps(warn, coverage, lambda j: t.name(j) + ' @ ' + str(offset[j]))
+        profile.count('overlapping bytes', coverage.overlap_bytes)
+    profile.count('cavities', cavity_count - 1)
+    if (estimator is not None):
+        # Extrapolate the uncompressed sizes of the streams that were not decoded
+        sample = ESTIMATED_CODES['sample']
+        for j, _, uncompressed_data, low, high in estimator.estimates():
+            t.uncompressed[j] = uncompressed_data
+            t.uncompressed_low[j] = low
+            t.uncompressed_high[j] = high
+            t.estimated[j] = sample
+            profile.count('streams estimated')
+        warn('ESTIMATE: ' + estimator.summary())
+    if (len(budget.hits) > 0):
+        warn('WARNING: budgets ran out, sizes are estimated: ' + budget.summary())
+
+    # Inter-object cavities (if any) were added at the end of the table so sort again by offset
+    if (len(t) > data_size):
+        if (debugmode):
+            print("\n\nCavities (%d):" % (len(t) - data_size))
+            debug_rows(map(t.row, range(data_size, len(t))))
+        profile.phase('sort')
+        t.sort()
+        kind = t.kind
+    # Every stream is decoded: remember this revision for the next one (unless markers were cut off)
+    revisions.done(MARKERS not in budget.hits)
+    profile.phase('recategorize')
+
+    # Process for Incremental Updates by looking for "%%EOF" and allowing for Linearization.
+    # Everything after the N-th "%%EOF" is Incremental Update N (N-1 if the first is the end of the Linearization)
+    eofs = t.indices('kind', EOF) + [len(t) - 1]
+    category = t.category
+    for n in range(1, len(eofs)):
+        incremental_update = (n - 1) if is_linearized else n
+        if (incremental_update > 0):
+            c = t.categories.code('Incremental Update ' + str(incremental_update))
+            for j in range(eofs[n - 1] + 1, eofs[n] + 1):
+                if (category[j] == PDF_FILE):
+                    category[j] = c
+                    t.color[j] = PALE_GREEN
+
+    if (debugmode):
+        print("\n\nAfter Incremental Updates:")
+        debug_rows(t.rows())
+
+    # Extract Linearization to make it a separate Sankey node
+    if is_linearized:
+        linearize = t.indices('category', LINEARIZED_CATEGORY)
+        sum_linearization = sum(t.size[j] for j in linearize if (t.size[j] != NONE))
+        # Append copies of the Linearization markers then make the originals Markers (purged below)
+        data_size = len(t)
+        t.take(list(range(data_size)) + linearize)
+        for j in linearize:
+            t.category[j] = MARKER
+        # Change the first to be the node grouping. Everything else is a Marker and will be purged 
+        t.category[first_obj_in_pdf] = PDF_FILE
+        t.set_name(first_obj_in_pdf, 'Linearized')
+        t.color[first_obj_in_pdf]    = PURPLE
+        t.size[first_obj_in_pdf]     = sum_linearization
+        if (debugmode):
+            print("\n\nLinearize (%d):" % len(linearize))
+            debug_rows(map(t.row, range(data_size, len(t))))
+            print("\n\nAfter Linearization:")
+            debug_rows(t.rows())
+
+    #####################################################
+    # CAN NO LONGER SORT by file offset!!!
+    # ...because we have clustered the Linearization data
+    #####################################################
+
+    profile.phase('rows')
+    if (aggregate is not None):
+        # Stream every non-marker row into the aggregation buckets - the full data list is never built
+        for i in range(len(t)):
+            if (t.category[i] != MARKER):
+                agg.add(t.row(i))
+        data = agg.rows()
+        if (debugmode):
+            print('\n\nAggregated %d rows into %d' % (agg.count, len(data)))
+            debug_rows(data)
+    else:
+        # Purge all markers (a mask over the category column) to compact data 
+        # Use -k/--keep to keep everything
+        if (not dont_delete):
+            t.purge(map(MARKER.__ne__, t.category))
+            if (debugmode):
+                print('\n\nPurge done')
+
+        # Only now turn the remaining markers into Sankey data dicts
+        data = list(t.rows())
+
+        # Append object streams after the "PDF File" categories
+        for ostm in object_streams:
+            for o in ostm:
+                compressed_row(o)
+                data.append(o)
+    del t
+
+    # Cluster things by object type...
+    # Each stream comprises a dictionary (from "X Y obj" up to just before "stream" + "endobj") 
+    # + compressed stream data (incl. "stream" and "endstream" keywords). And we will also capture
+    # the uncompressed data size. 
+    profile.phase('cluster')
+    cluster = []
+    sum_dicts = 0
+    sum_arrays = 0
+    sum_numbers = 0
+    sum_strings = 0
+    sum_stream_dicts = 0
+    sum_stream_data_compressed = 0
+    sum_stream_data_uncompressed = 0
+    stream_dicts = []
+    compressed = []
+    uncompressed = []
+    cavities = []
+    overhead = []
+    for d in data:
+        if ('type' in d) and ('size' in d):
+            if ('dict' in d['type']):
+                cluster.append({'category':d['name'], 'name':'Dictionaries', 'size':d['size'], 'color':'wheat'})
+                sum_dicts = sum_dicts + d['size']
+            elif ('array' in d['type']):
+                cluster.append({'category':d['name'], 'name':'Arrays', 'size':d['size'], 'color':'lightcyan'})
+                sum_arrays = sum_arrays + d['size']
+            elif ('number' in d['type']):
+                cluster.append({'category':d['name'], 'name':'Numbers', 'size':d['size']})
+                sum_numbers = sum_numbers + d['size']
+            elif ('string' in d['type']):
+                cluster.append({'category':d['name'], 'name':'Strings', 'size':d['size']})
+                sum_string = sum_strings + d['size']
+            elif ('stream' in d['type']):
+                if ('compressed' in d) and ('uncompressed' in d):
+                    dict_size = d['size'] - d['compressed']
+                    if (dict_size < 0):
+                        dict_size = 0
+                    cluster.append({'category':d['name'], 'name':'Stream dicts', 'size':dict_size, 'color':'wheat'})
+                    stream_dicts.append({'category':'Stream dict ' + d['name'], 'name':'Dictionaries', 'size':dict_size, 'color':'wheat'})
+                    sum_stream_dicts = sum_stream_dicts + dict_size
+                    cluster.append({'category':d['name'], 'name':'Compressed ' + d['name'], 'size':d['compressed'], 'color':'MistyRose'})
+                    compressed.append({'category':'Compressed ' + d['name'], 'name':'Uncompressed data (estimated)' if ('estimated' in d) else 'Uncompressed data', 'size':d['uncompressed'], 'color':'MistyRose'})
+                    if ('uncompressed_low' in d):
+                        compressed[-1]['uncompressed_low'] = d['uncompressed_low']
+                        compressed[-1]['uncompressed_high'] = d['uncompressed_high']
+                    sum_stream_data_compressed   = sum_stream_data_compressed   + d['compressed']
+                    sum_stream_data_uncompressed = sum_stream_data_uncompressed + d['uncompressed']
+
+        if ('Cavity' in d['name']):
+            assert('size' in d)
+            cavities.append({'category':d['name'], 'name':'Cavities', 'size':d['size'], 'color':'red'})
+
+        if (d['name'] in ['startxref', 'trailer', 'xref', '%%EOF']) or ('%PDF-' in d['name']):
+            assert('size' in d)
+            overhead.append({'category':d['name'], 'name':'Overhead', 'size':d['size'], 'color':'lightblue'})
+
+    if (debugmode):
+        print('\n\nClustering done')
+
+    # Summarize clusters
+    data.extend(cluster)
+    data.extend(compressed)
+    data.extend(uncompressed)
+    data.extend(cavities)
+    data.extend(overhead)
+    if (sum_stream_dicts > 0):
+        data.append({'category':'Stream dicts', 'name':'Dictionaries', 'size':sum_stream_dicts, 'color':'wheat'})
+    if ((sum_dicts > 0) or (sum_stream_dicts > 0)):
+        data.append({'category':'Dictionaries', 'name':'Objects', 'size':sum_dicts + sum_stream_dicts, 'color':'wheat'})
+    if (sum_arrays > 0):
+        data.append({'category':'Arrays', 'name':'Objects', 'size':sum_arrays, 'color':'lightcyan'})
+    if (sum_numbers > 0):
+        data.append({'category':'Numbers', 'name':'Objects', 'size':sum_numbers})
+    if (sum_strings > 0):
+        data.append({'category':'Strings', 'name':'Objects', 'size':sum_strings})
+
+    return data
+
+
+
+def sankey_rows(data):
+    # The Sankey CSV rows as (Source, Target, Size (bytes), HTML color-name or None) tuples
+    for d in data:
+        if is_sankey_row(d):
+            yield sankey_row(d)
+
+
+def csv_lines(data):
+    # Sankey CSV lines (see pdfwriter.csv_line())
+    for d in data:
+        if is_sankey_row(d):
+            yield csv_line(d)
+
+
+def write_csv(data, csvfile, debugmode=False):
+    # Make the CSV file for Sankey D3 ("-" for stdout)
+    if (debugmode):
+        print(''.join(csv_lines(data)), end='')
+    writer = CSVWriter(open_output(csvfile))
+    writer.write_all(data)
+    writer.close()
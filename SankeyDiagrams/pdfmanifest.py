@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# SQLite manifest of the PDFs of directories that are profiled continuously (see sankey-pdf.py
+# --rescan DIR).
+#
+# The files table has a row per PDF: path, size, mtime, SHA-256 of the contents, analyzer version,
+# status (and error), wall time and per-phase timings and counters (see pdfprofile.py), and its
+# layout summary: the pdfcorpus.CorpusTotals of the PDF, with the values that queries select on in
+# indexed columns (cavity bytes, cavities, incremental updates, ...). The totals table holds the
+# corpus totals of all PDFs in the manifest.
+#
+# A rescan stats the directory tree and compares size and mtime with the manifest: only new and
+# changed PDFs (or all PDFs analyzed by another ANALYZER_VERSION) are analyzed again. A PDF that
+# was only touched (same SHA-256) is not analyzed, its row is just updated. With --password the
+# encrypted PDFs that could not be opened before (EncryptionError) are analyzed again. Results are
+# written in transactions of COMMIT_EVERY PDFs: each replaces the PDF's row and takes its previous
+# summary out of the corpus totals before adding the new one, so the totals always match the rows
+# (also after an interrupted rescan). Rows of PDFs that are gone are removed the same way.
+#
+# Queries never touch the PDFs, e.g. pdfmanifest.py DB --cavities 1000 (PDFs with more than 1000
+# bytes of cavities), --updates 2 (more than 2 incremental updates) or any --sql on the files table.
+#
+# Usage: pdfmanifest.py DB [--cavities N] [--updates K] [--errors] [--sql QUERY] [--totals OUT.json] [-c corpus.csv]
+#
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from pdfcorpus import CorpusTotals, save_totals
+from pdflayout import csv_lines
+
+SCHEMA_VERSION = 1
+MANIFEST_NAME = '.sankey-manifest.sqlite'   # Default manifest filename in the rescanned directory
+COMMIT_EVERY = 100                          # PDFs per transaction
+ENCRYPTION_ERROR = 'EncryptionError:'       # error of a PDF the password did not open (see pdflayout.EncryptionError)
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+    '''CREATE TABLE IF NOT EXISTS files (
+        path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        sha256 TEXT,
+        analyzer_version TEXT,
+        status TEXT NOT NULL,           -- 'ok' or 'error'
+        error TEXT,
+        analyzed_at REAL,               -- time.time() of the analysis
+        seconds REAL,                   -- wall time of the analysis
+        profile TEXT,                   -- JSON: per-phase timings and counters (pdfprofile.Profile.as_dict())
+        summary TEXT,                   -- JSON: pdfcorpus.CorpusTotals of the PDF
+        cavity_bytes INTEGER,
+        cavities INTEGER,
+        updates INTEGER,                -- incremental updates
+        linearized INTEGER,
+        stream_bytes INTEGER,           -- compressed stream data
+        uncompressed_bytes INTEGER,     -- decoded stream data
+        xref_bytes INTEGER              -- cross-reference tables and streams, trailers, startxref, %%EOF
+    )''',
+    'CREATE INDEX IF NOT EXISTS files_cavity_bytes ON files (cavity_bytes)',
+    'CREATE INDEX IF NOT EXISTS files_updates ON files (updates)',
+    'CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 1), summary TEXT NOT NULL)',
+]
+
+
+def walk_pdfs(root):
+    # (path, size, mtime_ns) of the PDFs below root, sorted per directory
+    for dirpath, dirs, files in os.walk(root):
+        dirs.sort()
+        for f in sorted(files):
+            if f.lower().endswith('.pdf'):
+                path = os.path.join(dirpath, f)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue        # removed since the directory was listed
+                yield (path, st.st_size, st.st_mtime_ns)
+
+
+def summary_columns(totals):
+    # The indexed columns of a PDF's layout summary
+    return (totals.kind_total('Cavities'), totals.kind_total('Cavities', counts=True), totals.updates, totals.linearized,
+            totals.kind_total('Stream data'), totals.uncompressed, totals.kind_total('Cross-reference'))
+
+
+class Manifest:
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        with self.db:
+            for statement in SCHEMA:
+                self.db.execute(statement)
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+            if (row is None):
+                self.db.execute("INSERT INTO meta VALUES ('schema', ?)", (str(SCHEMA_VERSION),))
+            elif (row[0] != str(SCHEMA_VERSION)):
+                raise ValueError('%s: manifest schema %s, expected %d' % (path, row[0], SCHEMA_VERSION))
+            self.db.execute("INSERT OR IGNORE INTO totals VALUES (1, ?)", (json.dumps(CorpusTotals().as_dict()),))
+
+    def close(self):
+        self.db.close()
+
+    def plan(self, root, version, retry_encrypted=False):
+        # Stat the tree below root. Returns (jobs, removed, unchanged): jobs are (path, size,
+        # mtime_ns, previous SHA-256 or None) of the new and changed PDFs (or analyzed by another
+        # version), removed the paths in the manifest that are gone. With retry_encrypted (a
+        # --password was given) the encrypted PDFs that could not be opened before are analyzed again.
+        root = os.path.abspath(root)
+        known = {}
+        prefix = os.path.join(root, '')
+        for path, size, mtime_ns, sha256, analyzer_version, status, error in self.db.execute(
+                'SELECT path, size, mtime_ns, sha256, analyzer_version, status, error FROM files WHERE path >= ? AND path < ?',
+                (prefix, prefix[:-1] + chr(ord(os.sep) + 1))):
+            retry = retry_encrypted and (status == 'error') and (error or '').startswith(ENCRYPTION_ERROR)
+            known[path] = (size, mtime_ns, sha256, analyzer_version, retry)
+        jobs = []
+        unchanged = 0
+        for path, size, mtime_ns in walk_pdfs(root):
+            k = known.pop(path, None)
+            if (k is not None) and (k[0] == size) and (k[1] == mtime_ns) and (k[3] == version) and not k[4]:
+                unchanged = unchanged + 1
+            else:
+                # A PDF to retry has the same contents: no previous SHA-256 so that it is analyzed
+                jobs.append((path, size, mtime_ns, k[2] if ((k is not None) and (k[3] == version) and not k[4]) else None))
+        return (jobs, sorted(known), unchanged)
+
+    def totals(self):
+        return CorpusTotals.from_dict(json.loads(self.db.execute('SELECT summary FROM totals WHERE id = 1').fetchone()[0]))
+
+    def update(self, records, version):
+        # Store the results of a rescan (dicts with pdf, size, mtime_ns, status and for analyzed PDFs
+        # sha256, seconds, profile, corpus (CorpusTotals.as_dict()) or error) in one transaction.
+        # Status 'unchanged' only updates the size and mtime.
+        with self.db:
+            totals = self.totals()
+            for r in records:
+                if (r['status'] == 'unchanged'):
+                    self.db.execute('UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?', (r['size'], r['mtime_ns'], r['pdf']))
+                    continue
+                self.take_out(totals, r['pdf'])
+                summary = CorpusTotals.from_dict(r['corpus']) if ('corpus' in r) else CorpusTotals()
+                if (r['status'] != 'ok'):
+                    summary.add_error()
+                totals.merge(summary)
+                self.db.execute('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                (r['pdf'], r['size'], r['mtime_ns'], r.get('sha256'), version, r['status'], r.get('error'),
+                                 time.time(), r.get('seconds'), json.dumps(r.get('profile')), json.dumps(summary.as_dict()))
+                                + summary_columns(summary))
+            self.save_totals(totals)
+
+    def remove(self, paths):
+        # Remove the rows of PDFs that are gone, in one transaction
+        with self.db:
+            totals = self.totals()
+            for path in paths:
+                self.take_out(totals, path)
+            self.save_totals(totals)
+
+    def take_out(self, totals, path):
+        # Delete the row of a PDF and take its summary out of the corpus totals
+        row = self.db.execute('SELECT summary FROM files WHERE path = ?', (path,)).fetchone()
+        if (row is not None):
+            totals.merge(CorpusTotals.from_dict(json.loads(row[0])), sign=-1)
+            self.db.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def save_totals(self, totals):
+        self.db.execute('UPDATE totals SET summary = ? WHERE id = 1', (json.dumps(totals.as_dict()),))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the manifest of sankey-pdf.py --rescan without touching the PDFs. Prints one path per line.')
+    parser.add_argument('manifest', help='Manifest database (see sankey-pdf.py --manifest)')
+    parser.add_argument('--cavities', help='PDFs with more than N bytes of cavities', type=int, metavar='N')
+    parser.add_argument('--updates', help='PDFs with more than K incremental updates', type=int, metavar='K')
+    parser.add_argument('--errors', help='PDFs that could not be analyzed, with the error', action='store_true', default=False)
+    parser.add_argument('--sql', help="Any SELECT, e.g. \"SELECT path, seconds FROM files ORDER BY seconds DESC LIMIT 10\"", metavar='QUERY')
+    parser.add_argument('--totals', help='Write the corpus totals as a partial-aggregate file (see pdfcorpus.py)', metavar='OUT.json')
+    parser.add_argument('-c', '--csv', help='Write the corpus Sankey CSV (- for stdout)', dest='csvfile')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.manifest):
+        print('ERROR: no manifest %s' % args.manifest, file=sys.stderr)
+        return 1
+    manifest = Manifest(args.manifest)
+    queries = []
+    if (args.cavities is not None):
+        queries.append(('SELECT path, cavity_bytes FROM files WHERE cavity_bytes > ? ORDER BY cavity_bytes DESC', (args.cavities,)))
+    if (args.updates is not None):
+        queries.append(('SELECT path, updates FROM files WHERE updates > ? ORDER BY updates DESC', (args.updates,)))
+    if args.errors:
+        queries.append(("SELECT path, error FROM files WHERE status = 'error' ORDER BY path", ()))
+    if (args.sql is not None):
+        queries.append((args.sql, ()))
+    for sql, params in queries:
+        for row in manifest.db.execute(sql, params):
+            print('\t'.join('' if (v is None) else str(v) for v in row))
+    totals = manifest.totals()
+    if (args.totals is not None):
+        save_totals(totals, args.totals)
+    if (args.csvfile is not None):
+        out = sys.stdout if (args.csvfile == '-') else open(args.csvfile, "wt")
+        out.writelines(csv_lines(totals.rows()))
+        if (out is not sys.stdout):
+            out.close()
+    if (len(queries) == 0) and (args.totals is None) and (args.csvfile is None):
+        print('%d PDFs (%d bytes), %d errors, %d cavity bytes, %d incremental updates' % (totals.files, totals.file_bytes, totals.errors,
+              totals.kind_total('Cavities'), totals.updates))
+    manifest.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
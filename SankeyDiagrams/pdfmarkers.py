@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Columnar marker table used by pdflayout.py instead of one Python dict per marker.
+#
+# Each column is a typed array (stdlib `array` module): offsets and sizes are int64, marker
+# kinds, object types and colors are small integer codes and categories are codes into a
+# per-table string table. A marker costs ~55 bytes instead of a dict of strings (several hundred).
+# Sorting is a permutation applied to every column, purging is a mask and the Linearization
+# section is duplicated by index rather than deep-copied.
+#
+# Objects whose sizes are estimates because a budget ran out (see pdfbudget.py) have the budget's
+# code in the estimated column. TRUNCATED covers the end of a file that was not analyzed. Streams
+# estimated by sampling (see pdfestimate.py) also have a confidence interval of their uncompressed size.
+#
+# Marker names are derived from the kind ("12 0 obj", "endstream", "Cavity 3", ...) and only names
+# that cannot be derived are interned as labels (header text, sniffed type, renamed objects).
+# rows() turns markers back into the original dicts for debug output and the Sankey data list.
+#
+
+from array import array
+from itertools import compress
+from operator import itemgetter
+
+# Marker kinds
+HEADER, OBJ, TYPE, OBJSTM, XREFSTM, LINEARIZED, STREAM, ENDSTREAM, ENDOBJ, XREF, TRAILER, STARTXREF, EOF, CAVITY, TRUNCATED = range(15)
+
+# Names of the keyword marker kinds (others are derived, see MarkerTable.name())
+KEYWORDS = [None, None, None, 'ObjStm', 'XRef', 'Linearized', 'stream', 'endstream', 'endobj',
+            'xref', 'trailer', 'startxref', '%%EOF', None, 'Truncated']
+
+# Object types. Code 0 is "no type".
+TYPES = [None, 'array', 'name', 'literal-string', 'dict', 'null', 'bool', 'hex-string', 'number', '??',
+         'stream', 'XRef stream', 'Object stream']
+TYPE_CODES = {t: i for i, t in enumerate(TYPES)}
+T_DICT, T_STREAM, T_XREF_STREAM, T_OBJECT_STREAM = [TYPE_CODES[t] for t in ['dict', 'stream', 'XRef stream', 'Object stream']]
+
+# Sankey node colors. Code 0 is "no color".
+COLORS = [None, 'lightblue', 'red', 'MediumPurple', 'PaleGreen']
+LIGHTBLUE, RED, PURPLE, PALE_GREEN = range(1, len(COLORS))
+
+# Fixed category codes - every MarkerTable starts with these
+CATEGORIES = ['PDF file', 'Marker', 'Linearized']
+PDF_FILE, MARKER, LINEARIZED_CATEGORY = range(len(CATEGORIES))
+
+# Budgets (pdfbudget.py) or 'sample' (pdfestimate.py) in the estimated column. Code 0 is "not estimated".
+ESTIMATED = [None, 'time', 'stream bytes', 'decoded bytes', 'markers', 'sample']
+ESTIMATED_CODES = {e: i for i, e in enumerate(ESTIMATED)}
+
+NONE = -1           # Not set: size, compressed, uncompressed, num and label columns
+
+# (column, array typecode, default)
+COLUMNS = [('offset', 'q', 0), ('size', 'q', NONE), ('compressed', 'q', NONE), ('uncompressed', 'q', NONE),
+           ('uncompressed_low', 'q', NONE), ('uncompressed_high', 'q', NONE),
+           ('num', 'q', NONE), ('gen', 'i', 0), ('label', 'i', NONE),
+           ('category', 'i', PDF_FILE), ('kind', 'b', 0), ('type', 'b', 0), ('color', 'b', 0), ('estimated', 'b', 0)]
+
+
+class StringTable:
+    # Interned strings <-> small integer codes
+    def __init__(self, strings=()):
+        self.strings = []
+        self.codes = {}
+        for s in strings:
+            self.code(s)
+
+    def code(self, s):
+        c = self.codes.get(s)
+        if (c is None):
+            c = len(self.strings)
+            self.strings.append(s)
+            self.codes[s] = c
+        return c
+
+    def __getitem__(self, c):
+        return self.strings[c]
+
+
+class MarkerTable:
+
+    def __init__(self):
+        for col, tc, _ in COLUMNS:
+            setattr(self, col, array(tc))
+        self.categories = StringTable(CATEGORIES)
+        self.labels = StringTable()     # Names that cannot be derived
+
+    def __len__(self):
+        return len(self.offset)
+
+    def append(self, kind, offset, **values):
+        # Append one marker. values are column values, e.g. size=, category=, color=, num=
+        values['kind'] = kind
+        values['offset'] = offset
+        for col, _, default in COLUMNS:
+            getattr(self, col).append(values.get(col, default))
+
+    def extend(self, kind, offsets, **values):
+        # Append a marker of this kind at each of offsets. A column value is either one value
+        # for all the new markers or a sequence with one value per marker.
+        values['kind'] = kind
+        values['offset'] = offsets
+        n = len(offsets)
+        for col, tc, default in COLUMNS:
+            v = values.get(col, default)
+            if isinstance(v, int):
+                getattr(self, col).extend(array(tc, [v]) * n)
+            else:
+                getattr(self, col).extend(v)
+
+    def extend_objs(self, markers, **values):
+        # "X Y obj" markers from a list of (offset, "X Y obj", end). A name is only kept as a label
+        # if it cannot be derived from the numbers (e.g. "007 0 obj").
+        nums = []
+        gens = []
+        odd = []
+        for i, (_, text, _) in enumerate(markers, len(self)):
+            num, gen, _ = text.split(' ')
+            nums.append(int(num))
+            gens.append(int(gen))
+            if ('%d %d obj' % (nums[-1], gens[-1]) != text):
+                odd.append((i, text))
+        self.extend(OBJ, [m[0] for m in markers], num=nums, gen=gens, **values)
+        for i, text in odd:
+            self.set_name(i, text)
+
+    def set_name(self, i, name):
+        self.label[i] = self.labels.code(name)
+
+    def take(self, indices):
+        # Reorder (or duplicate) markers: row k becomes old row indices[k].
+        # itemgetter() gathers in C, but only returns a tuple for 2 or more indices.
+        if (len(indices) > 1):
+            get = itemgetter(*indices)
+        else:
+            get = lambda col: [col[i] for i in indices]
+        for col, tc, _ in COLUMNS:
+            setattr(self, col, array(tc, get(getattr(self, col))))
+
+    def sort(self):
+        # Stable sort by file offset: markers at the same offset keep the order they were added in
+        self.take(sorted(range(len(self)), key=self.offset.__getitem__))
+
+    def purge(self, mask):
+        # Keep only the markers where mask is true
+        mask = list(mask)
+        for col, tc, _ in COLUMNS:
+            setattr(self, col, array(tc, compress(getattr(self, col), mask)))
+
+    def fill(self, col, start, stop, value):
+        # Set col to value for markers [start, stop)
+        if (stop > start):
+            getattr(self, col)[start:stop] = array(getattr(self, col).typecode, [value]) * (stop - start)
+
+    def indices(self, col, value):
+        # Indices of the markers where col == value
+        return list(compress(range(len(self)), map(value.__eq__, getattr(self, col))))
+
+    def name(self, i):
+        if (self.label[i] != NONE):
+            return self.labels[self.label[i]]
+        k = self.kind[i]
+        if (k == OBJ):
+            return '%d %d obj' % (self.num[i], self.gen[i])
+        if (k == CAVITY):
+            return 'Cavity %d' % self.num[i]
+        return KEYWORDS[k]
+
+    def row(self, i):
+        # Marker i as a Sankey data dict
+        d = { 'category': self.categories[self.category[i]], 'name': self.name(i), 'offset': self.offset[i] }
+        if (self.type[i] != 0):
+            d['type'] = TYPES[self.type[i]]
+        if (self.color[i] != 0):
+            d['color'] = COLORS[self.color[i]]
+        for col in ['size', 'compressed', 'uncompressed', 'uncompressed_low', 'uncompressed_high']:
+            v = getattr(self, col)[i]
+            if (v != NONE):
+                d[col] = v
+        if (self.estimated[i] != 0):
+            d['estimated'] = ESTIMATED[self.estimated[i]]
+        return d
+
+    def rows(self):
+        return map(self.row, range(len(self)))
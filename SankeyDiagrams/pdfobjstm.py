@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Object streams (/Type /ObjStm) parsed in-process without keeping their decoded data.
+#
+# The decoded data of an object stream is an offset table of /N integer pairs (object number,
+# offset relative to /First) followed by the objects. Typing and sizing the compressed objects only
+# needs the offset table and the first HEAD_BYTES bytes of each object. ObjectStreamParser is fed
+# the decoded data chunk by chunk (by the in-process decoders or QPDF): it collects the first /First
+# bytes, parses the offset table, then copies only the first bytes at each object's offset and
+# counts the rest. Memory is the offset table plus HEAD_BYTES per object, however large the stream.
+#
+# Each object runs up to the next larger offset in the table or the end of the decoded data (see
+# pdfcavity.packed_ends()). ObjectIndex maps the object numbers of compressed objects to
+# (object stream number, index in the object stream, offset in the decoded data, size).
+#
+
+import re
+
+from pdfcavity import packed_ends
+from pdfdecode import PDFSyntaxError
+
+HEAD_BYTES = 2      # Bytes kept at the start of each object (see pdfscan.work_out_object_type())
+
+# Integers at the start of an object stream (the extent of its offset table)
+OFFSET_TABLE_REGEX = re.compile(rb'(?:[\x00\t\n\f\r ]*\d+)*')
+
+
+class ObjectStream:
+
+    def __init__(self, n=None, first=None):
+        self.n = n                  # /N (None if unknown)
+        self.first = first          # /First (None if unknown)
+        self.length = 0             # decoded bytes
+        self.table_end = 0          # end of the offset table in the decoded data
+        self.numbers = []           # object numbers in offset table order
+        self.offsets = []           # offsets in the decoded data (i.e. /First + offset in the table)
+        self.heads = []             # the first HEAD_BYTES bytes (or fewer) at each offset
+
+    def members(self):
+        # (index, object number, offset, size, head) of every object in offset table order
+        ends = packed_ends(self.offsets, self.length)
+        for j in range(len(self.offsets)):
+            yield (j, self.numbers[j], self.offsets[j], ends[j] - self.offsets[j], bytes(self.heads[j]))
+
+    def as_list(self):
+        # JSON-able form (see pdfrevision.py)
+        return [self.n, self.first, self.length, self.table_end, self.numbers, self.offsets,
+                [bytes(h).decode('latin-1') for h in self.heads]]
+
+    @classmethod
+    def from_list(cls, v):
+        objstm = cls(v[0], v[1])
+        objstm.length, objstm.table_end, objstm.numbers, objstm.offsets = v[2:6]
+        objstm.heads = [h.encode('latin-1') for h in v[6]]
+        return objstm
+
+
+class ObjectStreamParser:
+    # feed() it the decoded data of an object stream in order, close() it, then use objstm
+
+    def __init__(self, n, first):
+        if not isinstance(first, int) or (first < 0):
+            raise PDFSyntaxError('bad object stream /First %r' % (first,))
+        self.objstm = ObjectStream(n if isinstance(n, int) else None, first)
+        self.table = []         # decoded data up to /First, until the offset table is parsed
+        self.order = None       # object indices by offset
+        self.next = 0           # objects before self.order[self.next] have all their head bytes
+
+    def feed(self, chunk):
+        objstm = self.objstm
+        pos = objstm.length
+        objstm.length = pos + len(chunk)
+        if (self.order is None):
+            self.table.append(chunk[:objstm.first - pos])
+            if (objstm.length < objstm.first):
+                return
+            self.parse_table(b''.join(self.table))
+            self.table = None
+        offsets = objstm.offsets
+        heads = objstm.heads
+        end = objstm.length
+        j = self.next
+        while (j < len(self.order)) and (offsets[self.order[j]] < end):
+            k = self.order[j]
+            head = heads[k]
+            if (len(head) < HEAD_BYTES):
+                start = max(offsets[k] + len(head), pos)
+                head.extend(chunk[start - pos:offsets[k] + HEAD_BYTES - pos])
+            if (offsets[k] + HEAD_BYTES <= end) and (j == self.next):
+                # Offsets are sorted, so completed heads are a prefix of self.order
+                self.next = j + 1
+            j = j + 1
+
+    def close(self):
+        # End of the decoded data (which may be shorter than /First)
+        if (self.order is None):
+            self.parse_table(b''.join(self.table))
+            self.table = None
+
+    def parse_table(self, table):
+        objstm = self.objstm
+        objstm.table_end = OFFSET_TABLE_REGEX.match(table).end()
+        ints = [int(s) for s in table.split() if s.isdigit()]
+        pairs = len(ints) // 2
+        if (objstm.n is not None):
+            pairs = min(pairs, objstm.n)
+        objstm.numbers = [ints[2*j] for j in range(pairs)]
+        objstm.offsets = [objstm.first + ints[2*j + 1] for j in range(pairs)]
+        objstm.heads = [bytearray() for _ in range(pairs)]
+        self.order = sorted(range(pairs), key=objstm.offsets.__getitem__)
+
+
+class ObjectIndex:
+    # Compressed objects of a PDF: object number -> (object stream number, index, offset, size).
+    # If an object number is in more than one object stream, the last one added wins.
+
+    def __init__(self):
+        self.objects = {}
+
+    def add(self, container, objstm):
+        for index, num, offset, size, _ in objstm.members():
+            self.objects[num] = (container, index, offset, size)
+
+    def get(self, num):
+        return self.objects.get(num)
+
+    def __contains__(self, num):
+        return num in self.objects
+
+    def __len__(self):
+        return len(self.objects)
+
+    def items(self):
+        return self.objects.items()
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Per-phase timings and counters of one layout analysis - see --profile and pdfbench.py.
+#
+# The analysis is a sequence of phases, so a Profile is a lap timer: phase(name) ends the
+# current phase and starts the next one, stop() ends the last one. Time spent in a phase that
+# is entered more than once is summed. Counters are named integers.
+#
+# Phases of analyze() in order: open, markers (xref walk or keyword scan), sniff (object types),
+# table (marker table), encryption (file key of an encrypted PDF), sort, sample (--estimate),
+# classify (sizes, stream decoding and QPDF calls), recategorize (incremental updates and
+# Linearization), rows (purge or aggregation) and cluster. sankey-pdf.py adds cache (hashing and result cache lookups) and csv. Counters are:
+# objects, markers, cavities, streams decoded, streams estimated, bytes decoded, subprocesses,
+# xref fallbacks, bytes read and read requests (--chunk-size and URLs, see pdfsource.py), cache
+# hits, overlapping bytes (see pdfcavity.py), bytes reused and streams reused (see pdfrevision.py),
+# streams deduplicated and duplicate bytes (see pdfdedup.py), encrypted (see pdfcrypt.py).
+#
+# analyze() uses NO_PROFILE when no Profile is given: its methods do nothing, so the hooks
+# cost one method call per phase or counted event. A subclass can override phase() and count()
+# to hook into the analysis programmatically. count() may be called from the stream decoding
+# threads (see pdflayout.StreamJobs), phase() only from the analyzing thread.
+#
+
+import threading
+import time
+
+
+class Profile:
+
+    def __init__(self):
+        self.phases = {}        # phase name -> seconds, in the order the phases were first entered
+        self.counts = {}        # counter name -> int
+        self.current = None
+        self.started = 0.0
+        self.lock = threading.Lock()
+
+    def phase(self, name):
+        now = time.perf_counter()
+        if (self.current is not None):
+            self.phases[self.current] = self.phases.get(self.current, 0.0) + (now - self.started)
+        self.current = name
+        self.started = now
+
+    def stop(self):
+        if (self.current is not None):
+            self.phase(None)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def total(self):
+        return sum(self.phases.values())
+
+    def as_dict(self):
+        return { 'seconds': round(self.total(), 6), 'phases': { k: round(v, 6) for k, v in self.phases.items() },
+                 'counts': dict(self.counts) }
+
+    def report(self):
+        # Human readable lines: one per phase (seconds and share of the total), then the counters
+        total = self.total()
+        lines = ['%-14s %10.6f s %5.1f%%' % (k, v, (100.0 * v / total) if (total > 0) else 0.0) for k, v in self.phases.items()]
+        lines.append('%-14s %10.6f s' % ('total', total))
+        lines.extend('%-14s %10d' % (k, v) for k, v in self.counts.items())
+        return lines
+
+
+class NullProfile:
+    # Profiling off
+
+    def phase(self, name):
+        pass
+
+    def stop(self):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+
+NO_PROFILE = NullProfile()
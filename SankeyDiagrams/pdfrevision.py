@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Incremental re-analysis of PDFs that grew by incremental updates (see --cache).
+#
+# Incremental updates only ever append to a PDF, so a new revision of an already analyzed PDF
+# starts with the bytes of the previous revision, up to and including its last "%%EOF". After an
+# analysis the revision entry of the PDF is stored in the result cache: its marker dict (see
+# pdfscan.scan_markers()), the sniffed type of every object and the decoding results of its
+# streams, keyed by the SHA-256 of the whole file. Revisions are indexed by a hash of the first
+# bytes of the file (see head_span(): HEAD_BYTES, or a smaller power of two for shorter revisions),
+# with their length and a hash of their last TAIL_BYTES. A PDF is looked up under every span up to
+# its own, so that a revision shorter than HEAD_BYTES is found from its longer updates.
+#
+# When a PDF is analyzed, the longest indexed revision whose tail hash matches (and that ends with
+# "%%EOF", with or without an EOL, at the same offset) is a candidate prefix. The SHA-256 of the
+# new file up to that offset must then match a revision entry. Only the appended bytes are then
+# scanned (or their cross-reference sections walked), sniffed and decoded; the markers and results
+# of the prefix are reused. The classification loop still walks all markers, but it does no I/O or
+# decoding for the prefix. Anything unexpected in the appended bytes (e.g. an xref entry pointing
+# to an offset in the prefix that was not an object) means finding the markers of the whole file
+# again, which gives the same result.
+#
+# NO_REVISIONS (the default) analyzes everything, like NO_PROFILE it is a no-op stand-in.
+#
+
+import hashlib
+
+from pdfscan import scan_markers, sniff_object_type, MARKER_KINDS
+from pdfxref import xref_markers, XRefError
+from pdfdecode import PDFSyntaxError
+from pdfobjstm import ObjectStream
+
+HEAD_BYTES = 4096           # Revisions are indexed by a hash of at most this many bytes at the start of the file (a power of two)
+MIN_HEAD_BYTES = 64         # ... and at least this many (shorter revisions are not indexed)
+TAIL_BYTES = 4096           # Quick check of a candidate prefix: hash of its last bytes
+HASH_BLOCK_SIZE = 1024 * 1024
+MAX_REVISIONS = 64          # Revisions kept per index entry (newest first)
+EOLS = b'\r\n'
+
+
+def buffer_hash(buf, start, stop):
+    h = hashlib.sha256()
+    for i in range(start, stop, HASH_BLOCK_SIZE):
+        h.update(buf[i:min(i + HASH_BLOCK_SIZE, stop)])
+    return h.hexdigest()
+
+
+def ends_revision(buf, length):
+    # True if buf[:length] ends with "%%EOF" (and maybe an EOL), i.e. it could be a complete revision
+    return bytes(buf[max(0, length - 7):length]).rstrip(EOLS).endswith(b'%%EOF')
+
+
+def head_span(length):
+    # Bytes at the start of a revision of length bytes that its index key hashes: the largest power
+    # of two up to HEAD_BYTES, so a longer revision can look up every span a shorter one may have
+    # been indexed by. 0 if the revision is too short to be indexed.
+    span = HEAD_BYTES
+    while (span > length):
+        span = span // 2
+    return span if (span >= MIN_HEAD_BYTES) else 0
+
+
+class NoRevisions:
+    # Incremental re-analysis off
+
+    def start(self, pdf_buf, engine, profile, budget=None):
+        pass
+
+    def markers(self, find):
+        # find() finds all markers of the file: (marker dict, 'xref' or 'scan')
+        return find()[0]
+
+    def sniff(self, pdf_buf, objs):
+        return [sniff_object_type(pdf_buf, end) for _, _, end in objs]
+
+    def stream(self, offset):
+        return None
+
+    def record(self, offset, result):
+        pass
+
+    def done(self, complete):
+        pass
+
+
+NO_REVISIONS = NoRevisions()
+
+
+class RevisionCache(NoRevisions):
+    # Incremental re-analysis of one PDF with a pdfcache.ResultCache. content_hash is the SHA-256
+    # of the whole PDF (as for the result cache key) and version the ANALYZER_VERSION. password is
+    # the pdfcrypt.password_key() of the password (None without one): revisions analyzed with one
+    # password are not reused with another one.
+
+    def __init__(self, cache, content_hash, version, password=None):
+        self.cache = cache
+        self.content_hash = content_hash
+        self.version = version
+        self.password = password
+        self.prefix = None          # revision entry reused for the start of the file or None
+        self.method = None          # how the markers were found: 'xref' or 'scan'
+        self.found = None           # marker dict
+        self.sniffed = None         # sniffed types of found['obj']
+        self.streams = {}           # object offset -> stream decoding result (exact results only)
+
+    def key_options(self, options):
+        if (self.password is not None):
+            options['password'] = self.password
+        return options
+
+    def entry_key(self, content_hash):
+        return self.cache.key(content_hash, self.version, self.key_options({ 'revision': self.engine }))
+
+    def index_key(self, span):
+        head = buffer_hash(self.pdf_buf, 0, span)
+        return self.cache.key(head, self.version, self.key_options({ 'revisions': self.engine }))
+
+    def start(self, pdf_buf, engine, profile, budget=None):
+        # Look for the longest analyzed revision that this PDF starts with
+        self.pdf_buf = pdf_buf
+        self.size = len(pdf_buf)
+        self.engine = engine
+        self.profile = profile
+        self.budget = budget
+        self.indexes = {}           # head span -> revisions of its index entry
+        span = head_span(self.size)
+        while (span >= MIN_HEAD_BYTES):
+            index = self.cache.get_json(self.index_key(span))
+            self.indexes[span] = index.get('revisions', []) if (index is not None) else []
+            span = span // 2
+        for length, tail in sorted(set(tuple(r) for index in self.indexes.values() for r in index), reverse=True):
+            if (length > self.size) or not ends_revision(pdf_buf, length):
+                continue
+            if (buffer_hash(pdf_buf, max(0, length - TAIL_BYTES), length) != tail):
+                continue
+            entry = self.cache.get_json(self.entry_key(buffer_hash(pdf_buf, 0, length)))
+            if (entry is not None) and (entry.get('length') == length):
+                self.prefix = entry
+                profile.count('bytes reused', length)
+                break
+
+    def markers(self, find):
+        # A prefix whose cross-reference walk failed is not trusted for the markers with the xref
+        # engine: the new sections might fix the walk. Sniffed types and streams of its objects are
+        # still reused (they only depend on the bytes at their offsets).
+        if (self.prefix is not None) and ((self.prefix['method'] == 'xref') or (self.engine == 'scan')):
+            try:
+                self.found = self.tail_markers()
+                self.method = self.prefix['method']
+                return self.found
+            except (XRefError, PDFSyntaxError):
+                pass
+        self.found, self.method = find()
+        return self.found
+
+    def tail_markers(self):
+        # Markers of the prefix + markers of the appended bytes (found as the prefix's were)
+        prefix = self.prefix
+        length = prefix['length']
+        head = { k: [tuple(m) for m in prefix['markers'][k]] for k in MARKER_KINDS }
+        if (prefix['method'] == 'xref'):
+            tail = xref_markers(self.pdf_buf, length, set(m[0] for m in head['obj']), self.budget)
+        else:
+            tail = scan_markers(self.pdf_buf, start=length)
+        return { k: sorted(set(head[k] + tail[k])) for k in MARKER_KINDS }
+
+    def sniff(self, pdf_buf, objs):
+        if (self.prefix is None):
+            self.sniffed = super().sniff(pdf_buf, objs)
+        else:
+            known = dict(zip((m[0] for m in self.prefix['markers']['obj']), self.prefix['sniffed']))
+            self.sniffed = [known[o] if (o in known) else sniff_object_type(pdf_buf, end) for o, _, end in objs]
+            for o, result in self.prefix['streams'].items():
+                self.streams[int(o)] = (result if isinstance(result, int) else ObjectStream.from_list(result), None)
+        return self.sniffed
+
+    def stream(self, offset):
+        return self.streams.get(offset)
+
+    def record(self, offset, result):
+        if (result[-1] is None):
+            self.streams[offset] = result
+
+    def done(self, complete):
+        # Store the revision entry of the whole PDF (if it is a complete revision) and index it
+        if not complete or (self.found is None) or not ends_revision(self.pdf_buf, self.size):
+            return
+        streams = {}
+        for o, (result, _) in self.streams.items():
+            streams[str(o)] = result if isinstance(result, int) else result.as_list()
+        self.cache.put_json(self.entry_key(self.content_hash), { 'length': self.size, 'method': self.method,
+                            'markers': self.found, 'sniffed': self.sniffed, 'streams': streams })
+        span = head_span(self.size)
+        if (span == 0):
+            return
+        tail = buffer_hash(self.pdf_buf, max(0, self.size - TAIL_BYTES), self.size)
+        index = [[self.size, tail]] + [r for r in self.indexes[span] if (r != [self.size, tail])]
+        self.cache.put_json(self.index_key(span), { 'revisions': index[:MAX_REVISIONS] })
@@ -0,0 +1,341 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Single-pass PDF marker scanner. Replaces the separate `grep -P` passes of sankey-pdf.py
+# with ONE regex pass over the (mmap'ed) file that locates every marker with its byte offset.
+# There is still NO PDF PARSER USED HERE!!
+#
+# Unlike the old grep regexes, the full PDF Whitespace set (Table 1) is used between
+# "X", "Y" and "obj" so CR-only syntax (e.g. ProgressOnFileObservatory_PDFDays2022_JPL_20220909.pdf)
+# is also found.
+#
+# For PDFs larger than RAM (see --chunk-size) the file is not mmap'ed: a ChunkedBuffer reads it
+# through a small LRU cache of fixed-size chunks and the marker scan runs over a sliding window
+# of chunks. Markers that straddle a chunk boundary are found in the next window, which always
+# overlaps the previous one by MAX_MARKER_LENGTH bytes. Peak memory is then a few chunks
+# (plus the marker list), independent of the file size.
+#
+
+import mmap
+import os
+import re
+import stat
+import string
+import threading
+from collections import OrderedDict
+
+from pdfsource import FileSource
+
+# PDF Whitespace (Table 1) - this is NOT the same as [[:blank:]]!!
+PDF_WHITESPACE = b'\x00\x09\x0a\x0c\x0d\x20'
+WS = rb'[\x00\x09\x0a\x0c\x0d\x20]'
+
+# A PDF name ends at whitespace or a delimiter, so "/XRef" must not match "/XRefStm"
+END_OF_NAME = rb'(?![^\x00\x09\x0a\x0c\x0d\x20()<>\[\]{}/%])'
+
+# Order of alternatives matters: longer keywords MUST come before any keyword they contain
+# ("endstream" before "stream", "startxref" before "xref") so matches never overlap.
+MARKER_REGEX = re.compile(
+    rb'(?P<header>%PDF-[0-9]+\.[0-9]+)'
+    rb'|(?P<obj>[0-9]+' + WS + rb'+[0-9]+' + WS + rb'+obj)'
+    rb'|(?P<ObjStm>/ObjStm)' + END_OF_NAME +
+    rb'|(?P<XRef>/XRef)' + END_OF_NAME +
+    rb'|(?P<Linearized>/Linearized)' + END_OF_NAME +
+    rb'|(?P<endstream>endstream)'
+    rb'|(?P<stream>stream)'
+    rb'|(?P<endobj>endobj)'
+    rb'|(?P<startxref>startxref)'
+    rb'|(?P<xref>xref)'
+    rb'|(?P<trailer>trailer)'
+    rb'|(?P<eof>%%EOF)')
+
+MARKER_KINDS = ['header', 'obj', 'ObjStm', 'XRef', 'Linearized', 'endstream', 'stream',
+                'endobj', 'startxref', 'xref', 'trailer', 'eof']
+
+WHITESPACE_RUN = re.compile(WS + rb'+')
+
+# PDF whitespace and comments before the first bytes of an object
+SKIP_REGEX = re.compile(rb'(?:' + WS + rb'+|%[^\x0a\x0d]*)*')
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024    # Default chunk size (bytes) of a ChunkedBuffer. See --chunk-size
+CHUNK_CACHE = 4                     # Number of chunks a ChunkedBuffer keeps in memory
+REMOTE_CHUNK_SIZE = 64 * 1024       # Default chunk size (bytes) of a ChunkedBuffer over a URL
+REMOTE_CACHE_BYTES = 16 * 1024 * 1024   # Bytes of chunks a ChunkedBuffer over a URL keeps in memory
+REMOTE_READAHEAD = 16               # Largest read-ahead (chunks) of a ChunkedBuffer over a URL
+MAX_MARKER_LENGTH = 1024            # Chunked scan: longest marker found across a chunk boundary (only
+                                    # "X Y obj" with huge whitespace runs can be longer than ~20 bytes)
+MATCH_WINDOW = 4096                 # Initial size of the window copied for a regex match on a ChunkedBuffer
+
+
+class ChunkedBuffer:
+    # Read-only stand-in for the mmap'ed PDF file: len(), indexing, slicing, find() and rfind() like
+    # bytes, over a byte source (see pdfsource.py: a local file or an HTTP URL). Reads go through an
+    # LRU cache of cache_chunks chunks of chunk_size bytes. Misses are coalesced: a run of missing
+    # chunks is read with one request and sequential misses read ahead a window that doubles up to
+    # readahead chunks. Slices longer than readahead chunks (e.g. raw stream data) bypass the cache.
+    # The re module cannot search it - use regex_match() instead of regex.match().
+    # Safe to share between threads (see pdflayout.StreamJobs).
+
+    def __init__(self, source, chunk_size=DEFAULT_CHUNK_SIZE, cache_chunks=CHUNK_CACHE, readahead=1):
+        self.source = source
+        self.size = source.size
+        self.chunk_size = chunk_size
+        self.cache_chunks = cache_chunks
+        self.readahead = min(readahead, cache_chunks)
+        self.cache = OrderedDict()      # chunk number -> bytes
+        self.next_chunk = None          # chunk after the last chunks read (sequential misses)
+        self.window = 1                 # chunks read on the next sequential miss
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def bytes_read(self):
+        return self.source.bytes_read
+
+    @property
+    def requests(self):
+        return self.source.requests
+
+    def read(self, start, stop):
+        # Bytes [start, stop) straight from the source
+        return self.source.read(start, stop)
+
+    def chunks(self, first, last):
+        # Chunks first to last (inclusive)
+        found = {}
+        with self.lock:
+            for n in range(first, last + 1):
+                c = self.cache.get(n)
+                if (c is not None):
+                    self.cache.move_to_end(n)
+                    found[n] = c
+        cs = self.chunk_size
+        n = first
+        while (n <= last):
+            if (n in found):
+                n = n + 1
+                continue
+            with self.lock:
+                if (n == self.next_chunk):
+                    self.window = min(2 * self.window, self.readahead)
+                else:
+                    self.window = 1
+                # One read for the missing chunks up to last, and on into the read-ahead window
+                m = n
+                while ((m + 1 <= last) or (m + 1 < n + self.window)) and ((m + 1) * cs < self.size) and (m + 1 not in found) and (m + 1 not in self.cache):
+                    m = m + 1
+                self.next_chunk = m + 1
+            b = self.read(n * cs, min((m + 1) * cs, self.size))
+            with self.lock:
+                for k in range(n, m + 1):
+                    c = b[(k - n) * cs:(k - n + 1) * cs]
+                    if (k <= last):
+                        found[k] = c
+                    self.cache[k] = c
+                    self.cache.move_to_end(k)
+                    if (len(self.cache) > self.cache_chunks):
+                        self.cache.popitem(last=False)
+            n = m + 1
+        return [found[n] for n in range(first, last + 1)]
+
+    def chunk(self, n):
+        return self.chunks(n, n)[0]
+
+    def __getitem__(self, key):
+        cs = self.chunk_size
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if (step != 1):
+                raise ValueError('ChunkedBuffer slices must be contiguous')
+            if (stop <= start):
+                return b''
+            if (stop - start > cs * self.readahead):
+                return self.read(start, stop)
+            first = start // cs
+            last = (stop - 1) // cs
+            c = self.chunks(first, last)
+            if (first == last):
+                return c[0][start - first * cs:stop - first * cs]
+            c[0] = c[0][start - first * cs:]
+            c[-1] = c[-1][:stop - last * cs]
+            return b''.join(c)
+        if (key < 0):
+            key = key + self.size
+        if not (0 <= key < self.size):
+            raise IndexError('ChunkedBuffer index out of range')
+        return self.chunk(key // cs)[key % cs]
+
+    def find(self, sub, start=0, end=None):
+        end = self.size if (end is None) else min(end, self.size)
+        pos = max(start, 0)
+        while (pos < end):
+            # Windows overlap by len(sub) - 1 bytes so sub is also found across a chunk boundary
+            i = self[pos:min(end, pos + self.chunk_size + len(sub) - 1)].find(sub)
+            if (i >= 0):
+                return pos + i
+            pos = pos + self.chunk_size
+        return -1
+
+    def rfind(self, sub, start=0, end=None):
+        end = self.size if (end is None) else min(end, self.size)
+        start = max(start, 0)
+        while (end > start):
+            pos = max(start, end - self.chunk_size - len(sub) + 1)
+            i = self[pos:end].rfind(sub)
+            if (i >= 0):
+                return pos + i
+            end = end - self.chunk_size
+        return -1
+
+
+def open_pdf_buffer(f, chunk_size=None):
+    # Return a read-only buffer over an open binary file: an mmap if possible, otherwise the bytes
+    # (mmap cannot map empty files or pipes). With chunk_size (bytes) a ChunkedBuffer of the file instead.
+    if (chunk_size is not None):
+        try:
+            if stat.S_ISREG(os.fstat(f.fileno()).st_mode):
+                return ChunkedBuffer(FileSource(f), chunk_size)
+        except (ValueError, OSError):
+            pass
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        f.seek(0)
+        return f.read()
+
+
+def open_source_buffer(source, chunk_size=None):
+    # Return a ChunkedBuffer over a byte source that is not a local file (see pdfsource.py): small
+    # chunks, since remote reads are charged per byte and per request, with read-ahead
+    if (chunk_size is None):
+        chunk_size = REMOTE_CHUNK_SIZE
+    return ChunkedBuffer(source, chunk_size, max(REMOTE_CACHE_BYTES // chunk_size, REMOTE_READAHEAD), REMOTE_READAHEAD)
+
+
+def is_chunked(buf):
+    return isinstance(buf, ChunkedBuffer)
+
+
+class WindowMatch:
+    # A match in a window copied from buf[base:] with the offsets of buf (see regex_match())
+
+    def __init__(self, m, base):
+        self.m = m
+        self.base = base
+        self.lastgroup = m.lastgroup
+
+    def start(self, group=0):
+        return self.base + self.m.start(group)
+
+    def end(self, group=0):
+        return self.base + self.m.end(group)
+
+    def group(self, *groups):
+        return self.m.group(*groups)
+
+
+def regex_match(regex, buf, pos, end=None):
+    # regex.match(buf, pos, end) for any buffer. A ChunkedBuffer is matched on a copy of a window
+    # starting at pos that is doubled while the match runs up to the end of the window.
+    if not is_chunked(buf):
+        return regex.match(buf, pos, len(buf) if (end is None) else end)
+    end = len(buf) if (end is None) else min(end, len(buf))
+    n = MATCH_WINDOW
+    while True:
+        w = buf[pos:min(end, pos + n)]
+        m = regex.match(w)
+        if (m is None) or (m.end() < len(w)) or (pos + len(w) >= end):
+            return None if (m is None) else WindowMatch(m, pos)
+        n = n * 2
+
+
+def add_marker(markers, m, base=0):
+    kind = m.lastgroup
+    text = m.group(kind)
+    if (kind == 'obj'):
+        text = WHITESPACE_RUN.sub(b' ', text)
+    markers[kind].append((base + m.start(), text.decode('latin-1'), base + m.end()))
+
+
+def scan_markers(buf, chunk_size=None, start=0):
+    # Find every marker in ONE pass over buf (bytes, bytearray, mmap, memoryview or ChunkedBuffer)
+    # from offset start on.
+    # Returns a dict of marker kind -> list of (offset, marker text, end offset), each sorted by offset.
+    # Text of "X Y obj" markers has PDF whitespace normalized to single SPACEs, e.g. "12 0 obj".
+    # A ChunkedBuffer (or any buf when chunk_size is given) is scanned a chunk at a time.
+    if is_chunked(buf) and (chunk_size is None):
+        # With read-ahead, windows (plus the overlap) that the ChunkedBuffer caches: a remote PDF is fetched once
+        chunk_size = buf.chunk_size * max(1, buf.readahead - 1)
+    if (chunk_size is not None):
+        return scan_markers_chunked(buf, chunk_size, start)
+    markers = {k: [] for k in MARKER_KINDS}
+    for m in MARKER_REGEX.finditer(buf, start):
+        add_marker(markers, m)
+    return markers
+
+
+def scan_markers_chunked(buf, chunk_size, start=0):
+    # scan_markers() over a sliding window of chunk_size + MAX_MARKER_LENGTH bytes. Only matches
+    # that start in the first chunk_size bytes of a window are kept (unless it is the last window):
+    # the regex could not see all of a marker starting later. The next window starts after the
+    # last kept match, or at the cut if that is later, so each marker is found exactly once.
+    markers = {k: [] for k in MARKER_KINDS}
+    size = len(buf)
+    pos = start
+    while (pos < size):
+        stop = min(size, pos + chunk_size + MAX_MARKER_LENGTH)
+        w = bytes(buf[pos:stop])
+        cut = chunk_size if (stop < size) else len(w)
+        nxt = cut
+        for m in MARKER_REGEX.finditer(w):
+            if (m.start() >= cut):
+                break
+            add_marker(markers, m, pos)
+            nxt = max(nxt, m.end())
+        pos = pos + nxt
+    return markers
+
+
+def work_out_object_type(c1, c2):
+    # Work out the object type based on first 2 characters: c1, c2
+    t = '??'
+    if (c1 == '['):
+        t = 'array'
+    elif (c1 == '/'):
+        t = 'name'
+    elif (c1 == '('):
+        t = 'literal-string'
+    elif ((c1 == '<') and (c2 == '<')):
+        t = 'dict'
+    elif ((c1 == 'n') and (c2 == 'u')): # null
+        t = 'null'
+    elif (((c1 == 't') and (c2 == 'r')) or ((c1 == 'f') and (c2 == 'a'))): # true / false
+        t = 'bool'
+    elif (c1 == '<') and ((c2 in string.hexdigits) or (c2 == '>')):
+        t = 'hex-string'
+    elif (((c1 in string.digits) and ((c2 in string.digits) or (c2 == chr(0)) or (c2 == '.'))) or ((c1 == '.') and (c2 in string.digits))):
+        t = 'number'
+    return t
+
+
+def sniff_object_type(buf, pos):
+    # Skip over N x PDF whitespace and comments from pos (immediately after "X Y obj") and use the
+    # first 2 non-whitespace bytes to determine the type of object
+    pos = regex_match(SKIP_REGEX, buf, pos).end()
+    b = bytes(buf[pos:pos + 2])
+    c1 = chr(b[0]) if (len(b) > 0) else ' '
+    c2 = chr(b[1]) if (len(b) > 1) else ' '
+    return work_out_object_type(c1, c2)
@@ -0,0 +1,375 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# PDF layout analysis as a local HTTP service on a Unix socket or a localhost TCP port, for
+# document pipelines that analyze every uploaded PDF.
+#
+#   POST /analyze?format=json|csv&engine=xref|scan&force=1&keep=1&aggregate=N&estimate=N&deadline=SECS
+#        body: the PDF bytes, or a JSON object {"path": "..."} naming a PDF below --root
+#   GET  /health, GET /stats
+#
+# JSON responses are {"status": "ok", "data": [...], "warnings": [...], "estimated": {...}, "seconds": ...}
+# with the same `data` list that sankey-pdf.py prints (estimated: objects per budget that ran out). format=csv returns the Sankey CSV (text/csv).
+# Errors are {"status": "error", "error": "..."}: 400 bad request, 413 PDF too large, 422 PDF
+# cannot be analyzed (a pdflayout.LayoutError), 503 too busy (with Retry-After), 504 deadline.
+#
+# The asyncio front end only parses requests and hands them to a bounded process pool (-j/--jobs
+# workers) - it never analyzes anything itself. At most --jobs requests are in the pool and at
+# most --queue more wait for a worker; further requests are rejected straight away with 503
+# instead of growing the queue, so latency stays flat under bursts and callers can back off.
+# Every request has a deadline (--deadline, or ?deadline= up to --max-deadline) that covers the
+# time spent waiting for a worker and the whole analysis including QPDF calls: requests whose
+# deadline passes while queued never reach the pool, and what is left of it is the time budget
+# of the analysis (see pdfbudget.py) - streams not decoded by then are estimated and the response
+# is still 200. A worker slot is only freed when the worker is really done.
+#
+# Everything runs locally: "pdfbench.py --burst N" starts a server on a temporary Unix socket and
+# measures latency percentiles under bursts of concurrent requests (see request() below).
+#
+# Usage: pdfserver.py [--unix PATH | --host HOST --port PORT] [-j JOBS] [--queue N] [--deadline SECS] [--root DIR]
+#
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from urllib.parse import urlsplit, parse_qs
+
+from pdflayout import analyze_layout, LayoutOptions, LayoutError, ANALYZER_VERSION
+
+DEFAULT_PORT = 8040
+DEFAULT_DEADLINE = 30           # Seconds per request (queueing + analysis). See --deadline
+MAX_DEADLINE = 300              # Largest ?deadline= a request may ask for. See --max-deadline
+DEFAULT_MAX_SIZE = 256          # Largest PDF body (MB). See --max-size
+HEADER_TIMEOUT = 10             # Seconds to receive the request line and headers
+MAX_HEADER_LINES = 100
+RETRY_AFTER = 1                 # Retry-After (seconds) of 503 responses
+WORKER_TASKS = 1000             # PDFs a pool worker analyzes before it is replaced (bounds leaks)
+
+STATUS_TEXT = { 200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 411: 'Length Required',
+                413: 'Payload Too Large', 422: 'Unprocessable Entity', 500: 'Internal Server Error',
+                503: 'Service Unavailable', 504: 'Gateway Timeout' }
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def json_body(obj):
+    return json.dumps(obj).encode('utf-8')
+
+
+def error_response(status, message):
+    return (status, 'application/json', json_body({ 'status': 'error', 'error': message }))
+
+
+def analyze_job(source, options, fmt):
+    # Runs in a pool worker process. Returns (HTTP status, content type, body) so that all the
+    # serialization is done in the worker, not in the event loop.
+    start = time.perf_counter()
+    try:
+        layout = analyze_layout(source, options)
+    except LayoutError as e:
+        return error_response(422, '%s: %s' % (type(e).__name__, str(e).strip()))
+    except Exception as e:
+        return error_response(500, '%s: %s' % (type(e).__name__, str(e).strip()))
+    if (fmt == 'csv'):
+        return (200, 'text/csv; charset=utf-8', layout.csv().encode('utf-8'))
+    return (200, 'application/json', json_body({ 'status': 'ok', 'data': layout.data, 'warnings': [w.strip() for w in layout.warnings],
+                                                 'estimated': layout.budget_hits, 'seconds': round(time.perf_counter() - start, 6) }))
+
+
+def warm_up():
+    return os.getpid()
+
+
+def query_flag(query, name):
+    return query.get(name, ['0'])[-1].lower() in ['1', 'true', 'yes']
+
+
+async def read_request(reader, max_size):
+    # Returns (method, target, headers, body) of one HTTP/1.x request
+    line = await reader.readline()
+    parts = line.decode('latin-1').split()
+    if (len(parts) != 3) or not parts[2].startswith('HTTP/'):
+        raise HTTPError(400, 'malformed request line')
+    method, target, _ = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if (line in [b'\r\n', b'\n', b'']):
+            break
+        if (len(headers) >= MAX_HEADER_LINES):
+            raise HTTPError(400, 'too many headers')
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = b''
+    if (method == 'POST'):
+        if ('chunked' in headers.get('transfer-encoding', '').lower()) or ('content-length' not in headers):
+            raise HTTPError(411, 'Content-Length is required')
+        try:
+            length = int(headers['content-length'])
+        except ValueError:
+            raise HTTPError(400, 'bad Content-Length')
+        if (length < 0):
+            raise HTTPError(400, 'bad Content-Length')
+        if (length > max_size):
+            raise HTTPError(413, 'PDF is larger than %d bytes' % max_size)
+        body = await reader.readexactly(length)
+    return (method, target, headers, body)
+
+
+class LayoutServer:
+
+    def __init__(self, jobs, queue_size, deadline=DEFAULT_DEADLINE, max_deadline=MAX_DEADLINE, max_size=DEFAULT_MAX_SIZE * 1024 * 1024, root=None, verbose=False):
+        self.jobs = jobs
+        self.queue_size = queue_size
+        self.deadline = deadline
+        self.max_deadline = max_deadline
+        self.max_size = max_size
+        self.root = os.path.realpath(root) if (root is not None) else None
+        self.verbose = verbose
+        self.pool = None
+        self.slots = None               # asyncio.Semaphore(jobs): requests in the pool
+        self.waiting = 0                # requests waiting for a slot
+        self.busy = 0                   # requests in the pool
+        self.stats = { 'requests': 0, 'rejected': 0, 'deadline': 0, 'errors': 0, 'ok': 0 }
+        self.started = time.time()
+
+    def new_pool(self):
+        ctx = multiprocessing.get_context('forkserver')
+        return concurrent.futures.ProcessPoolExecutor(self.jobs, mp_context=ctx, max_tasks_per_child=WORKER_TASKS)
+
+    async def start(self):
+        self.slots = asyncio.Semaphore(self.jobs)
+        self.pool = self.new_pool()
+        # Start every worker (and import pdflayout in it) before the first request arrives
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.pool, warm_up) for _ in range(self.jobs)])
+
+    def close(self):
+        if (self.pool is not None):
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def request_deadline(self, query):
+        # Absolute time.monotonic() deadline of a request
+        seconds = self.deadline
+        if ('deadline' in query):
+            try:
+                seconds = float(query['deadline'][-1])
+            except ValueError:
+                raise HTTPError(400, 'bad deadline')
+            if (seconds <= 0):
+                raise HTTPError(400, 'bad deadline')
+        return time.monotonic() + min(seconds, self.max_deadline)
+
+    def request_options(self, query):
+        engine = query.get('engine', ['xref'])[-1]
+        aggregate = query.get('aggregate', [None])[-1]
+        estimate = query.get('estimate', [None])[-1]
+        try:
+            aggregate = int(aggregate) if (aggregate is not None) else None
+            estimate = int(estimate) if (estimate is not None) else None
+            return LayoutOptions(force=query_flag(query, 'force'), keep=query_flag(query, 'keep'), engine=engine, aggregate=aggregate,
+                                 estimate=estimate)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+
+    def request_source(self, headers, body):
+        # The PDF bytes of the request body, or the filename of a {"path": ...} request
+        if not headers.get('content-type', '').startswith('application/json'):
+            return body
+        if (self.root is None):
+            raise HTTPError(400, 'path requests are not enabled (see --root)')
+        try:
+            path = json.loads(body)['path']
+        except (ValueError, KeyError, TypeError):
+            raise HTTPError(400, 'expected {"path": "..."}')
+        if not isinstance(path, str):
+            raise HTTPError(400, 'expected {"path": "..."}')
+        path = os.path.realpath(os.path.join(self.root, path))
+        if (os.path.commonpath([self.root, path]) != self.root) or not os.path.isfile(path):
+            raise HTTPError(400, 'no such PDF below --root')
+        return path
+
+    async def analyze(self, query, headers, body):
+        deadline = self.request_deadline(query)
+        fmt = query.get('format', ['json'])[-1]
+        if (fmt not in ['json', 'csv']):
+            raise HTTPError(400, "format must be 'json' or 'csv'")
+        options = self.request_options(query)
+        source = self.request_source(headers, body)
+
+        # Admission control: a free worker, or a place in the bounded queue, or 503
+        if self.slots.locked() and (self.waiting >= self.queue_size):
+            return error_response(503, 'too busy, %d requests queued' % self.waiting)
+        self.waiting = self.waiting + 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            return error_response(504, 'DeadlineError: deadline passed while waiting for a worker')
+        finally:
+            self.waiting = self.waiting - 1
+
+        # The worker gets what is left of the deadline. The slot is released when the worker is
+        # done, even if this request has given up waiting for it.
+        options.timeout = deadline - time.monotonic()
+        loop = asyncio.get_running_loop()
+        pool = self.pool
+        try:
+            future = loop.run_in_executor(pool, analyze_job, source, options, fmt)
+        except BaseException:
+            self.slots.release()
+            raise
+        self.busy = self.busy + 1
+        future.add_done_callback(self.job_done)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), max(0.0, deadline - time.monotonic()) + 1.0)
+        except asyncio.TimeoutError:
+            return error_response(504, 'DeadlineError: analysis did not finish by the deadline')
+        except concurrent.futures.process.BrokenProcessPool:
+            # A worker died (e.g. killed for running out of memory): start a fresh pool (once)
+            if (pool is self.pool):
+                pool.shutdown(wait=False)
+                self.pool = self.new_pool()
+            return error_response(500, 'analysis worker died')
+
+    def job_done(self, future):
+        self.busy = self.busy - 1
+        self.slots.release()
+
+    def status(self):
+        return (200, 'application/json', json_body(dict(self.stats, jobs=self.jobs, queue_size=self.queue_size, waiting=self.waiting,
+                                                        busy=self.busy, uptime=round(time.time() - self.started, 3),
+                                                        analyzer_version=ANALYZER_VERSION)))
+
+    async def dispatch(self, method, target, headers, body):
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        if (url.path == '/analyze'):
+            if (method != 'POST'):
+                raise HTTPError(405, 'use POST')
+            self.stats['requests'] = self.stats['requests'] + 1
+            return await self.analyze(query, headers, body)
+        if (url.path in ['/health', '/stats']) and (method == 'GET'):
+            return self.status()
+        raise HTTPError(404, 'no such endpoint')
+
+    async def handle(self, reader, writer):
+        # One request per connection
+        start = time.perf_counter()
+        target = '-'
+        try:
+            try:
+                method, target, headers, body = await asyncio.wait_for(read_request(reader, self.max_size), HEADER_TIMEOUT + self.max_size / (1024 * 1024))
+                status, ctype, payload = await self.dispatch(method, target, headers, body)
+            except HTTPError as e:
+                status, ctype, payload = error_response(e.status, str(e))
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                writer.close()
+                return
+            outcome = { 200: 'ok', 503: 'rejected', 504: 'deadline' }.get(status, 'errors')
+            self.stats[outcome] = self.stats[outcome] + 1
+            head = 'HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n' % (status, STATUS_TEXT.get(status, ''), ctype, len(payload))
+            if (status == 503):
+                head = head + 'Retry-After: %d\r\n' % RETRY_AFTER
+            writer.write(head.encode('latin-1') + b'\r\n' + payload)
+            await writer.drain()
+            if (self.verbose):
+                print('%s %d %.3fs' % (target, status, time.perf_counter() - start), file=sys.stderr)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(server, unix=None, host='127.0.0.1', port=DEFAULT_PORT):
+    await server.start()
+    if (unix is not None):
+        if os.path.exists(unix):
+            os.unlink(unix)
+        listener = await asyncio.start_unix_server(server.handle, path=unix, backlog=1024)
+        where = unix
+    else:
+        listener = await asyncio.start_server(server.handle, host=host, port=port, backlog=1024)
+        where = 'http://%s:%d' % (host, listener.sockets[0].getsockname()[1])
+    print('Listening on %s with %d workers' % (where, server.jobs), file=sys.stderr, flush=True)
+    loop = asyncio.get_running_loop()
+    stop = loop.create_future()
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        loop.add_signal_handler(sig, stop.set_result, None)
+    try:
+        async with listener:
+            await stop
+    finally:
+        server.close()
+        if (unix is not None) and os.path.exists(unix):
+            os.unlink(unix)
+
+
+async def request(address, method, target, body=b'', content_type='application/pdf'):
+    # Minimal client for tests and pdfbench.py: address is "unix:PATH" or "HOST:PORT".
+    # Returns (HTTP status, headers dict, body bytes).
+    if address.startswith('unix:'):
+        reader, writer = await asyncio.open_unix_connection(address[5:])
+    else:
+        host, _, port = address.rpartition(':')
+        reader, writer = await asyncio.open_connection(host, int(port))
+    try:
+        head = '%s %s HTTP/1.1\r\nHost: localhost\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n' % (method, target, content_type, len(body))
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if (line in [b'\r\n', b'\n', b'']):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        payload = await reader.read()
+        return (int(status_line.split()[1]), headers, payload)
+    finally:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PDF layout analysis (sankey-pdf.py) as a local HTTP service')
+    parser.add_argument('--unix', help='Listen on this Unix socket (instead of TCP)')
+    parser.add_argument('--host', help='TCP address to listen on (default: 127.0.0.1)', default='127.0.0.1')
+    parser.add_argument('--port', help='TCP port to listen on (default: %d, 0: any free port)' % DEFAULT_PORT, type=int, default=DEFAULT_PORT)
+    parser.add_argument('-j', '--jobs', help='Worker processes, i.e. concurrent analyses (default: number of CPUs)', type=int, default=os.cpu_count())
+    parser.add_argument('-q', '--queue', help='Requests that may wait for a worker before new ones get 503 (default: 2 x jobs)', type=int)
+    parser.add_argument('--deadline', help='Default per-request deadline in seconds, queueing included (default: %d)' % DEFAULT_DEADLINE, type=float, default=DEFAULT_DEADLINE)
+    parser.add_argument('--max-deadline', help='Largest ?deadline= a request may ask for (default: %d)' % MAX_DEADLINE, type=float, default=MAX_DEADLINE, dest='max_deadline')
+    parser.add_argument('--max-size', help='Largest PDF request body in MB (default: %d)' % DEFAULT_MAX_SIZE, type=int, default=DEFAULT_MAX_SIZE, dest='max_size')
+    parser.add_argument('--root', help='Allow {"path": ...} requests for PDFs below this directory')
+    parser.add_argument('-v', '--verbose', help='Log every request on stderr', action='store_true', default=False)
+    args = parser.parse_args()
+    jobs = max(1, args.jobs)
+    queue_size = args.queue if (args.queue is not None) else 2 * jobs
+    server = LayoutServer(jobs, queue_size, args.deadline, args.max_deadline, args.max_size * 1024 * 1024, args.root, args.verbose)
+    asyncio.run(serve(server, args.unix, args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
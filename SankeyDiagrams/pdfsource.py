@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Byte sources that a pdfscan.ChunkedBuffer reads a PDF from, for PDFs that are not memory mapped.
+#
+# A byte source has a size (bytes), a read(start, stop) method returning the bytes [start, stop)
+# and counters of the bytes read and of the read requests. read() may be called from several
+# threads at once (see pdflayout.StreamJobs).
+#
+# - FileSource: a local file, read with pread() (see --chunk-size)
+# - HTTPSource: a PDF in object storage or on a web server, read with HTTP range requests. The
+#   ChunkedBuffer in front of it caches blocks and coalesces misses, so that the analysis fetches
+#   about what it looks at: the tail (startxref and trailer), the cross-reference sections, the
+#   object headers and the data of the streams that are decoded. Only --engine scan (and the
+#   QPDF fallback, which needs a local file) reads the whole PDF. A server that ignores Range
+#   headers sends the whole PDF with the first request; it is then kept in memory.
+#
+# As a stand-in for object storage in tests, this script serves a directory over HTTP with
+# single range requests (Python's http.server does not support Range).
+#
+# Usage: pdfsource.py --serve DIR [--port PORT]
+#
+
+import argparse
+import http.server
+import os
+import re
+import threading
+import urllib.request
+
+HTTP_TIMEOUT_SECS = 30          # Timeout of each HTTP request (seconds)
+RANGE_REGEX = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+def is_url(pdf):
+    return isinstance(pdf, str) and pdf.lower().startswith(('http://', 'https://'))
+
+
+def source_size(pdf):
+    # Size (bytes) of a PDF file or URL
+    if is_url(pdf):
+        return HTTPSource(pdf).size
+    return os.path.getsize(pdf)
+
+
+class FileSource:
+
+    def __init__(self, f):
+        self.fd = f.fileno()
+        self.size = os.fstat(self.fd).st_size
+        self.bytes_read = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def read(self, start, stop):
+        # Bytes [start, stop) straight from the file
+        parts = []
+        while (start < stop):
+            b = os.pread(self.fd, stop - start, start)
+            if (len(b) == 0):
+                break
+            parts.append(b)
+            start = start + len(b)
+        with self.lock:
+            self.bytes_read = self.bytes_read + sum(len(b) for b in parts)
+            self.requests = self.requests + len(parts)
+        return parts[0] if (len(parts) == 1) else b''.join(parts)
+
+
+class HTTPSource:
+
+    def __init__(self, url, timeout=HTTP_TIMEOUT_SECS):
+        self.url = url
+        self.timeout = timeout
+        self.bytes_read = 0         # Bytes transferred (response bodies)
+        self.requests = 0
+        self.data = None            # The whole PDF if the server ignores Range headers
+        self.lock = threading.Lock()
+        with self.request('HEAD') as r:
+            length = r.headers.get('Content-Length')
+        if (length is None) or not length.isdigit():
+            raise OSError('%s: no Content-Length' % url)
+        self.size = int(length)
+
+    def request(self, method, headers=None):
+        with self.lock:
+            self.requests = self.requests + 1
+        return urllib.request.urlopen(urllib.request.Request(self.url, headers=headers or {}, method=method), timeout=self.timeout)
+
+    def read(self, start, stop):
+        stop = min(stop, self.size)
+        if (start >= stop):
+            return b''
+        if (self.data is not None):
+            return self.data[start:stop]
+        with self.request('GET', { 'Range': 'bytes=%d-%d' % (start, stop - 1) }) as r:
+            body = r.read()
+            status = r.status
+        with self.lock:
+            self.bytes_read = self.bytes_read + len(body)
+        if (status != 206):
+            # The server ignored the Range header and sent the whole PDF
+            self.data = body
+            return body[start:stop]
+        if (len(body) != stop - start):
+            raise OSError('%s: %d bytes instead of %d for bytes %d-%d' % (self.url, len(body), stop - start, start, stop - 1))
+        return body
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    # Static files with single range requests (bytes=A-B, bytes=A-, bytes=-N)
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404, 'File not found')
+            return None
+        f = open(path, "rb")
+        size = os.fstat(f.fileno()).st_size
+        start, stop = 0, size
+        m = RANGE_REGEX.match(self.headers.get('Range', '').strip())
+        if (m is not None) and (m.group(1) or m.group(2)):
+            if (m.group(1) == ''):
+                start = max(0, size - int(m.group(2)))
+            else:
+                start = int(m.group(1))
+                if (m.group(2) != ''):
+                    stop = min(size, int(m.group(2)) + 1)
+            if (start >= stop):
+                f.close()
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' % size)
+                self.end_headers()
+                return None
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, stop - 1, size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Length', str(stop - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        f.seek(start)
+        self.remaining = stop - start
+        return f
+
+    def copyfile(self, source, outputfile):
+        while (self.remaining > 0):
+            b = source.read(min(self.remaining, 65536))
+            if (len(b) == 0):
+                break
+            outputfile.write(b)
+            self.remaining = self.remaining - len(b)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a directory over HTTP with range requests (a local stand-in for object storage).')
+    parser.add_argument('--serve', help='Directory to serve', required=True, metavar='DIR')
+    parser.add_argument('--port', help='Localhost TCP port (default: %(default)d, 0: any free port)', type=int, default=8041)
+    args = parser.parse_args()
+
+    handler = lambda *a, **kw: RangeRequestHandler(*a, directory=args.serve, **kw)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', args.port), handler)
+    print('Serving %s on http://127.0.0.1:%d/' % (args.serve, server.server_address[1]), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
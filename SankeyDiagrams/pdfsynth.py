@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Synthetic PDF generator for benchmarking sankey-pdf.py (see pdfbench.py). Makes a structurally
+# valid PDF with N objects (catalog, page tree and filler dicts/arrays/numbers/strings/names),
+# M FlateDecode content streams, optional object streams (the filler objects are compressed into
+# them and a cross-reference stream is used), a Linearization dictionary with a first-page
+# cross-reference section, incremental updates and junk byte cavities between objects.
+# Output is deterministic for a given seed so scaling curves can be compared across versions.
+#
+# The pages are not meant to render anything useful - only the file structure matters.
+#
+# Usage: pdfsynth.py OUT.pdf [-n OBJECTS] [-m STREAMS] [-s OBJSTMS] [-l] [-u UPDATES] [-j CAVITIES]
+#
+
+import argparse
+import random
+import zlib
+
+DEFAULT_OBJECTS = 100           # Objects outside of streams: catalog, page tree and filler objects
+DEFAULT_STREAMS = 10            # Content streams
+DEFAULT_STREAM_SIZE = 4096      # Decoded bytes per content stream
+
+FILLER_KINDS = 6                # dict, array, number, literal string, hex string, name
+
+
+def filler_object(i):
+    k = i % FILLER_KINDS
+    if (k == 0):
+        return b'<< /Type /Filler /Index %d /Next %d 0 R >>' % (i, i + 1)
+    if (k == 1):
+        return b'[%d 0 R 1 2.5 (three) /Four]' % (i + 1)
+    if (k == 2):
+        return b'%d' % (i * 7)
+    if (k == 3):
+        return b'(Filler string %d)' % i
+    if (k == 4):
+        return b'<%08X>' % i
+    return b'/Filler%d' % i
+
+
+def content_stream(rnd, size):
+    lines = []
+    n = 0
+    while (n < size):
+        line = b'BT /F1 %d Tf %d %d Td (Line %d) Tj ET\n' % (rnd.randint(8, 24), rnd.randint(0, 600), rnd.randint(0, 800), len(lines))
+        lines.append(line)
+        n = n + len(line)
+    return b''.join(lines)[:size]
+
+
+def runs(nums):
+    # Sorted object numbers as (first, count) runs of consecutive numbers
+    result = []
+    for num in sorted(nums):
+        if (len(result) > 0) and (result[-1][0] + result[-1][1] == num):
+            result[-1][1] = result[-1][1] + 1
+        else:
+            result.append([num, 1])
+    return result
+
+
+class Builder:
+
+    def __init__(self):
+        self.out = bytearray(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+        self.entries = {}       # object number -> (xref stream entry type, field 2, field 3)
+
+    def obj(self, num, body, stream=None):
+        self.entries[num] = (1, len(self.out), 0)
+        self.out.extend(b'%d 0 obj\n' % num + body)
+        if (stream is not None):
+            self.out.extend(b'\nstream\n' + stream + b'\nendstream')
+        self.out.extend(b'\nendobj\n')
+
+    def junk(self, rnd):
+        self.out.extend(b'JUNK' * rnd.randint(2, 16) + b'\n')
+
+    def end_section(self, startxref):
+        self.out.extend(b'startxref\n%d\n%%%%EOF\n' % startxref)
+
+    def xref_table(self, nums, trailer):
+        # Classic "xref" table for nums, returns its offset
+        pos = len(self.out)
+        self.out.extend(b'xref\n0 1\n0000000000 65535 f \n')
+        for first, count in runs(n for n in nums if (n != 0)):
+            self.out.extend(b'%d %d\n' % (first, count))
+            for num in range(first, first + count):
+                self.out.extend(b'%010d 00000 n \n' % self.entries[num][1])
+        self.out.extend(b'trailer\n<< ' + trailer + b' >>\n')
+        return pos
+
+    def xref_stream(self, num, nums, trailer):
+        # Cross-reference stream object num for nums (and itself), returns its offset
+        pos = len(self.out)
+        self.entries[num] = (1, pos, 0)
+        nums = set(nums) | {num}
+        index = runs(nums)
+        rows = bytearray()
+        for first, count in index:
+            for n in range(first, first + count):
+                t, f2, f3 = self.entries.get(n, (0, 0, 65535))
+                rows.extend(bytes([t]) + f2.to_bytes(4, 'big') + f3.to_bytes(2, 'big'))
+        data = zlib.compress(bytes(rows))
+        self.obj(num, b'<< /Type /XRef /W [1 4 2] /Index [%s] /Filter /FlateDecode /Length %d %s >>' %
+                 (b' '.join(b'%d %d' % (f, c) for f, c in index), len(data), trailer), data)
+        return pos
+
+
+def synthetic_pdf(objects=DEFAULT_OBJECTS, streams=DEFAULT_STREAMS, object_streams=0, linearized=False,
+                  updates=0, cavities=0, stream_size=DEFAULT_STREAM_SIZE, seed=0):
+    # Returns the bytes of a synthetic PDF. See the module comment.
+    rnd = random.Random(seed)
+    b = Builder()
+    next_num = 4
+
+    def new_nums(n):
+        nonlocal next_num
+        next_num = next_num + n
+        return list(range(next_num - n, next_num))
+
+    # Object numbers: 1 catalog, 2 page tree, 3 page, then streams, filler objects and object streams
+    stream_nums = new_nums(streams)
+    filler_nums = new_nums(max(0, objects - 3))
+    objstm_nums = new_nums(object_streams)
+    use_xref_streams = (object_streams > 0)
+
+    # Junk is written after every cavity_every-th body object (until there have been enough cavities)
+    num_body = len(stream_nums) + (len(objstm_nums) if use_xref_streams else len(filler_nums))
+    cavity_every = max(1, num_body // cavities) if (cavities > 0) else 0
+    written = [0, 0]        # body objects, cavities
+
+    def body_obj(num, body, stream=None):
+        b.obj(num, body, stream)
+        written[0] = written[0] + 1
+        if (cavity_every > 0) and (written[0] % cavity_every == 0) and (written[1] < cavities):
+            b.junk(rnd)
+            written[1] = written[1] + 1
+
+    contents = b' '.join(b'%d 0 R' % n for n in stream_nums)
+    first_page = [
+        (1, b'<< /Type /Catalog /Pages 2 0 R >>'),
+        (2, b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>'),
+        (3, b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents [' + contents + b'] >>'),
+    ]
+
+    if linearized:
+        # Linearization dictionary and the first-page objects, then the first-page xref section.
+        # /L, /Size and /Prev (to the main cross-reference section at the end) are patched later.
+        lin_num = new_nums(1)[0]
+        b.obj(lin_num, b'<< /Linearized 1 /L 0000000000 /H [0 0] /O 3 /E 0 /N 1 /T 0 >>')
+        patch_l = b.out.rfind(b'/L ') + 3
+        for num, body in first_page:
+            b.obj(num, body)
+        first_xref = b.xref_table([lin_num] + [n for n, _ in first_page], b'/Size 0000000000 /Root 1 0 R /Prev 0000000000')
+        patch_size = b.out.rfind(b'/Size ') + 6
+        patch_prev = b.out.rfind(b'/Prev ') + 6
+        b.end_section(0)
+        first_page_nums = [lin_num] + [n for n, _ in first_page]
+    else:
+        for num, body in first_page:
+            b.obj(num, body)
+        first_page_nums = []
+
+    for num in stream_nums:
+        data = zlib.compress(content_stream(rnd, stream_size))
+        body_obj(num, b'<< /Length %d /Filter /FlateDecode >>' % len(data), data)
+    if use_xref_streams:
+        # Filler objects are compressed into the object streams
+        per_stm = (len(filler_nums) + object_streams - 1) // object_streams
+        for k, stm_num in enumerate(objstm_nums):
+            members = filler_nums[k * per_stm:(k + 1) * per_stm]
+            header = bytearray()
+            bodies = bytearray()
+            for idx, num in enumerate(members):
+                header.extend(b'%d %d ' % (num, len(bodies)))
+                bodies.extend(filler_object(num) + b'\n')
+                b.entries[num] = (2, stm_num, idx)
+            header.extend(b'\n')
+            data = zlib.compress(bytes(header + bodies))
+            body_obj(stm_num, b'<< /Type /ObjStm /N %d /First %d /Filter /FlateDecode /Length %d >>' % (len(members), len(header), len(data)), data)
+    else:
+        for num in filler_nums:
+            body_obj(num, filler_object(num))
+
+    # Main cross-reference section
+    main_nums = [n for n in b.entries if (n not in first_page_nums)]
+    if use_xref_streams:
+        xref_num = new_nums(1)[0]
+        main = b.xref_stream(xref_num, main_nums, b'/Size %d /Root 1 0 R' % next_num)
+    else:
+        main = b.xref_table(main_nums, b'/Size %d /Root 1 0 R' % next_num)
+    if linearized:
+        # The last startxref of a linearized file points to the first-page section
+        b.end_section(first_xref)
+        b.out[patch_l:patch_l + 10] = b'%010d' % len(b.out)
+        b.out[patch_size:patch_size + 10] = b'%010d' % next_num
+        b.out[patch_prev:patch_prev + 10] = b'%010d' % main
+        prev = first_xref
+    else:
+        b.end_section(main)
+        prev = main
+
+    for u in range(updates):
+        # Each incremental update rewrites the page and adds one new object
+        num = new_nums(1)[0]
+        b.obj(3, first_page[2][1][:-2] + b'/Rotate %d >>' % (90 * ((u + 1) % 4)))
+        b.obj(num, b'<< /Type /Update /Number %d >>' % (u + 1))
+        if use_xref_streams:
+            xref_num = new_nums(1)[0]
+            pos = b.xref_stream(xref_num, [3, num], b'/Size %d /Root 1 0 R /Prev %d' % (next_num, prev))
+        else:
+            pos = b.xref_table([3, num], b'/Size %d /Root 1 0 R /Prev %d' % (next_num, prev))
+        b.end_section(pos)
+        prev = pos
+    return bytes(b.out)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic PDF for benchmarking sankey-pdf.py')
+    parser.add_argument('output', help='Output PDF filename')
+    parser.add_argument('-n', '--objects', help='Objects outside of streams (default: %d)' % DEFAULT_OBJECTS, type=int, default=DEFAULT_OBJECTS)
+    parser.add_argument('-m', '--streams', help='Content streams (default: %d)' % DEFAULT_STREAMS, type=int, default=DEFAULT_STREAMS)
+    parser.add_argument('-z', '--stream-size', help='Decoded bytes per content stream (default: %d)' % DEFAULT_STREAM_SIZE, type=int, default=DEFAULT_STREAM_SIZE, dest='stream_size')
+    parser.add_argument('-s', '--object-streams', help='Compress the filler objects into this many object streams (uses a cross-reference stream)', type=int, default=0, dest='object_streams')
+    parser.add_argument('-l', '--linearized', help='Add a Linearization dictionary and first-page cross-reference section', action='store_true', default=False)
+    parser.add_argument('-u', '--updates', help='Number of incremental updates', type=int, default=0)
+    parser.add_argument('-j', '--cavities', help='Number of junk byte cavities between objects', type=int, default=0)
+    parser.add_argument('--seed', help='Random seed (default: 0)', type=int, default=0)
+    args = parser.parse_args()
+    with open(args.output, "wb") as f:
+        f.write(synthetic_pdf(args.objects, args.streams, args.object_streams, args.linearized, args.updates,
+                              args.cavities, args.stream_size, args.seed))
@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Streaming writers of Sankey data dicts (see pdflayout.analyze()), selected with --format:
+#
+# - csv: the Sankey CSV (Source, Target, Size, color, 95% interval of estimated sizes). Markers and
+#   rows without a size are skipped. With a PDF column (batch mode) each line starts with the PDF.
+# - jsonl: JSON Lines, one data dict per line (with a "pdf" key in batch mode)
+# - columnar: JSON Lines of record batches for analytics, each {"rows": N, "columns": {column: [N
+#   values]}} with the columns of DATA_COLUMNS (null where a dict has no such key), "pdf" first in
+#   batch mode. A batch holds up to COLUMNAR_BATCH_ROWS rows and loads straight into a data frame
+#   or Arrow record batch without a third-party library here.
+#
+# Rows are written as they come (write()), never collected: encoded lines are gathered and written
+# in bulk every WRITE_BUFFER_BYTES. The output is a file, a named pipe or stdout ("-"). A reader
+# that goes away (e.g. "| head") stops the output instead of failing the analysis.
+#
+# debug_rows() is the -d/--debug dump of intermediate data: one row per line, also in bulk writes,
+# without building a list of the rows first.
+#
+
+import json
+import sys
+
+WRITE_BUFFER_BYTES = 1024 * 1024    # Encoded rows are written in blocks of about this many bytes
+COLUMNAR_BATCH_ROWS = 65536         # Rows per record batch of the columnar format
+DEBUG_LINES = 1000                  # debug_rows() writes this many lines at a time
+
+FORMATS = ['csv', 'jsonl', 'columnar']
+FORMAT_EXTENSIONS = { 'csv': '.csv', 'jsonl': '.jsonl', 'columnar': '.columns.jsonl' }
+DATA_COLUMNS = ['category', 'name', 'size', 'color', 'type', 'offset', 'compressed', 'uncompressed',
+                'uncompressed_low', 'uncompressed_high', 'estimated']
+
+
+def is_sankey_row(d):
+    return (d['category'] != 'Marker') and ('size' in d)
+
+
+def sankey_row(d):
+    return (d['category'].strip(), d['name'].strip(), d['size'], d['color'].strip() if ('color' in d) else None)
+
+
+def csv_line(d):
+    # Sankey CSV line of a data dict: Source, Target, Size (bytes), HTML color-name (optional), then
+    # for flows estimated by --estimate the 95% confidence interval of the size as LOW-HIGH (bytes)
+    category, name, size, color = sankey_row(d)
+    s = '%s,%s,%d' % (category, name, size)
+    if (color is not None):
+        s = s + ',' + color
+    if ('uncompressed_low' in d):
+        s = s + ',%d-%d' % (d['uncompressed_low'], d['uncompressed_high'])
+    return s + '\n'
+
+
+def csv_field(s):
+    if any(c in s for c in ',"\r\n'):
+        return '"' + s.replace('"', '""') + '"'
+    return s
+
+
+def open_output(path):
+    # Binary output for a writer: a file or named pipe, or stdout for "-"
+    if (path == '-'):
+        sys.stdout.flush()      # what was printed before comes first
+        return sys.stdout.buffer
+    return open(path, "wb")
+
+
+class RowWriter:
+    # Base class of the writers: out is a binary file object (see open_output()). With pdf_column
+    # every row is written with the PDF it belongs to.
+
+    def __init__(self, out, pdf_column=False):
+        self.out = out
+        self.pdf_column = pdf_column
+        self.rows = 0               # rows written
+        self.pending = []           # encoded rows not written yet
+        self.pending_bytes = 0
+        self.broken = False         # the reader went away
+
+    def write(self, d, pdf=None):
+        raise NotImplementedError
+
+    def write_all(self, data, pdf=None):
+        for d in data:
+            self.write(d, pdf)
+
+    def emit(self, b):
+        self.pending.append(b)
+        self.pending_bytes = self.pending_bytes + len(b)
+        self.rows = self.rows + 1
+        if (self.pending_bytes >= WRITE_BUFFER_BYTES):
+            self.flush()
+
+    def flush(self):
+        if (len(self.pending) > 0) and not self.broken:
+            try:
+                self.out.write(b''.join(self.pending))
+            except BrokenPipeError:
+                self.broken = True
+        self.pending = []
+        self.pending_bytes = 0
+
+    def close(self):
+        self.flush()
+        try:
+            if (self.out is sys.stdout.buffer):
+                self.out.flush()
+            else:
+                self.out.close()
+        except BrokenPipeError:
+            self.broken = True
+
+
+class CSVWriter(RowWriter):
+
+    def write(self, d, pdf=None):
+        if is_sankey_row(d):
+            line = csv_line(d)
+            if self.pdf_column:
+                line = csv_field(pdf) + ',' + line
+            self.emit(line.encode('utf-8'))
+
+
+class JSONLinesWriter(RowWriter):
+
+    def write(self, d, pdf=None):
+        if self.pdf_column:
+            d = dict(pdf=pdf, **d)
+        self.emit((json.dumps(d) + '\n').encode('utf-8'))
+
+
+class ColumnarWriter(RowWriter):
+
+    def __init__(self, out, pdf_column=False, batch_rows=COLUMNAR_BATCH_ROWS):
+        super().__init__(out, pdf_column)
+        self.columns = (['pdf'] if pdf_column else []) + DATA_COLUMNS
+        self.batch_rows = batch_rows
+        self.batch = { c: [] for c in self.columns }
+        self.batch_size = 0
+
+    def write(self, d, pdf=None):
+        batch = self.batch
+        if self.pdf_column:
+            batch['pdf'].append(pdf)
+        for c in DATA_COLUMNS:
+            batch[c].append(d.get(c))
+        self.batch_size = self.batch_size + 1
+        if (self.batch_size == self.batch_rows):
+            self.end_batch()
+
+    def end_batch(self):
+        if (self.batch_size > 0):
+            self.pending.append((json.dumps({ 'rows': self.batch_size, 'columns': self.batch }) + '\n').encode('utf-8'))
+            self.pending_bytes = self.pending_bytes + len(self.pending[-1])
+            self.rows = self.rows + self.batch_size
+            self.batch = { c: [] for c in self.columns }
+            self.batch_size = 0
+            if (self.pending_bytes >= WRITE_BUFFER_BYTES):
+                self.flush()
+
+    def close(self):
+        self.end_batch()
+        super().close()
+
+
+WRITERS = { 'csv': CSVWriter, 'jsonl': JSONLinesWriter, 'columnar': ColumnarWriter }
+
+
+def open_writer(fmt, path, pdf_column=False):
+    # A writer of one of FORMATS to path ("-" for stdout)
+    return WRITERS[fmt](open_output(path), pdf_column)
+
+
+def debug_rows(rows, out=None):
+    # Print rows (e.g. data dicts) one per line with their index, DEBUG_LINES at a time
+    out = out or sys.stdout
+    lines = []
+    for i, row in enumerate(rows):
+        lines.append('%5d: %r\n' % (i, row))
+        if (len(lines) == DEBUG_LINES):
+            out.write(''.join(lines))
+            lines = []
+    out.write(''.join(lines))
@@ -0,0 +1,318 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# Copyright 2023 PDF Association, Inc. https://www.pdfa.org
+#
+# This material is based upon work supported by the Defense Advanced
+# Research Projects Agency (DARPA) under Contract No. HR001119C0079.
+# Any opinions, findings and conclusions or recommendations expressed
+# in this material are those of the author(s) and do not necessarily
+# reflect the views of the Defense Advanced Research Projects Agency
+# (DARPA). Approved for public release.
+#
+# SPDX-License-Identifier: Apache-2.0
+# Author: Peter Wyatt, PDF Association
+#
+# Cross-reference driven marker location for sankey-pdf.py. Instead of keyword scanning the
+# whole file, start at the last "startxref", walk the chain of classic "xref" tables and XRef
+# streams (/Prev chains from incremental updates and /XRefStm of hybrid-reference files) and then
+# seek straight to each in-use object's offset. Only object headers, dictionaries and the bytes
+# around "endstream"/"endobj" are read - stream data is skipped using /Length.
+#
+# xref_markers() returns the same marker dict as pdfscan.scan_markers() so the classification
+# loop is unchanged. Anything inconsistent raises XRefError and the caller falls back to the
+# full-file scan (which is also the way to find objects that no xref references).
+#
+# For incremental re-analysis (see pdfrevision.py) the walk can be limited to the bytes appended
+# after an already analyzed revision: only sections and objects from that offset on are read.
+#
+# XRef streams are decoded within the budgets of the analysis (see pdfbudget.py) and never to more
+# than their /W entries need (plus XREF_STREAM_SLACK): a stream over that, or running out of time
+# while walking, is an XRefError too.
+#
+
+import re
+
+from pdfscan import MARKER_KINDS, WHITESPACE_RUN, regex_match
+from pdfdecode import Lexer, Ref, parse_object, decoded_data, PDFSyntaxError, UnsupportedFilter, DecodeError, BudgetExceeded
+
+HEADER_WINDOW = 1024        # "%PDF-x.y" must be in this many bytes at the start of the file
+TAIL_WINDOW = 1024          # Last "startxref" must be in this many bytes at the end of the file
+SECTION_END_WINDOW = 1024   # "startxref" / "%%EOF" must follow a trailer or XRef stream within this many bytes
+MAX_SECTIONS = 10000        # Guard against /Prev loops in broken files
+XREF_STREAM_SLACK = 65536   # XRef stream data may decode to this many bytes more than its entries
+
+HEADER_REGEX = re.compile(rb'%PDF-[0-9]+\.[0-9]+')
+OBJ_REGEX = re.compile(rb'([0-9]+)[\x00\x09\x0a\x0c\x0d\x20]+([0-9]+)[\x00\x09\x0a\x0c\x0d\x20]+obj')
+STARTXREF_REGEX = re.compile(rb'startxref[\x00\x09\x0a\x0c\x0d\x20]+([0-9]+)')
+XREF_SUBSECTION_REGEX = re.compile(rb'[\x00\x09\x0a\x0c\x0d\x20]*([0-9]+)[\x00\x09\x0a\x0c\x0d\x20]+([0-9]+)[\x00\x09\x0a\x0c\x0d\x20]*(?=[\x0a\x0d])')
+XREF_ENTRY_REGEX = re.compile(rb'[\x00\x09\x0a\x0c\x0d\x20]*([0-9]{1,10})[\x00\x09\x0a\x0c\x0d\x20]+([0-9]{1,5})[\x00\x09\x0a\x0c\x0d\x20]+([nf])')
+
+
+class XRefError(Exception):
+    pass
+
+
+def skip_whitespace(buf, pos):
+    lexer = Lexer(buf, pos)
+    lexer.skip_whitespace()
+    return lexer.pos
+
+
+def keyword_at(buf, pos, keyword):
+    # Offset of keyword if it is the next token at pos (after whitespace/comments), otherwise -1
+    pos = skip_whitespace(buf, pos)
+    if (bytes(buf[pos:pos + len(keyword)]) == keyword):
+        return pos
+    return -1
+
+
+class XRefWalker:
+
+    def __init__(self, buf, start=0, known=(), budget=None):
+        # start: only read sections and objects at or after this offset. known: offsets of the
+        # objects before start (entries for any other offset before start are an XRefError).
+        # budget: the pdfbudget.Budget of the analysis or None (unlimited).
+        self.buf = buf
+        self.budget = budget
+        self.size = len(buf)
+        self.start = start
+        self.known = known
+        self.offsets = {}               # object number -> byte offset (newest revision wins)
+        self.object_offsets = set()     # every in-use byte offset from every xref section
+        self.markers = {k: [] for k in MARKER_KINDS}
+
+    def add_marker(self, kind, offset, text, end):
+        self.markers[kind].append((offset, text, end))
+
+    def walk(self):
+        buf = self.buf
+        if (self.start == 0):
+            m = HEADER_REGEX.search(bytes(buf[0:HEADER_WINDOW]))
+            if (m is None):
+                raise XRefError('no "%PDF-x.y" header')
+            self.add_marker('header', m.start(), m.group(0).decode('latin-1'), m.end())
+
+        tail = max(0, self.size - TAIL_WINDOW)
+        startxref = buf.rfind(b'startxref', tail)
+        if (startxref < 0):
+            raise XRefError('no "startxref" near the end of the file')
+        m = regex_match(STARTXREF_REGEX, buf, startxref)
+        if (m is None):
+            raise XRefError('no offset after the last "startxref"')
+        todo = [int(m.group(1))]
+        visited = set()
+        while (len(todo) > 0):
+            offset = todo.pop(0)
+            if (offset in visited):
+                continue
+            if (len(visited) >= MAX_SECTIONS) or (offset <= 0) or (offset >= self.size):
+                raise XRefError('bad cross-reference section offset %d' % offset)
+            if (offset < self.start):
+                continue
+            if (self.budget is not None) and self.budget.expired():
+                raise XRefError('time budget ran out before the section at offset %d' % offset)
+            visited.add(offset)
+            if (keyword_at(buf, offset, b'xref') == skip_whitespace(buf, offset)):
+                trailer = self.read_xref_table(skip_whitespace(buf, offset))
+            else:
+                trailer = self.read_xref_stream(offset)
+            # Hybrid-reference files: /XRefStm is read before /Prev
+            for key in ['XRefStm', 'Prev']:
+                if isinstance(trailer.get(key), int):
+                    todo.append(trailer[key])
+
+        for offset in sorted(self.object_offsets):
+            if (offset >= self.start):
+                self.read_object(offset)
+            elif (offset not in self.known):
+                raise XRefError('object offset %d is before the new revision but was not analyzed' % offset)
+
+        for kind in MARKER_KINDS:
+            self.markers[kind] = sorted(set(self.markers[kind]))
+        return self.markers
+
+    def section_end(self, pos):
+        # "startxref" / "%%EOF" following a trailer dictionary or an XRef stream (if any)
+        buf = self.buf
+        startxref = buf.find(b'startxref', pos, min(pos + SECTION_END_WINDOW, self.size))
+        if (startxref >= 0):
+            self.add_marker('startxref', startxref, 'startxref', startxref + len('startxref'))
+            eof = buf.find(b'%%EOF', startxref, min(startxref + SECTION_END_WINDOW, self.size))
+            if (eof >= 0):
+                self.add_marker('eof', eof, '%%EOF', eof + len('%%EOF'))
+
+    def add_entry(self, num, offset):
+        if (offset <= 0) or (offset >= self.size):
+            raise XRefError('object %d has a bad offset %d' % (num, offset))
+        self.object_offsets.add(offset)
+        if (num not in self.offsets):
+            self.offsets[num] = offset
+
+    def read_xref_table(self, offset):
+        # Classic cross-reference table: "xref" then subsections "start count" of 20 byte entries
+        buf = self.buf
+        self.add_marker('xref', offset, 'xref', offset + len('xref'))
+        pos = offset + len('xref')
+        while True:
+            trailer = keyword_at(buf, pos, b'trailer')
+            if (trailer >= 0):
+                break
+            m = regex_match(XREF_SUBSECTION_REGEX, buf, pos)
+            if (m is None):
+                raise XRefError('bad xref subsection at offset %d' % pos)
+            start = int(m.group(1))
+            count = int(m.group(2))
+            pos = m.end()
+            for num in range(start, start + count):
+                m = regex_match(XREF_ENTRY_REGEX, buf, pos)
+                if (m is None):
+                    raise XRefError('bad xref entry at offset %d' % pos)
+                pos = m.end()
+                if (m.group(3) == b'n'):
+                    self.add_entry(num, int(m.group(1)))
+        self.add_marker('trailer', trailer, 'trailer', trailer + len('trailer'))
+        lexer = Lexer(self.buf, trailer + len('trailer'))
+        try:
+            trailer_dict = parse_object(lexer)
+        except PDFSyntaxError as e:
+            raise XRefError('bad trailer dictionary: %s' % e)
+        if not isinstance(trailer_dict, dict):
+            raise XRefError('trailer is not a dictionary')
+        self.section_end(lexer.pos)
+        return trailer_dict
+
+    def read_xref_stream(self, offset):
+        # XRef stream. Its own object is added to the object offsets (it is not always in its own /W table)
+        buf = self.buf
+        m = regex_match(OBJ_REGEX, buf, skip_whitespace(buf, offset))
+        if (m is None):
+            raise XRefError('no "xref" or XRef stream at offset %d' % offset)
+        offset = m.start()
+        obj = self.read_object(offset, want_dict=True)
+        if (obj is None) or not isinstance(obj['dict'], dict) or (obj['dict'].get('Type') != 'XRef') or (obj['stream'] is None):
+            raise XRefError('object at offset %d is not an XRef stream' % offset)
+        self.object_offsets.add(offset)
+        stm_dict = obj['dict']
+        w = stm_dict.get('W')
+        size = stm_dict.get('Size')
+        if not isinstance(w, list) or (len(w) < 3) or not all(isinstance(x, int) and (x >= 0) for x in w) or not isinstance(size, int):
+            raise XRefError('XRef stream at offset %d has a bad /W or /Size' % offset)
+        index = stm_dict.get('Index', [0, size])
+        if not isinstance(index, list) or (len(index) % 2 != 0) or not all(isinstance(x, int) for x in index):
+            raise XRefError('XRef stream at offset %d has a bad /Index' % offset)
+        entry_len = sum(w)
+        limit = sum(max(0, n) for n in index[1::2]) * entry_len + XREF_STREAM_SLACK
+        deadline = None
+        if (self.budget is not None):
+            stream_limit, _ = self.budget.stream_limit()
+            if (stream_limit is not None):
+                limit = min(limit, stream_limit)
+            deadline = self.budget.deadline
+        try:
+            data = decoded_data(buf, stm_dict, obj['stream'], obj['endstream'], limit, deadline)
+        except (PDFSyntaxError, UnsupportedFilter, DecodeError) as e:
+            raise XRefError('XRef stream at offset %d: %s' % (offset, e))
+        except BudgetExceeded as e:
+            raise XRefError('XRef stream at offset %d is over its budget after %d decoded bytes' % (offset, e.decoded))
+        pos = 0
+        for j in range(0, len(index), 2):
+            for num in range(index[j], index[j] + index[j + 1]):
+                if (pos + entry_len > len(data)):
+                    raise XRefError('XRef stream at offset %d is too short' % offset)
+                fields = []
+                p = pos
+                for width in w:
+                    fields.append(int.from_bytes(data[p:p + width], 'big'))
+                    p = p + width
+                pos = pos + entry_len
+                t = fields[0] if (w[0] > 0) else 1
+                if (t == 1):
+                    self.add_entry(num, fields[1])
+        self.section_end(obj['endobj'])
+        return stm_dict
+
+    def read_object(self, offset, want_dict=False):
+        # Add the markers of the indirect object at offset. Returns a dict with the parsed
+        # dictionary (if any) and stream/endstream/endobj offsets.
+        buf = self.buf
+        m = regex_match(OBJ_REGEX, buf, offset)
+        if (m is None):
+            raise XRefError('no "X Y obj" at offset %d' % offset)
+        obj = { 'dict': None, 'stream': None, 'endstream': None, 'endobj': None }
+        if not want_dict:
+            self.add_marker('obj', offset, WHITESPACE_RUN.sub(b' ', m.group(0)).decode('latin-1'), m.end())
+        lexer = Lexer(buf, m.end())
+        try:
+            value = parse_object(lexer)
+        except PDFSyntaxError:
+            # Not parseable by the minimal tokenizer - just look for "endobj"
+            value = None
+            endobj = buf.find(b'endobj', m.end())
+            if (endobj < 0):
+                raise XRefError('no "endobj" for object at offset %d' % offset)
+            lexer.pos = endobj
+        if isinstance(value, dict):
+            obj['dict'] = value
+            if not want_dict:
+                dict_bytes = bytes(buf[m.end():lexer.pos])
+                for kind, name in [('ObjStm', b'/ObjStm'), ('XRef', b'/XRef'), ('Linearized', b'/Linearized')]:
+                    if ((kind == 'Linearized') and ('Linearized' in value)) or ((kind != 'Linearized') and (value.get('Type') == kind)):
+                        p = dict_bytes.find(name)
+                        if (p >= 0):
+                            self.add_marker(kind, m.end() + p, name.decode('latin-1'), m.end() + p + len(name))
+            stream = keyword_at(buf, lexer.pos, b'stream')
+            if (stream >= 0):
+                endstream = self.find_endstream(value, stream)
+                obj['stream'] = stream
+                obj['endstream'] = endstream
+                if not want_dict:
+                    self.add_marker('stream', stream, 'stream', stream + len('stream'))
+                    self.add_marker('endstream', endstream, 'endstream', endstream + len('endstream'))
+                lexer.pos = endstream + len('endstream')
+        endobj = keyword_at(buf, lexer.pos, b'endobj')
+        if (endobj < 0):
+            endobj = buf.find(b'endobj', lexer.pos)
+            if (endobj < 0):
+                raise XRefError('no "endobj" for object at offset %d' % offset)
+        obj['endobj'] = endobj
+        if not want_dict:
+            self.add_marker('endobj', endobj, 'endobj', endobj + len('endobj'))
+        return obj
+
+    def resolve_length(self, length):
+        # Direct /Length or an indirect reference to an integer object
+        if isinstance(length, Ref) and (length.num in self.offsets):
+            m = regex_match(OBJ_REGEX, self.buf, self.offsets[length.num])
+            if (m is not None):
+                try:
+                    length = parse_object(Lexer(self.buf, m.end()))
+                except PDFSyntaxError:
+                    return None
+        if isinstance(length, int) and (length >= 0):
+            return length
+        return None
+
+    def find_endstream(self, stm_dict, stream):
+        # Use /Length to jump over the stream data straight to "endstream"
+        buf = self.buf
+        start = stream + len('stream')
+        if (bytes(buf[start:start + 2]) == b'\r\n'):
+            start = start + 2
+        elif (bytes(buf[start:start + 1]) in [b'\n', b'\r']):
+            start = start + 1
+        length = self.resolve_length(stm_dict.get('Length'))
+        if (length is not None):
+            endstream = keyword_at(buf, start + length, b'endstream')
+            if (endstream >= 0):
+                return endstream
+        # Bad /Length: search for "endstream" (reads the stream data of this object only)
+        endstream = buf.find(b'endstream', start)
+        if (endstream < 0):
+            raise XRefError('no "endstream" for stream at offset %d' % stream)
+        return endstream
+
+
+def xref_markers(buf, start=0, known=(), budget=None):
+    # Marker dict (see pdfscan.scan_markers()) located via the cross-reference information
+    # (of the sections from offset start on, see XRefWalker)
+    return XRefWalker(buf, start, known, budget).walk()
@@ -12,618 +12,393 @@
 # SPDX-License-Identifier: Apache-2.0
 # Author: Peter Wyatt, PDF Association
 #
-# A HIGHLY inefficient way of working out the layout of a PDF using Linux grep and QPDF.
+# A HIGHLY inefficient way of working out the layout of a PDF using a single-pass marker scanner and QPDF.
 # There is NO PDF PARSER USED HERE!!
-# Avoid using on large PDFs or PDFs with many objects! Script will exit if it sees
-# object number `MAX_MARKERS` or greater. Only works with valid PDFs that work with QPDF and
-# that are not encrypted with a User Password.
+# Avoid using on large PDFs or PDFs with many objects! Over `MAX_MARKERS` markers objects are
+# bucketed into a bounded number of Sankey nodes (-a/--aggregate) unless -f/--force. Only works with valid PDFs that work with QPDF.
+# Encrypted PDFs are decrypted in-process (see pdfcrypt.py), with --password if they have a User Password.
 #
-# Creates a CSV output suitable for cutting & pasting to create a Sankey diagram at 
+# Creates a CSV output suitable for cutting & pasting to create a Sankey diagram at
 # https://observablehq.com/@pdf/visualizing-pdfs-with-sankey-diagrams
 #
-# Due to very flexible PDF EOL rules, do NOT use ^ (start-of-line) in regexes! 
+# Due to very flexible PDF EOL rules, do NOT use ^ (start-of-line) in regexes!
 # PDF Whitespace (Table 1) regex: [\\000\\011\\012\\014\\015\\040] - this is NOT the same as [[:blank:]]!!
 #
+# The analysis itself is in pdflayout.py (library entry point: analyze_layout()) - this script is
+# a command line wrapper around it. With -b/--batch a whole directory tree (or a list file of
+# PDF filenames) is analyzed by a pool of worker processes, writing one JSON Lines result record per PDF.
+# --chunk-size reads PDFs larger than RAM in bounded chunks instead of memory mapping them.
+# --profile reports where the time went (see pdfprofile.py). --timeout, --max-stream-mb,
+# --max-decoded-mb and --max-markers are per-PDF budgets (see pdfbudget.py): hitting one marks
+# the objects concerned as estimated instead of failing. --estimate only decodes a stratified
+# sample of the streams and extrapolates the other uncompressed sizes (see pdfestimate.py).
+# --corpus adds the PDFs to the corpus totals of a partial-aggregate file (see pdfcorpus.py).
+# PDFs can also be http(s) URLs, read with range requests (see pdfsource.py).
+# --rescan DIR only analyzes the new and changed PDFs of a directory tree and keeps the results,
+# timings and corpus totals in a SQLite manifest that can be queried (see pdfmanifest.py).
+# --dedup skips decoding streams already seen in the corpus and reports duplicate bytes (see pdfdedup.py).
+# --format selects the writer of -c and -o output: Sankey CSV, JSON Lines or columnar record batches
+# (see pdfwriter.py). Rows are streamed to files, pipes or stdout (-c -) in bulk writes.
+#
 
-import subprocess
 import os
+import sys
 import argparse
-import pprint
-import string
-import re
-import copy
+import json
+import time
+import multiprocessing
 from sys import platform
 
-pp = pprint.PrettyPrinter(indent=2, compact=False, width=180)
-
-parser = argparse.ArgumentParser()
-parser.add_argument('-c', '--csv',   help='Output CSV filename (always overwritten)', dest="csvfile", )
-parser.add_argument('-d', '--debug', help="Verbose debugging output of internal Python data", action='store_true', default=False, dest="debugmode")
-parser.add_argument('-k', '--keep',  help="Keep all data markers in debug output", action='store_true', default=False, dest="dont_delete")
-parser.add_argument('-f', '--force', help="Force processing by ignoring possible data issues", action='store_true', default=False, dest="force")
-parser.add_argument('-p', '--pdf',   help='Input PDF filename', dest="pdffile")
-args = parser.parse_args()
-
-# Constants
-MAX_MARKERS = 500       # Maximum number of markers before we assume things are too complex/big for D3 Sankey and exit.  See -f/--force
-LINEARIZE_RANGE = 10    # How many markers after a Linearization marker should there be "startxref" / "%%EOF"
-BUFFER_SIZE = 24        # Byte buffer used to guessimate what type each indirect object is (number of bytes after "X Y obj")
-TIMEOUT_SECS = 10       # QPDF subprocess run timeout (seconds)
-
-if (args.pdffile is None):
-    parser.print_help()
-    exit(-1)
-
-if ('linux' not in platform):
-    print('ERROR: only works under Linux! Needs grep and qpdf.\n')
-    parser.print_help()
-    exit(-1)
-
-pdf = args.pdffile              # input PDF filename
-print(pdf +": ", end='')
-size = os.path.getsize(pdf)     # phsyical file size (bytes)
-in_pdf = open(pdf, "rb")
-
-data = []                       # Data dictionary for Sankey D3 diagram 
-cavity_count = 1                # Need to uniquely label each cavity for Sankey nodes 
-
-def work_out_object_type(c1, c2):
-    # Work out the object type based on first 2 characters: c1, c2
-    t = '??'
-    if (c1 == '['):
-        t = 'array'
-    elif (c1 == '/'):
-        t = 'name'
-    elif (c1 == '('): 
-        t = 'literal-string'
-    elif ((c1 == '<') and (c2 == '<')):
-        t = 'dict'
-    elif ((c1 == 'n') and (c2 == 'u')): # null
-        t = 'null'
-    elif (((c1 == 't') and (c2 == 'r')) or ((c1 == 'f') and (c2 == 'a'))): # true / false
-        t = 'bool'
-    elif (c1 == '<') and ((c2 in string.hexdigits) or (c2 == '>')):
-        t = 'hex-string'
-    elif (((c1 in string.digits) and ((c2 in string.digits) or (c2 == chr(0)) or (c2 == '.'))) or ((c1 == '.') and (c2 in string.digits))):
-        t = 'number'
-    return t
-
-
-# Find PDF header magic (might not be at physical file offset 0!)
-cmd = ['grep', '-P', '--text', '--color=none', '--byte-offset', '--only-matching', '%PDF-[0-9]+\.[0-9]+', pdf ]
-result = subprocess.run(cmd, capture_output=True, text=True)
-if (result.returncode != 0) or (len(result.stdout.strip()) == 0):
-    print('"%PDF-x.y" header could not be found! Not a PDF file...')
-    exit(-1)
-result = result.stdout.splitlines()
-if (len(result) > 1):
-    print('\n\nWARNING: More than one "%PDF-x.y" header was found! Huh???')
-result = result[0].split(':')
-sof = int(result[0])
-if (sof > 0):
-    data.append({ 'category':'PDF file', 'name':'Cavity ' + str(cavity_count), 'offset':0, 'size':sof, 'color':'red' })
-    cavity_count = cavity_count + 1 
-data.append({ 'category':'PDF file', 'name':result[1], 'offset':sof, 'size':len(result[1])+1, 'color':'lightblue' })
-
-# PDF conventional body indirect object marker "X Y obj"
-cmd = ['grep', '-P', '--text', '--color=none', '--byte-offset', '--only-matching', '[0-9]+[\\000[:blank:]]+[0-9]+[\\000[:blank:]]+obj', pdf ]
-result = subprocess.run(cmd, capture_output=True, text=True).stdout
-result = result.splitlines()
-num_obj_keywords = len(result)
-if (num_obj_keywords < 5):
-    # Likely non-SPACEs are between "X", "Y" and "obj" so grep fails. e.g. ProgressOnFileObservatory_PDFDays2022_JPL_20220909.pdf
-    # @todo - read the PDF file into a bytearray and manually do this search... yuck!
-    print('ERROR: could not find sufficient "X Y obj" markers (%d found)!' % num_obj_keywords)
-    exit(-1)
-for s in result:
-    d = s.split(':')
-    data.append({ 'category':'PDF file', 'name':d[1], 'offset':int(d[0])})
-
-# Primitive PDF object type classification markers.
-# Want the first 2 non-whitespace bytes following "obj" to determine type of object.
-# Linux grep cannot span mulitple lines correctly with PDF's mix of EOLs and whitespace (even pcregrep can't do this).
-# Best approach is to re-use the byte-offsets from "X Y obj" above, skip over N x whitespace (EOLs, NUL, SPACE, etc) 
-# to locate the first 2 non-whitespace bytes in a small buffer.
-for s in result:
-    d = s.split(':')
-    in_pdf.seek(int(d[0]) + len(d[1]) + 1)   # start reading immediately after "X Y obj"
-    b = bytearray(in_pdf.read(BUFFER_SIZE))
-    i = 0
-    while ((i < (BUFFER_SIZE - 2)) and (b[i] in [0, 9, 10, 12, 13, 32])): # PDF whitespace bytes (Table 1)
-        i = i + 1
-    c1 = chr(b[i + 0])
-    c2 = chr(b[i + 1])
-    t = work_out_object_type(c1, c2)
-    data.append({ 'category':'Marker', 'name':t, 'type': t, 'offset':int(d[0]) })
-
-# Object stream marker
-cmd = ['grep', '-P', '--text', '--color=none', '--byte-offset', '--only-matching', '/ObjStm', pdf ]
-result = subprocess.run(cmd, capture_output=True, text=True).stdout
-result = result.splitlines()
-for s in result:
-    d = s.split(':')
-    data.append({ 'category':'Marker', 'name':'ObjStm', 'type':'Object stream', 'offset':int(d[0]) })
-
-# Cross-reference stream marker
-cmd = ['grep', '-P', '--text', '--color=none', '--byte-offset', '--only-matching', '/XRef', pdf ]
-result = subprocess.run(cmd, capture_output=True, text=True).stdout
-result = result.splitlines()
-for s in result:
-    d = s.split(':')
-    data.append({ 'category':'Marker', 'name':'XRef', 'type':'XRef stream', 'offset':int(d[0]) })
-
-# "stream" keyword - need to explicitly differentiate from "endstream"
-cmd = ['grep', '-P', '--text', '--color=none', '--byte-offset', '--only-matching', '(^stream)|([^d]\Kstream)', pdf ]
-result = subprocess.run(cmd, capture_output=True, text=True).stdout
-result = result.splitlines()
-num_stream = len(result)
-for s in result:
-    d = s.split(':')
-    data.append({ 'category':'Marker', 'name':'stream', 'type':'stream', 'offset':int(d[0])})
-
-# "endstream" keyword
-cmd = ['grep', '-P', '--text', '--color=none', '--byte-offset', '--only-matching', 'endstream', pdf ]
-result = subprocess.run(cmd, capture_output=True, text=True).stdout
-result = result.splitlines()
-if (num_stream != len(result)):
-    print('ERROR: "endstream" marker (%d) mismatch with "stream" (%d)!' % (len(result), num_stream))
-    exit(-1)
-if ((num_stream > num_obj_keywords) or (len(result) > num_obj_keywords)):
-    print('ERROR: "endstream" (%d) / "stream" (%d) markers did not correlate with number of objects (%d)!' % (len(result), num_stream, num_obj_keywords))
-    exit(-1)
-for s in result:
-    d = s.split(':')
-    data.append({ 'category':'Marker', 'name':'endstream', 'type':'stream', 'offset':int(d[0]) })
-
-# "endobj" keyword
-cmd = ['grep', '-P', '--text', '--color=none', '--byte-offset', '--only-matching', 'endobj', pdf ]
-result = subprocess.run(cmd, capture_output=True, text=True).stdout
-result = result.splitlines()
-if (len(result) != num_obj_keywords):
-    print('ERROR: "endobj" marker mismatch (%d found, %d expected)!' % (len(result), num_obj_keywords))
-    exit(-1)
-for s in result:
-    d = s.split(':')
-    data.append({ 'category':'Marker', 'name':'endobj', 'offset':int(d[0])})
-
-# "xref" keyword
-cmd = ['grep', '-P', '--text', '--color=none', '--byte-offset', '--only-matching', '[^t]\Kxref', pdf ]
-result = subprocess.run(cmd, capture_output=True, text=True).stdout
-result = result.splitlines()
-for s in result:
-    d = s.split(':')
-    data.append({ 'category':'PDF file', 'name':'xref', 'offset':int(d[0]), 'color':'lightblue' })
-
-# "trailer" keyword
-cmd = ['grep', '-P', '--text', '--color=none', '--byte-offset', '--only-matching', 'trailer', pdf ]
-result = subprocess.run(cmd, capture_output=True, text=True).stdout
-result = result.splitlines()
-for s in result:
-    d = s.split(':')
-    data.append({ 'category':'PDF file', 'name':'trailer', 'offset':int(d[0]), 'color':'lightblue' })
-
-# "startxref" keyword
-cmd = ['grep', '-P', '--text', '--color=none', '--byte-offset', '--only-matching', 'startxref', pdf ]
-result = subprocess.run(cmd, capture_output=True, text=True).stdout
-result = result.splitlines()
-num_startxrefs = len(result)
-for s in result:
-    d = s.split(':')
-    data.append({ 'category':'PDF file', 'name':'startxref', 'offset':int(d[0]), 'color':'lightblue' })
-
-# Linearization dictionary 
-cmd = ['grep', '-P', '--text', '--color=none', '--byte-offset', '--only-matching', '/Linearized', pdf ]
-result = subprocess.run(cmd, capture_output=True, text=True).stdout
-result = result.splitlines()
-if (len(result) > 1):
-    print('ERROR: more than 1 /Linearized dictionary found! Huh???')
-    exit(-1)
-is_linearized = False
-for s in result:
-    d = s.split(':')
-    data.append({ 'category':'Marker', 'name':'Linearized', 'offset':int(d[0]), 'color':'MediumPurple'})
-    is_linearized = True
-
-# PDF "%%EOF" marker
-cmd = ['grep', '-P', '--text', '--color=none', '--byte-offset', '--only-matching', '%%EOF', pdf ]
-result = subprocess.run(cmd, capture_output=True, text=True).stdout
-result = result.splitlines()
-num_eofs = len(result)
-for s in result:
-    d = s.split(':')
-    data.append({ 'category':'PDF file', 'name':'%%EOF', 'size':len('%%EOF')+1, 'offset':int(d[0]), 'color':'lightblue'})
-
-# Close the input PDF file
-in_pdf.close()
-
-# Sort everything by file byte offset. For each object, "X Y obj" will come first, then a type marker (dict, array, etc), 
-# then either XRef or ObjStm (keys in the stream extent dict), then "stream" then "endstream" (if a stream) then "endobj"
-data = sorted(data, key=lambda d: d['offset'])
-
-# Work out if the file ended correctly with a "%%EOF"
-missing_last_eof = False
-if (data[-1]['name'] != '%%EOF'):
-    missing_last_eof = True
-
-# Check physical file size in case of junk post-amble byte cavity
-if (size > (data[-1]['offset'] + len(data[-1]['name']) + 2)):
-    data.append({'category': 'PDF file', 
-                 'name': 'Cavity ' + str(cavity_count),  
-                 'offset': data[-1]['offset'] + len('%%EOF') + 1, 
-                 'size': (size - data[-1]['offset'] - len('%%EOF') - 1),
-                 'color': 'red'})
-    cavity_count = cavity_count + 1
-
-if (args.debugmode):
-    print("\n\nRaw sorted data (%d):" % len(data))
-    pp.pprint(data)
-
-if (len(data) > MAX_MARKERS) and not args.force:
-    print('Over %d markers were in the PDF file - this is too large for a Sankey diagram!' % MAX_MARKERS)
-    exit(-1)
-
-if (num_startxrefs != num_eofs) and not args.force:
-    # @todo - work out how to determine end of Linearization section
-    print('LOGIC ERROR: number of "%%EOF" (%) did not match number of "startxref" keywords - possibly hybrid reference??' % ( num_eofs, num_startxrefs) )
-    exit(-2)
-
-first_obj_in_pdf = -1
-cavities = []
-object_streams = []
-data_size = len(data)
-i = 0
-# Convert absolute file offsets to sizes, correct types for "X Y obj" and work out stream compressed/uncompressed lengths
-while (i < data_size):
-    obj_num = -1            # for "X Y obj"
-    end_last_marker = -1    # the very end of the marker + 1 - for cavity checking
-    d = data[i]
-
-    if (args.debugmode):
-        print('%5d: %s' % (i, d))
-
-    if ('%PDF-' in d['name']) or ('Cavity' in d['name']) or (d['name'] in ['trailer', 'startxref', 'xref', '%%EOF']):
-        # Work out size (if req'd) and where next object should start (cavity detection)
-        end_last_marker = d['offset'] + len(d['name']) + 1
-        if ('size' not in d):
-            data[i + 0]['size'] = end_last_marker - data[i + 0]['offset']
-        i = i + 1                             # Move to next item in data
-    elif (' obj' in d['name']):
-        # Start of an indirect object: "X Y obj"
-        if (first_obj_in_pdf < 0):
-            first_obj_in_pdf = i
-        obj_num = re.search(r'\d+', d['name']).group(0)
-        if (data[i + 1]['type'] == 'dict') and (data[i + 2]['name'] == 'XRef'):
-            assert (i + 6) < len(data)
-            assert(data[i + 3]['name'] == 'stream')
-            assert(data[i + 4]['name'] == 'endstream')
-            assert(data[i + 5]['name'] == 'endobj')
-            data[i + 0]['name'] = 'XRef stream ' + obj_num
-            data[i + 0]['type'] = 'XRef stream' # X Y obj
-            data[i + 1]['type'] = 'XRef stream' # dict
-            data[i + 2]['type'] = 'XRef stream' # XRef
-            data[i + 3]['type'] = 'XRef stream' # stream
-            data[i + 4]['type'] = 'XRef stream' # endstream
-            data[i + 5]['type'] = 'XRef stream' # endobj            
-            # Calculate compressed data length from "stream" and to after "endstream" keywords (i.e. keywords inclusive)
-            compressed_data = data[i + 4]['offset'] - data[i + 3]['offset'] + len('endstream') + 1
-            data[i + 0]['compressed'] = compressed_data
-            # Calculate the decompressed length of the stream data, including "stream" and "endstream" keywords + EOLs
-            cmd = ['qpdf', '--show-object='+obj_num, '--filtered-stream-data', pdf ]
-            result = subprocess.run(cmd, capture_output=True, timeout=TIMEOUT_SECS).stdout
-            uncompressed_data = len(result) + len('stream') + len('endstream') + 2
-            # EOLs can cause some mismatches for unfiltered streams
-            if (uncompressed_data < compressed_data):
-                uncompressed_data = compressed_data
-            data[i + 0]['uncompressed'] = uncompressed_data
-            # Work out size and where next object should start (cavity detection)
-            end_last_marker = data[i + 5]['offset'] + len('endobj') + 1
-            data[i + 0]['size'] = end_last_marker - data[i + 0]['offset']
-            i = i + 6 # Skip over: dict, XRef, stream, endstream, endobj 
-        elif (data[i + 1]['type'] == 'dict') and (data[i + 2]['name'] == 'ObjStm'):
-            # @todo Cavities are not checked for in Object Streams
-            assert (i + 6) < len(data)
-            assert(data[i + 3]['name'] == 'stream')
-            assert(data[i + 4]['name'] == 'endstream')
-            assert(data[i + 5]['name'] == 'endobj')
-            data[i + 0]['name'] = 'Object stream ' + obj_num
-            data[i + 0]['type'] = 'Object stream' # X Y obj
-            data[i + 1]['type'] = 'Object stream' # dict
-            data[i + 2]['type'] = 'Object stream' # ObjStm
-            data[i + 3]['type'] = 'Object stream' # stream
-            data[i + 4]['type'] = 'Object stream' # endstream
-            data[i + 5]['type'] = 'Object stream' # endobj            
-            # Calculate compressed data length from "stream" and to after "endstream" keywords (i.e. keywords inclusive)
-            compressed_data = data[i + 4]['offset'] - data[i + 3]['offset'] + len('endstream') + 1
-            data[i + 0]['compressed'] = compressed_data
-            # Work out size and where next object should start (cavity detection)
-            end_last_marker = data[i + 5]['offset'] + len('endobj') + 1
-            data[i + 0]['size'] = end_last_marker - data[i + 0]['offset']
-            # Get the object stream data via QPDF. First get /N and /First entries.
-            # Encrypted PDFs will have encrypted object streams so check QPDF return code
-            # @todo - add password support
-            cmd = ['qpdf', '--show-object='+str(obj_num), pdf ]
-            result = subprocess.run(cmd, capture_output=True, timeout=TIMEOUT_SECS, text=True)
-            if (result.returncode != 0):
-                print('ERROR: ', end='')
-                pp.pprint(result)
-                exit(-1)
-            result = result.stdout.splitlines()
-            m = re.search(r'(?<=/N)\s?\d+', result[1])
-            n = int(m.group(0))
-            m = re.search(r'(?<=/First)\s?\d+', result[1])
-            first = int(m.group(0))
-            # Calculate the decompressed length of the stream data, including "stream" and "endstream" keywords + EOLs
-            cmd = ['qpdf', '--show-object='+obj_num, '--filtered-stream-data', pdf ]
-            result = subprocess.run(cmd, capture_output=True, timeout=TIMEOUT_SECS).stdout
-            uncompressed_data = len(result) + len('stream') + len('endstream') + 2
-            # EOLs can cause some mismatches for unfiltered streams
-            if (uncompressed_data < compressed_data):
-                uncompressed_data = compressed_data
-            data[i + 0]['uncompressed'] = uncompressed_data
-            # Use uncompressed data to work out objects in Object stream 
-            length = len(result)
-            first_line = result[:first].decode('utf-8')
-            pairs = [int(s) for s in first_line.split() if s.isdigit()]
-            objstm = []
-            for j in range(0, (len(pairs) // 2) - 1):
-                # PDF string objects can have non-UTF-8 byte sequences so do as 2 chars rather than a string
-                c1 = chr(result[first + pairs[2*j + 1] + 0])
-                c2 = chr(result[first + pairs[2*j + 1] + 1])
-                objstm.append({'category': 'Object stream ' + str(obj_num), 
-                            'name': str(pairs[2*j]) + ' 0 obj', 
-                            'type': work_out_object_type(c1, c2),
-                            'offset': first + pairs[2*j + 1], 
-                            'size': pairs[2*j + 3] - pairs[2*j+1]})
-                if (pairs[2*j] > MAX_MARKERS) and not args.force:
-                    print('PDF object %d was in a compressed object stream - this is too large for a Sankey diagram!' % MAX_MARKERS)
-                    exit(-1)
-            c1 = chr(result[first + pairs[-1] + 0])
-            c2 = chr(result[first + pairs[-1] + 1])
-            objstm.append({'category': 'Object stream ' + str(obj_num), 
-                            'name': str(pairs[-2]) + ' 0 obj', 
-                            'offset': first + pairs[-1], 
-                            'type': work_out_object_type(c1, c2),
-                            'size': length - first - pairs[-1]})
-            if (args.debugmode):
-                print("\n\nObject stream %s (%d):" % (obj_num, len(objstm)))
-                pp.pprint(objstm)
-            object_streams.append(objstm)            
-            i = i + 6 # Skip over: dict, XRef, stream, endstream, endobj 
-        elif (data[i + 1]['type'] == 'dict') and (data[i + 2]['name'] == 'Linearized'):
-            # Linearized PDF - set category from 1st object in file to 1st '%%EOF'
-            # "X Y obj" / dict / Linearized / endobj
-            assert(data[i + 3]['name'] == 'endobj')
-            assert(is_linearized)
-            assert(first_obj_in_pdf > 0)
-            # Recategorize from top of file to end of Linearization dictionary
-            for j in range(first_obj_in_pdf, i + 4, 1):
-                data[j]['category'] = 'Linearized'
-                data[j]['color'] = 'MediumPurple'
-            # Recategorize from next object to next '%%EOF'
-            if (num_eofs > 1) or (missing_last_eof and (num_eofs == 1)):
-                j = i + 4
-                while (data[j]['name'] != '%%EOF'):
-                    data[j]['category'] = 'Linearized'
-                    data[j]['color'] = 'MediumPurple'
-                    j = j + 1
-                # Also mark "%%EOF" as part of Linearization
-                data[j]['category'] = 'Linearized'
-                data[j]['color'] = 'MediumPurple'
-            # Work out size and where next object should start (cavity detection)
-            end_last_marker = data[i + 3]['offset'] + len('endobj') + 1
-            data[i + 0]['size'] = end_last_marker - data[i + 0]['offset']
-            i = i + 4
-        elif (data[i + 1]['type'] == 'dict') and (data[i + 2]['name'] == 'stream'):
-            # Normal stream
-            assert((i + 5) < len(data))
-            assert(data[i + 3]['name'] == 'endstream')
-            assert(data[i + 4]['name'] == 'endobj')
-            data[i + 0]['type'] = 'stream' # X Y obj
-            data[i + 1]['type'] = 'stream' # dict
-            data[i + 2]['type'] = 'stream' # stream
-            data[i + 3]['type'] = 'stream' # endstream
-            data[i + 4]['type'] = 'stream' # endobj            
-            # Calculate compressed data length from "stream" and to after "endstream" keywords (i.e. keywords inclusive)
-            compressed_data = data[i + 3]['offset'] - data[i + 2]['offset'] + len('endstream') + 1
-            data[i + 0]['compressed'] = compressed_data
-            # Calculate the decompressed length of the stream data, including "stream" and "endstream" keywords + EOLs
-            cmd = ['qpdf', '--show-object='+obj_num, '--filtered-stream-data', pdf ]
-            result = subprocess.run(cmd, capture_output=True, timeout=TIMEOUT_SECS).stdout
-            uncompressed_data = len(result) + len('stream') + len('endstream') + 2
-            # EOLs can cause some mismatches for unfiltered streams
-            if (uncompressed_data < compressed_data):
-                uncompressed_data = compressed_data
-            data[i + 0]['uncompressed'] = uncompressed_data
-            # Work out size and where next object should start (cavity detection)
-            end_last_marker = data[i + 4]['offset'] + len('endobj') + 1
-            data[i + 0]['size'] = end_last_marker - data[i + 0]['offset']
-            i = i + 5 # Skip over: dict, stream, endstream, endobj 
+from pdflayout import analyze_layout, LayoutOptions, Layout, LayoutError, ANALYZER_VERSION, TIMEOUT_SECS
+from pdfbudget import TIME, DEFAULT_STREAM_BYTES, DEFAULT_TOTAL_BYTES, DEFAULT_MARKERS
+from pdfcache import ResultCache, file_hash, DEFAULT_CACHE_SIZE
+from pdfaggregate import DEFAULT_TOP_N
+from pdfscan import DEFAULT_CHUNK_SIZE
+from pdfprofile import Profile, NO_PROFILE
+from pdfestimate import DEFAULT_SAMPLES
+from pdfrevision import RevisionCache
+from pdfcorpus import CorpusTotals, load_totals, save_totals
+from pdfsource import is_url, source_size
+from pdfmanifest import Manifest, MANIFEST_NAME, COMMIT_EVERY
+from pdfwriter import FORMATS, FORMAT_EXTENSIONS, open_writer, open_output, debug_rows
+
+BATCH_CHUNKSIZE = 8     # Number of PDFs handed to a batch worker process at a time
+CORPUS_SAVE_EVERY = 1000   # Batch mode: PDFs between saves of the --corpus totals
+MB = 1024 * 1024
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--csv',   help='Output CSV filename (always overwritten, - for stdout). Batch mode: the rows of all PDFs, with a PDF column', dest="csvfile", )
+    parser.add_argument('-d', '--debug', help="Verbose debugging output of internal Python data", action='store_true', default=False, dest="debugmode")
+    parser.add_argument('-k', '--keep',  help="Keep all data markers in debug output", action='store_true', default=False, dest="dont_delete")
+    parser.add_argument('-f', '--force', help="Force processing by ignoring possible data issues", action='store_true', default=False, dest="force")
+    parser.add_argument('-p', '--pdf',   help='Input PDF filename or http(s) URL (read with range requests)', dest="pdffile")
+    parser.add_argument('-b', '--batch', help='Batch mode: directory tree of PDFs, or a text file with one PDF filename per line', dest="batch")
+    parser.add_argument('-j', '--jobs',  help='Batch mode: number of worker processes (default: number of CPUs)', type=int, default=os.cpu_count(), dest="jobs")
+    parser.add_argument('-o', '--outdir', help='Batch mode: write one Sankey CSV (or --format) file per PDF into this directory', dest="outdir")
+    parser.add_argument('-F', '--format', help="Format of -c and -o output: 'csv' (Sankey CSV, default), 'jsonl' (JSON Lines of the data dicts) or 'columnar' (JSON Lines of column batches). See pdfwriter.py", choices=FORMATS, default='csv', dest="format")
+    parser.add_argument('-r', '--results', help='Batch mode: JSON Lines result file, one record per PDF (default: stdout)', default='-', dest="results")
+    parser.add_argument('-e', '--engine', help="How objects are located: 'xref' walks the cross-reference tables/streams (falls back to 'scan' for broken files), 'scan' keyword scans the whole file (also finds unreferenced objects)", choices=['xref', 'scan'], default='xref', dest="engine")
+    parser.add_argument('-a', '--aggregate', help='Large PDFs: keep the N largest objects as Sankey nodes (default: %d) and group all others into per-type size buckets. No marker limit, ignores -k/--keep' % DEFAULT_TOP_N, nargs='?', type=int, const=DEFAULT_TOP_N, metavar='N', dest="aggregate")
+    parser.add_argument('--chunk-size', help='PDFs larger than RAM: read the file in chunks of KB kilobytes through a small bounded cache instead of memory mapping it (default: %d)' % (DEFAULT_CHUNK_SIZE // 1024), nargs='?', type=int, const=DEFAULT_CHUNK_SIZE // 1024, metavar='KB', dest="chunk_size")
+    parser.add_argument('--profile', help="Report per-phase timings and counters (markers, streams decoded, subprocesses, cavities, bytes decoded) on stderr as 'text' (default) or 'json'. Batch mode: in each result record", nargs='?', choices=['text', 'json'], const='text', dest="profile")
+    parser.add_argument('-t', '--threads', help='Streams decoded concurrently per PDF (default: number of CPUs, batch mode: 1)', type=int, dest="threads")
+    parser.add_argument('--timeout', help='Time budget in seconds for the analysis of a PDF, QPDF calls included. Streams not decoded in time are estimated (default: none, each QPDF call times out after %d seconds)' % TIMEOUT_SECS, type=float, metavar='SECS', dest="timeout")
+    parser.add_argument('--max-stream-mb', help='Budget of decoded MB per stream, larger streams are estimated (default: %d, 0: unlimited)' % (DEFAULT_STREAM_BYTES // MB), type=int, default=DEFAULT_STREAM_BYTES // MB, metavar='MB', dest="max_stream_mb")
+    parser.add_argument('--max-decoded-mb', help='Budget of decoded MB for all streams of a PDF together, the streams after are estimated (default: %d, 0: unlimited)' % (DEFAULT_TOTAL_BYTES // MB), type=int, default=DEFAULT_TOTAL_BYTES // MB, metavar='MB', dest="max_decoded_mb")
+    parser.add_argument('--max-markers', help='Budget of markers per PDF, the rest of the file is one estimated node (default: %d, 0: unlimited)' % DEFAULT_MARKERS, type=int, default=DEFAULT_MARKERS, dest="max_markers")
+    parser.add_argument('--estimate', help='Quick triage: decode only N streams per stratum of filters, /Type, /Subtype and compressed size (default: %d) and extrapolate the other uncompressed sizes, with 95%%%% confidence intervals in the CSV' % DEFAULT_SAMPLES, nargs='?', type=int, const=DEFAULT_SAMPLES, metavar='N', dest="estimate")
+    parser.add_argument('--cache', help='Directory of a content-addressed result cache (shared by batch workers)', dest="cachedir")
+    parser.add_argument('--cache-size', help='Result cache size cap in MB, least recently used results are evicted (default: %d)' % DEFAULT_CACHE_SIZE, type=int, default=DEFAULT_CACHE_SIZE, dest="cache_size")
+    parser.add_argument('--corpus', help='Add the PDF (batch mode: all PDFs) to the corpus totals in this partial-aggregate file, created if missing. See pdfcorpus.py', dest="corpus")
+    parser.add_argument('--dedup', help='SQLite index of the streams decoded (shared by batch workers, created if missing): streams seen before are not decoded again and the raw bytes of duplicate streams are reported. See pdfdedup.py', metavar='FILE', dest="dedup")
+    parser.add_argument('--password', help='User or owner password of encrypted PDFs (default: the empty user password). Revision 6 passwords are Unicode', default='', dest="password")
+    parser.add_argument('--rescan', help='Analyze the new and changed PDFs of this directory tree (in parallel, see -j) and update the manifest. Other batch mode options apply', metavar='DIR', dest="rescan")
+    parser.add_argument('--manifest', help='Rescan: SQLite manifest of the results, timings and corpus totals (default: DIR/%s). See pdfmanifest.py' % MANIFEST_NAME, dest="manifest")
+    return parser
+
+
+def layout_options(args, debugmode=False):
+    # The LayoutOptions of the command line arguments (--chunk-size is in KB). Batch mode already
+    # analyzes PDFs in parallel so it decodes the streams of each PDF one at a time by default.
+    # Budgets of 0 are unlimited.
+    threads = args.threads
+    if (threads is None):
+        threads = 1 if (args.batch is not None) or (args.rescan is not None) else os.cpu_count()
+    return LayoutOptions(force=args.force, keep=args.dont_delete, engine=args.engine, aggregate=args.aggregate,
+                         chunk_size=(args.chunk_size * 1024) if (args.chunk_size is not None) else None, debug=debugmode, timeout=args.timeout, threads=threads,
+                         max_stream_bytes=(args.max_stream_mb * MB) or None, max_decoded_bytes=(args.max_decoded_mb * MB) or None, max_markers=args.max_markers or None,
+                         estimate=args.estimate, dedup=args.dedup, password=args.password)
+
+
+def cached_analyze(pdf, cache, options, profile=NO_PROFILE):
+    # analyze_layout() with an optional ResultCache. Returns (Layout, Sankey CSV text). A cache hit
+    # skips all scanning and decompression (and has no warnings). Results that ran out of time
+    # depend on the machine and load so they are not cached. On a miss, what is left of the analysis
+    # of a previous revision of the PDF is reused (see pdfrevision.py). Results and revisions of an
+    # encrypted PDF are cached per password. URLs are not cached: hashing the contents would mean
+    # downloading all of the PDF.
+    if (cache is None) or is_url(pdf):
+        layout = analyze_layout(pdf, options, profile)
+        profile.phase('csv')
+        csv = layout.csv()
+        profile.stop()
+        return (layout, csv)
+    profile.phase('cache')
+    content_hash = file_hash(pdf)
+    cache_options = options.cache_options()
+    key = cache.key(content_hash, ANALYZER_VERSION, cache_options)
+    entry = cache.get(key)
+    if (entry is not None):
+        profile.stop()
+        profile.count('cache hits')
+        if (options.debug):
+            print('Result cache hit: %s' % cache.entry_path(key))
+        return (Layout(entry[0]), entry[1])
+    layout = analyze_layout(pdf, options, profile, RevisionCache(cache, content_hash, ANALYZER_VERSION, cache_options.get('password')))
+    profile.phase('csv')
+    csv = layout.csv()
+    if (TIME not in layout.budget_hits):
+        profile.phase('cache')
+        cache.put(key, layout.data, csv)
+    profile.stop()
+    return (layout, csv)
+
+
+def open_cache(cachedir, cache_size):
+    if (cachedir is None):
+        return None
+    return ResultCache(cachedir, cache_size * 1024 * 1024)
+
+
+def batch_pdfs(batch):
+    # Lazily yield the PDF filenames of a batch (never builds the full list for huge corpora)
+    if os.path.isdir(batch):
+        for root, dirs, files in os.walk(batch):
+            dirs.sort()
+            for f in sorted(files):
+                if f.lower().endswith('.pdf'):
+                    yield os.path.join(root, f)
+    else:
+        with open(batch, "rt") as lst:
+            for line in lst:
+                line = line.strip()
+                if (len(line) > 0):
+                    yield line
+
+
+def batch_csv_filename(pdf, batch, outdir, extension='.csv'):
+    # Mirror the PDF's path (relative to the batch directory) below outdir so CSV files never collide
+    if os.path.isdir(batch):
+        rel = os.path.relpath(pdf, batch)
+    else:
+        rel = os.path.abspath(pdf).lstrip(os.sep)
+    return os.path.join(outdir, rel + extension)
+
+
+def write_layout(layout, csv, fmt, path):
+    # Write a Layout to path ("-" for stdout) in one of pdfwriter.FORMATS. The CSV text (maybe from
+    # the result cache) is written as it is.
+    if (fmt == 'csv'):
+        out = open_output(path)
+        out.write(csv.encode('utf-8'))
+        if (out is sys.stdout.buffer):
+            out.flush()
+        else:
+            out.close()
+    else:
+        writer = open_writer(fmt, path)
+        writer.write_all(layout.data)
+        writer.close()
+
+
+def batch_worker(job):
+    # Analyze one PDF in a batch worker process. Never raises: failures become an error record.
+    pdf, batch, options, profiling, outdir, cachedir, cache_size, corpus, fmt, rows = job
+    record = { 'pdf': pdf, 'status': 'ok' }
+    profile = Profile() if profiling else NO_PROFILE
+    start = time.perf_counter()
+    try:
+        layout, csv = cached_analyze(pdf, open_cache(cachedir, cache_size), options, profile)
+        if (outdir is not None):
+            csvfile = batch_csv_filename(pdf, batch, outdir, FORMAT_EXTENSIONS[fmt])
+            os.makedirs(os.path.dirname(csvfile), exist_ok=True)
+            write_layout(layout, csv, fmt, csvfile)
+            record['csv'] = csvfile
+        elif rows:
+            # Written by the main process to the -c output (not to the result record)
+            record['rows'] = layout.data
+        else:
+            record['data'] = [list(row) for row in layout.rows()]
+        if (len(layout.warnings) > 0):
+            record['warnings'] = [w.strip() for w in layout.warnings]
+        if (len(layout.budget_hits) > 0):
+            record['estimated'] = layout.budget_hits
+        if (layout.duplicate_bytes is not None):
+            record['duplicate_bytes'] = layout.duplicate_bytes
+        if corpus:
+            # This PDF's corpus totals, merged by run_batch() (not written to the result record)
+            record['corpus'] = corpus_totals(pdf, layout).as_dict()
+    except Exception as e:
+        profile.stop()
+        record['status'] = 'error'
+        record['error'] = '%s: %s' % (type(e).__name__, str(e).strip())
+    if profiling:
+        record['profile'] = profile.as_dict()
+    record['seconds'] = round(time.perf_counter() - start, 6)
+    return record
+
+
+def run_batch(args):
+    options = layout_options(args)
+    jobs = ((pdf, args.batch, options, (args.profile is not None), args.outdir, args.cachedir, args.cache_size, (args.corpus is not None), args.format, (args.csvfile is not None))
+            for pdf in batch_pdfs(args.batch))
+    totals = load_totals(args.corpus) if (args.corpus is not None) else None
+    out = sys.stdout if (args.results == '-') else open(args.results, "wt")
+    writer = open_writer(args.format, args.csvfile, pdf_column=True) if (args.csvfile is not None) else None
+    num_ok = 0
+    num_errors = 0
+    if (args.jobs is not None) and (args.jobs > 1):
+        pool = multiprocessing.Pool(args.jobs)
+        records = pool.imap_unordered(batch_worker, jobs, chunksize=BATCH_CHUNKSIZE)
+    else:
+        pool = None
+        records = map(batch_worker, jobs)
+    for record in records:
+        if (totals is not None):
+            if ('corpus' in record):
+                totals.merge(CorpusTotals.from_dict(record.pop('corpus')))
+            else:
+                totals.add_error()
+            if ((num_ok + num_errors + 1) % CORPUS_SAVE_EVERY == 0):
+                save_totals(totals, args.corpus)
+        if ('rows' in record):
+            writer.write_all(record.pop('rows'), record['pdf'])
+        out.write(json.dumps(record) + '\n')
+        if (record['status'] == 'ok'):
+            num_ok = num_ok + 1
         else:
-            # just a basic object: number, string, array, etc. Followed by "endobj" marker
-            assert(data[i + 2]['name'] == 'endobj')
-            data[i + 0]['type'] = data[i + 1]['type']
-            # Work out size and where next object should start (cavity detection)
-            end_last_marker = data[i + 2]['offset'] + len('endobj') + 1
-            data[i + 0]['size'] = end_last_marker - data[i + 0]['offset']
-            i = i + 3 # Skip over: type, endobj
-
-        # 'i' has now been updated index to the next core marker (keyword, "X Y obj", etc.)
+            num_errors = num_errors + 1
+    if (totals is not None):
+        save_totals(totals, args.corpus)
+    if (writer is not None):
+        writer.close()
+    if (pool is not None):
+        pool.close()
+        pool.join()
+    if (out is not sys.stdout):
+        out.close()
+    print('%d PDFs analyzed: %d OK, %d errors' % (num_ok + num_errors, num_ok, num_errors), file=sys.stderr)
+
+
+def rescan_worker(job):
+    # Analyze one new or changed PDF of a rescan, unless its contents are the same as in the
+    # manifest (it was only touched or copied over). Never raises, like batch_worker().
+    pdf, size, mtime_ns, old_hash, root, options, outdir, cachedir, cache_size, fmt, rows = job
+    try:
+        content_hash = file_hash(pdf)
+    except OSError as e:
+        return { 'pdf': pdf, 'status': 'error', 'error': '%s: %s' % (type(e).__name__, str(e).strip()), 'size': size, 'mtime_ns': mtime_ns }
+    if (content_hash == old_hash):
+        return { 'pdf': pdf, 'status': 'unchanged', 'size': size, 'mtime_ns': mtime_ns }
+    record = batch_worker((pdf, root, options, True, outdir, cachedir, cache_size, True, fmt, rows))
+    record.update(size=size, mtime_ns=mtime_ns, sha256=content_hash)
+    return record
+
+
+def run_rescan(args):
+    # Stat the tree, drop the PDFs that are gone from the manifest and analyze the new and changed
+    # ones. Results are stored every COMMIT_EVERY PDFs, so an interrupted rescan keeps what it did.
+    options = layout_options(args)
+    manifest = Manifest(args.manifest or os.path.join(args.rescan, MANIFEST_NAME))
+    pending, removed, unchanged = manifest.plan(args.rescan, ANALYZER_VERSION, retry_encrypted=(args.password != ''))
+    manifest.remove(removed)
+    jobs = ((pdf, size, mtime_ns, old_hash, args.rescan, options, args.outdir, args.cachedir, args.cache_size, args.format, (args.csvfile is not None))
+            for pdf, size, mtime_ns, old_hash in pending)
+    out = sys.stdout if (args.results == '-') else open(args.results, "wt")
+    writer = open_writer(args.format, args.csvfile, pdf_column=True) if (args.csvfile is not None) else None
+    if (args.jobs is not None) and (args.jobs > 1) and (len(pending) > 1):
+        pool = multiprocessing.Pool(args.jobs)
+        records = pool.imap_unordered(rescan_worker, jobs, chunksize=BATCH_CHUNKSIZE)
     else:
-        print('LOGIC ERROR: unexpected marker at data[%d]!' % i)
-        pp.pprint(d)
-        exit(-2)
-
-    # Work out if there is a cavity between marker just checked and new marker (current 'i')
-    assert(end_last_marker > 0)
-    if (i < data_size):
-        if ((data[i]['offset'] - end_last_marker) > 3):
-            cavities.append({'category': data[i]['category'], 
-                                'name': 'Cavity ' + str(cavity_count), 
-                                'offset': end_last_marker + 1, 
-                                'size': (data[i]['offset'] - end_last_marker - 1),
-                                'color': 'red' })
-            cavity_count = cavity_count + 1
-
-# Add inter-object cavities (if any) to the sorted data and sort again by offset
-if (len(cavities) > 0):
-    if (args.debugmode):
-        print("\n\nCavities (%d):" % len(cavities))
-        pp.pprint(cavities)
-    data = data + cavities
-    data = sorted(data, key=lambda d: d['offset'])
-
-# Process for Incremental Updates by looking for "%%EOF" and allowing for Linearization
-incremental_update = 0
-for d in data:
-    if (is_linearized and (incremental_update > 1)):
-        if (d['category'] == 'PDF file'):
-            d['category'] = 'Incremental Update ' + str(incremental_update - 1)
-            d['color'] = 'PaleGreen'
-    elif (not is_linearized and (incremental_update > 0)):
-        if (d['category'] == 'PDF file'):
-            d['category'] = 'Incremental Update ' + str(incremental_update)
-            d['color'] = 'PaleGreen'
-    if (d['name'] == '%%EOF'):
-        incremental_update = incremental_update + 1
-
-if (args.debugmode):
-    print("\n\nAfter Incremental Updates:")
-    pp.pprint(data)
-
-# Extract Linearization to make it a separate Sankey node
-sum_linearization = 0
-linearize = []
-if is_linearized:
-    for d in data:
-        if (d['category'] == 'Linearized'):
-            linearize.append(copy.deepcopy(d))
-            if ('size' in d):
-                sum_linearization = sum_linearization + d['size']
-            d['category'] = 'Marker'  # 
-    # Change the first to be the node grouping. Everything else is a Marker and will be purged 
-    data[first_obj_in_pdf]['category'] = 'PDF file'
-    data[first_obj_in_pdf]['name']     = 'Linearized'
-    data[first_obj_in_pdf]['color']    = 'MediumPurple'
-    data[first_obj_in_pdf]['size']     = sum_linearization
-    # Append the Linearization
-    data = data + linearize
-    if (args.debugmode):
-        print("\n\nLinearize (%d):" % len(linearize))
-        pp.pprint(linearize)
-        print("\n\nAfter Linearization:")
-        pp.pprint(data)
-
-#####################################################
-# CAN NO LONGER SORT by file offset!!!
-# ...because we have clustered the Linearization data
-#####################################################
-
-# Append object streams after the "PDF File" categories
-for ostm in object_streams:
-    for o in ostm:
-        o['type'] = 'Compressed ' + o['type']
-        data.append(o)
-
-# Reverse iterate and delete all markers to compact data 
-# Use -k/--keep to keep everything
-if (not args.dont_delete):
-    for i in range(len(data)-1, -1, -1):
-        if data[i]['category'] in ['Marker']:
-            del data[i]
-    if (args.debugmode):
-        print('\n\nPurge done')
-
-# Cluster things by object type...
-# Each stream comprises a dictionary (from "X Y obj" up to just before "stream" + "endobj") 
-# + compressed stream data (incl. "stream" and "endstream" keywords). And we will also capture
-# the uncompressed data size. 
-cluster = []
-sum_dicts = 0
-sum_arrays = 0
-sum_numbers = 0
-sum_strings = 0
-sum_stream_dicts = 0
-sum_stream_data_compressed = 0
-sum_stream_data_uncompressed = 0
-stream_dicts = []
-compressed = []
-uncompressed = []
-cavities = []
-overhead = []
-for d in data:
-    if ('type' in d) and ('size' in d):
-        if ('dict' in d['type']):
-            cluster.append({'category':d['name'], 'name':'Dictionaries', 'size':d['size'], 'color':'wheat'})
-            sum_dicts = sum_dicts + d['size']
-        elif ('array' in d['type']):
-            cluster.append({'category':d['name'], 'name':'Arrays', 'size':d['size'], 'color':'lightcyan'})
-            sum_arrays = sum_arrays + d['size']
-        elif ('number' in d['type']):
-            cluster.append({'category':d['name'], 'name':'Numbers', 'size':d['size']})
-            sum_numbers = sum_numbers + d['size']
-        elif ('string' in d['type']):
-            cluster.append({'category':d['name'], 'name':'Strings', 'size':d['size']})
-            sum_string = sum_strings + d['size']
-        elif ('stream' in d['type']):
-            if ('compressed' in d) and ('uncompressed' in d):
-                dict_size = d['size'] - d['compressed']
-                if (dict_size < 0):
-                    dict_size = 0
-                cluster.append({'category':d['name'], 'name':'Stream dicts', 'size':dict_size, 'color':'wheat'})
-                stream_dicts.append({'category':'Stream dict ' + d['name'], 'name':'Dictionaries', 'size':dict_size, 'color':'wheat'})
-                sum_stream_dicts = sum_stream_dicts + dict_size
-                cluster.append({'category':d['name'], 'name':'Compressed ' + d['name'], 'size':d['compressed'], 'color':'MistyRose'})
-                compressed.append({'category':'Compressed ' + d['name'], 'name':'Uncompressed data', 'size':d['uncompressed'], 'color':'MistyRose'})
-                sum_stream_data_compressed   = sum_stream_data_compressed   + d['compressed']
-                sum_stream_data_uncompressed = sum_stream_data_uncompressed + d['uncompressed']
-
-    if ('Cavity' in d['name']):
-        assert('size' in d)
-        cavities.append({'category':d['name'], 'name':'Cavities', 'size':d['size'], 'color':'red'})
-    
-    if (d['name'] in ['startxref', 'trailer', 'xref', '%%EOF']) or ('%PDF-' in d['name']):
-        assert('size' in d)
-        overhead.append({'category':d['name'], 'name':'Overhead', 'size':d['size'], 'color':'lightblue'})
-
-if (args.debugmode):
-    print('\n\nClustering done')
-
-# Summarize clusters
-for o in cluster:
-    data.append(o)        
-for o in compressed:
-    data.append(o)
-for o in uncompressed:
-    data.append(o)
-for o in cavities:
-    data.append(o)
-for o in overhead:
-    data.append(o)
-if (sum_stream_dicts > 0):
-    data.append({'category':'Stream dicts', 'name':'Dictionaries', 'size':sum_stream_dicts, 'color':'wheat'})
-if ((sum_dicts > 0) or (sum_stream_dicts > 0)):
-    data.append({'category':'Dictionaries', 'name':'Objects', 'size':sum_dicts + sum_stream_dicts, 'color':'wheat'})
-if (sum_arrays > 0):
-    data.append({'category':'Arrays', 'name':'Objects', 'size':sum_arrays, 'color':'lightcyan'})
-if (sum_numbers > 0):
-    data.append({'category':'Numbers', 'name':'Objects', 'size':sum_numbers})
-if (sum_strings > 0):
-    data.append({'category':'Strings', 'name':'Objects', 'size':sum_strings})
-
-# Make the CSV file for Sankey D3 
-if (args.csvfile is not None):
-    csv = open(args.csvfile, "wt")
-    for d in data:
-        if (d['category'] != 'Marker') and ('size' in d):
-            if (args.debugmode):
-                print(d)
-            # Sankey CSV: Source, Target, Size (bytes), HTML color-name (optional)
-            s = format('%s,%s,%d' % (d['category'].strip(), d['name'].strip(), d['size']))
-            if ('color' in d):
-                s = s + ',' + d['color'].strip()
-            csv.writelines(s+'\n')
-    csv.close()
-    print('"%s" created.' % args.csvfile)
-else:
-    print("\n\nData (%d):" % len(data))
-    pp.pprint(data)
+        pool = None
+        records = map(rescan_worker, jobs)
+    statuses = { 'ok': 0, 'error': 0, 'unchanged': 0 }
+    done = []
+    for record in records:
+        statuses[record['status']] = statuses[record['status']] + 1
+        done.append(record)
+        if (len(done) == COMMIT_EVERY):
+            manifest.update(done, ANALYZER_VERSION)
+            done = []
+        if ('rows' in record):
+            writer.write_all(record.pop('rows'), record['pdf'])
+        if (record['status'] != 'unchanged'):
+            out.write(json.dumps({ k: v for k, v in record.items() if (k != 'corpus') }) + '\n')
+    manifest.update(done, ANALYZER_VERSION)
+    if (writer is not None):
+        writer.close()
+    if (pool is not None):
+        pool.close()
+        pool.join()
+    if (out is not sys.stdout):
+        out.close()
+    manifest.close()
+    print('%d PDFs analyzed: %d OK, %d errors. %d unchanged, %d removed' % (statuses['ok'] + statuses['error'], statuses['ok'], statuses['error'],
+          unchanged + statuses['unchanged'], len(removed)), file=sys.stderr)
+
+
+def corpus_totals(pdf, layout):
+    # The corpus totals of one analyzed PDF (see pdfcorpus.py)
+    totals = CorpusTotals()
+    totals.add_layout(layout.data, source_size(pdf))
+    return totals
+
+
+def print_profile(pdf, profile, fmt):
+    if (fmt == 'json'):
+        print(json.dumps(dict(profile.as_dict(), pdf=pdf)), file=sys.stderr)
+    elif (fmt == 'text'):
+        print('\nProfile of %s:' % pdf, file=sys.stderr)
+        for line in profile.report():
+            print('  ' + line, file=sys.stderr)
+
+
+def main():
+    parser = arg_parser()
+    args = parser.parse_args()
+
+    if (args.pdffile is None) and (args.batch is None) and (args.rescan is None):
+        parser.print_help()
+        exit(-1)
+
+    if ('linux' not in platform):
+        print('ERROR: only works under Linux! Needs qpdf.\n')
+        parser.print_help()
+        exit(-1)
+
+    if (args.batch is not None):
+        run_batch(args)
+        exit(0)
+
+    if (args.rescan is not None):
+        run_rescan(args)
+        exit(0)
+
+    pdf = args.pdffile              # input PDF filename
+    profile = Profile() if (args.profile is not None) else NO_PROFILE
+    info = sys.stderr if (args.csvfile == '-') else sys.stdout     # -c -: the rows alone on stdout
+    print(pdf +": ", end='', file=info)
+    try:
+        layout, csv = cached_analyze(pdf, open_cache(args.cachedir, args.cache_size), layout_options(args, args.debugmode), profile)
+    except LayoutError as e:
+        profile.stop()
+        print(e, file=info)
+        print_profile(pdf, profile, args.profile)
+        if (args.corpus is not None):
+            totals = load_totals(args.corpus)
+            totals.add_error()
+            save_totals(totals, args.corpus)
+        exit(e.exit_code)
+    if (args.corpus is not None):
+        save_totals(load_totals(args.corpus).merge(corpus_totals(pdf, layout)), args.corpus)
+    for w in layout.warnings:
+        print(w, file=info)
+    if (layout.duplicate_bytes is not None):
+        print('%d bytes of duplicate streams' % layout.duplicate_bytes, file=info)
+
+    if (args.csvfile is not None):
+        if (args.debugmode) and (args.csvfile != '-'):
+            print(csv, end='')
+        write_layout(layout, csv, args.format, args.csvfile)
+        if (args.csvfile != '-'):
+            print('"%s" created.' % args.csvfile)
+    else:
+        print("\n\nData (%d):" % len(layout.data))
+        debug_rows(layout.data)
+    print_profile(pdf, profile, args.profile)
+
+
+if __name__ == '__main__':
+    main()